@@ -3,7 +3,7 @@ from django.contrib.auth.admin import UserAdmin
 
 from .forms import CustomUserCreationForm, CustomUserChangeForm
 from .models import CustomUser, Address, Contact, Shop, Category, Product, ProductInfo, Parameter, ProductInfoParameter, \
-    Order, OrderProduct
+    Order, ShopOrder, OrderProduct, ImportJob, ImportLock
 
 
 class CustomUserAdmin(UserAdmin):
@@ -43,5 +43,8 @@ admin.site.register(ProductInfo)
 admin.site.register(Parameter)
 admin.site.register(ProductInfoParameter)
 admin.site.register(Order)
+admin.site.register(ShopOrder)
 admin.site.register(OrderProduct)
+admin.site.register(ImportJob)
+admin.site.register(ImportLock)
 admin.site.register(CustomUser, CustomUserAdmin)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class OrderingServiceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ordering_service'
+
+    def ready(self):
+        from ordering_service import best_offers, notifications, signals, streams  # noqa: F401
@@ -0,0 +1,210 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from ordering_service import catalog
+from ordering_service.models import Shop, Category, ProductInfo, Order
+from ordering_service.pagination import KeysetPagination
+from ordering_service.serializers import ShopSerializer, CategorySerializer, ProductInfoSerializer, OrderNewSerializer
+from ordering_service.streams import event_stream, get_broker
+from ordering_service.views import ProductInfoViewSet, with_order_details
+
+# связанные объекты, которые нужны ProductInfoSerializer: в асинхронном коде они загружаются заранее
+PRODUCT_INFO_PREFETCH = ['product_info_parameters__parameter']
+
+
+async def authenticate(request):
+    """
+    Пользователь по заголовку "Authorization: Token <ключ>", как в TokenAuthentication
+    """
+    keyword, _separator, key = request.headers.get('Authorization', '').partition(' ')
+    if keyword != 'Token':
+        return None
+    if not key.strip():
+        raise exceptions.AuthenticationFailed(_('Invalid token header. No credentials provided.'))
+    try:
+        token = await Token.objects.select_related('user').aget(key=key.strip())
+    except Token.DoesNotExist:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+    return token.user
+
+
+async def check_throttles(request):
+    """
+    Те же ограничения частоты запросов (DEFAULT_THROTTLE_CLASSES), что у представлений DRF,
+    с той же историей запросов в кэше, но через асинхронный интерфейс кэша
+    """
+    for throttle in [throttle_class() for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES]:
+        key = throttle.get_cache_key(request, None)
+        if key is None:
+            continue
+        throttle.now = throttle.timer()
+        throttle.history = [moment for moment in await throttle.cache.aget(key, [])
+                            if moment > throttle.now - throttle.duration]
+        if len(throttle.history) >= throttle.num_requests:
+            raise exceptions.Throttled(throttle.wait())
+        await throttle.cache.aset(key, [throttle.now] + throttle.history, throttle.duration)
+
+
+def api_response(data, status=200, headers=None):
+    return JsonResponse(data, status=status, headers=headers, safe=False, encoder=JSONEncoder,
+                        json_dumps_params={'ensure_ascii': False})
+
+
+def error_response(exc):
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    headers = {}
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        headers['WWW-Authenticate'] = 'Token'
+    if getattr(exc, 'wait', None):
+        headers['Retry-After'] = str(int(exc.wait))
+    return api_response(data, exc.status_code, headers)
+
+
+def api_view(authentication_required=False):
+    """
+    Асинхронное представление с проверками, как у APIView: аутентификация по токену, ограничение
+    частоты запросов. Исключения DRF превращаются в JSON-ответ с тем же статусом.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                request.user = await authenticate(request) or AnonymousUser()
+                if authentication_required and not request.user.is_authenticated:
+                    raise exceptions.NotAuthenticated()
+                await check_throttles(request)
+                return await view(request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                return error_response(exc)
+        return wrapper
+    return decorator
+
+
+def read_view(async_view, view):
+    """
+    Одно представление на URL: GET обрабатывает асинхронное представление, остальные методы - обычное
+    представление DRF в потоке. Подключается в urls.py при ASYNC_READ_VIEWS.
+    """
+    sync_view = sync_to_async(view)
+
+    async def dispatch(request, *args, **kwargs):
+        if request.method == 'GET':
+            return await async_view(request, *args, **kwargs)
+        return await sync_view(request, *args, **kwargs)
+    dispatch.csrf_exempt = True
+    return dispatch
+
+
+def api_request(request):
+    """
+    Request DRF поверх запроса асинхронного представления: query_params для фильтров и пагинации
+    """
+    drf_request = Request(request)
+    drf_request.user = request.user
+    return drf_request
+
+
+@api_view()
+async def shop_list(request):
+    """
+    Список магазинов
+    """
+    shops = [shop async for shop in Shop.objects.all().aiterator()]
+    return api_response(ShopSerializer(shops, many=True).data)
+
+
+@api_view()
+async def category_list(request):
+    """
+    Список категорий с магазинами
+    """
+    categories = [category async for category in Category.objects.prefetch_related('shops')]
+    return api_response(CategorySerializer(categories, many=True).data)
+
+
+@api_view()
+async def product_info_list(request):
+    """
+    Список карточек из кэша каталога (тот же ключ и те же данные, что у ProductInfoViewSet.list).
+    При промахе фильтры применяются в потоке (django-filter проверяет значения запросами к базе),
+    а страница читается асинхронным ORM.
+    """
+    async def compute():
+        view = ProductInfoViewSet(request=api_request(request), format_kwarg=None, action='list', args=(), kwargs={})
+        queryset = await sync_to_async(view.filter_queryset)(view.get_queryset())
+        page = await view.paginator.apaginate_queryset(queryset.prefetch_related(*PRODUCT_INFO_PREFETCH),
+                                                       view.request, view=view)
+        return view.paginator.get_paginated_response(view.get_serializer(page, many=True).data).data
+
+    data, hit = await catalog.acached_data(await catalog.alist_key(request.GET), compute)
+    return api_response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
+
+@api_view()
+async def product_info_detail(request, pk):
+    """
+    Карточка товара из кэша каталога. Права доступа (IsShopOwner) проверяются до обращения к кэшу
+    """
+    queryset = ProductInfo.objects.filter(is_active=True)
+    try:
+        instance = await queryset.select_related('shop').aget(pk=pk)
+    except (ProductInfo.DoesNotExist, TypeError, ValueError, ValidationError):
+        raise exceptions.NotFound()
+    if instance.shop.user_id != request.user.id:
+        if not request.user.is_authenticated:
+            raise exceptions.NotAuthenticated()
+        raise exceptions.PermissionDenied()
+
+    async def compute():
+        product_info = await queryset.prefetch_related(*PRODUCT_INFO_PREFETCH).aget(pk=instance.pk)
+        return ProductInfoSerializer(product_info).data
+
+    data, hit = await catalog.acached_data(await catalog.adetail_key(instance), compute)
+    return api_response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
+
+@api_view(authentication_required=True)
+async def order_list(request):
+    """
+    Список заказов пользователя
+    """
+    orders = with_order_details(Order.objects.filter(user=request.user).exclude(status='basket'))
+    paginator = KeysetPagination()
+    page = await paginator.apaginate_queryset(orders, api_request(request))
+    return api_response(paginator.get_paginated_response(OrderNewSerializer(page, many=True).data).data)
+
+
+@api_view(authentication_required=True)
+async def order_events(request):
+    """
+    Поток событий о новых заказах и изменениях статусов для магазинов поставщика (server-sent events).
+    Продолжить с места обрыва можно заголовком Last-Event-ID или параметром ?last_event_id=
+    """
+    if request.user.type != 'shop':
+        raise exceptions.PermissionDenied('У вас недостаточно прав!')
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    if last_event_id is not None:
+        if not last_event_id.isdigit():
+            raise exceptions.ValidationError({'last_event_id': 'Ожидается номер события'})
+        last_event_id = int(last_event_id)
+
+    # без настроенного брокера запрос завершается ошибкой, а не пустым потоком
+    get_broker()
+    shop_ids = [shop_id async for shop_id in Shop.objects.filter(user=request.user).values_list('id', flat=True)]
+    response = StreamingHttpResponse(event_stream(shop_ids, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
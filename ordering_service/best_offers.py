@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, Window
+from django.db.models.functions import RowNumber
+
+from ordering_service import outbox
+from ordering_service.importer import chunked
+from ordering_service.models import BestOffer, ProductInfo, StockBucket
+
+# сколько товаров пересчитывается одним запросом
+REFRESH_BATCH_SIZE = 1000
+# сколько товаров можно запросить у product/best_offers/ за раз
+MAX_PRODUCTS = 100
+
+
+def ranked_offers(product_ids):
+    """
+    Лучшие предложения товаров: активные карточки открытых магазинов с остатком (в карточке
+    или в ячейках горячего товара), по BEST_OFFERS_SIZE самых дешевых на товар
+    """
+    in_stock = Q(quantity__gt=0) | Exists(StockBucket.objects.filter(product_info=OuterRef('pk'), quantity__gt=0))
+    return ProductInfo.objects.filter(in_stock, product_id__in=product_ids, is_active=True, shop__state=True).annotate(
+        rank=Window(RowNumber(), partition_by=F('product_id'), order_by=[F('price').asc(), F('id').asc()])
+    ).filter(rank__lte=settings.BEST_OFFERS_SIZE).values_list('product_id', 'rank', 'id', 'shop_id', 'price')
+
+
+def refresh(product_ids):
+    """
+    Пересчет индекса для товаров product_ids: строки товара заменяются целиком в одной транзакции,
+    так что читатели видят либо прежний, либо новый список
+    """
+    for chunk in chunked(sorted(set(product_ids)), REFRESH_BATCH_SIZE):
+        offers = [BestOffer(product_id=product_id, rank=rank, product_info_id=product_info_id, shop_id=shop_id,
+                            price=price)
+                  for product_id, rank, product_info_id, shop_id, price in ranked_offers(chunk)]
+        with transaction.atomic():
+            BestOffer.objects.filter(product_id__in=chunk).delete()
+            BestOffer.objects.bulk_create(offers)
+
+
+def offer_products(product_info_ids):
+    """
+    Товары, которые затрагивает изменение карточек: их товары и товары, в чьих списках карточки уже стоят
+    """
+    product_ids = set(ProductInfo.objects.filter(id__in=product_info_ids).values_list('product_id', flat=True))
+    product_ids.update(BestOffer.objects.filter(product_info_id__in=product_info_ids).values_list('product_id',
+                                                                                                  flat=True))
+    return product_ids
+
+
+def refresh_offers(product_info_ids):
+    """
+    Пересчет после изменения карточек
+    """
+    refresh(offer_products(product_info_ids))
+
+
+def refresh_shops(shop_ids):
+    """
+    Пересчет после импорта прайс-листа или смены состояния магазина: все товары магазинов
+    """
+    product_ids = set(ProductInfo.objects.filter(shop_id__in=shop_ids).values_list('product_id', flat=True))
+    product_ids.update(BestOffer.objects.filter(shop_id__in=shop_ids).values_list('product_id', flat=True))
+    refresh(product_ids)
+
+
+@outbox.handler(outbox.SHOP_STATE_CHANGED)
+def shop_state_changed(events):
+    """
+    Магазин открылся или закрылся: товаров у магазина может быть много, поэтому пересчет идет
+    в обработчике событий outbox, а не в запросе
+    """
+    refresh_shops({event['payload']['shop_id'] for event in events})
+
+
+@outbox.handler(outbox.OFFERS_CHANGED)
+def offers_changed(events):
+    """
+    Изменились цены или остатки карточек. Пересчет идет в обработчике событий outbox, а не после
+    фиксации транзакции в запросе: ошибка пересчета не превращает уже оформленный заказ в ответ 500
+    """
+    product_info_ids = {offer_id for event in events for offer_id in event['payload']['product_info_ids']}
+    product_ids = {product_id for event in events for product_id in event['payload']['product_ids']}
+    refresh(product_ids | offer_products(product_info_ids))
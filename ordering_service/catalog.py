@@ -0,0 +1,163 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+
+GLOBAL_VERSION_KEY = 'catalog:version'
+# версии индекса параметров: меняются только при изменении параметров и состава карточек, а не остатков
+FACETS_VERSION_KEY = 'catalog:facets:version'
+STATS_KEYS = {'hits': 'catalog:stats:hits', 'misses': 'catalog:stats:misses'}
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def shop_version_key(shop_id):
+    return f'catalog:version:shop:{shop_id}'
+
+
+def facets_version_key(shop_id):
+    return f'catalog:facets:version:shop:{shop_id}'
+
+
+def get_version(key):
+    return get_versions([key])[0]
+
+
+def get_versions(keys):
+    """
+    Текущие значения счетчиков версий. Новый (или вытесненный из кэша) счетчик начинается
+    с текущего времени, чтобы не совпасть ни с одной из прежних версий.
+    Счетчики хранятся в том же кэше, что и ответы: увеличение версии в одном процессе (например,
+    импортом в Celery) видно другим процессам, только если кэш общий (CATALOG_CACHE_URL).
+    """
+    cache = get_cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(shop_ids):
+    """
+    Сброс закэшированных ответов каталога: увеличиваются общий счетчик и счетчики магазинов.
+    Старые записи не удаляются, а перестают находиться и вытесняются по таймауту.
+    """
+    bump_keys([GLOBAL_VERSION_KEY] + [shop_version_key(shop_id) for shop_id in set(shop_ids) if shop_id])
+
+
+def bump_facet_versions(shop_ids):
+    """
+    Перечитывание индекса параметров для магазинов shop_ids во всех процессах
+    """
+    bump_keys([FACETS_VERSION_KEY] + [facets_version_key(shop_id) for shop_id in set(shop_ids) if shop_id])
+
+
+def bump_keys(keys):
+    cache = get_cache()
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def list_key(query_params, prefix='list'):
+    """
+    Ключ ответа со списком карточек. Список одного магазина (?shop=) зависит только от версии
+    этого магазина, остальные списки - от общей версии.
+    """
+    return f'catalog:{prefix}:{get_version(list_version_key(query_params))}:{params_digest(query_params)}'
+
+
+def list_version_key(query_params):
+    shop_id = query_params.get('shop', '')
+    return shop_version_key(shop_id) if shop_id.isdigit() else GLOBAL_VERSION_KEY
+
+
+def params_digest(query_params):
+    params = urlencode(sorted((name, value) for name, values in query_params.lists() for value in values))
+    return hashlib.sha1(params.encode()).hexdigest()
+
+
+def detail_key(product_info):
+    return f'catalog:detail:{get_version(shop_version_key(product_info.shop_id))}:{product_info.pk}'
+
+
+def cached_data(key, compute):
+    """
+    Данные ответа из кэша, а при промахе - результат compute(), который сохраняется в кэш.
+    Возвращает пару (данные, попадание в кэш).
+    """
+    cache = get_cache()
+    data = cache.get(key)
+    hit = data is not None
+    if not hit:
+        data = compute()
+        cache.set(key, data, settings.CATALOG_CACHE_TIMEOUT)
+    count(hit)
+    return data, hit
+
+
+def count(hit):
+    cache = get_cache()
+    key = STATS_KEYS['hits' if hit else 'misses']
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+async def aget_version(key):
+    """
+    get_version для асинхронных представлений: обращения к кэшу через его асинхронный интерфейс
+    """
+    cache = get_cache()
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+async def alist_key(query_params, prefix='list'):
+    return f'catalog:{prefix}:{await aget_version(list_version_key(query_params))}:{params_digest(query_params)}'
+
+
+async def adetail_key(product_info):
+    return f'catalog:detail:{await aget_version(shop_version_key(product_info.shop_id))}:{product_info.pk}'
+
+
+async def acached_data(key, compute):
+    """
+    cached_data для асинхронных представлений, compute - корутинная функция
+    """
+    cache = get_cache()
+    data = await cache.aget(key)
+    hit = data is not None
+    if not hit:
+        data = await compute()
+        await cache.aset(key, data, settings.CATALOG_CACHE_TIMEOUT)
+    await acount(hit)
+    return data, hit
+
+
+async def acount(hit):
+    cache = get_cache()
+    key = STATS_KEYS['hits' if hit else 'misses']
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        if not await cache.aadd(key, 1, timeout=None):
+            await cache.aincr(key)
+
+
+def stats():
+    values = get_cache().get_many(STATS_KEYS.values())
+    return {name: values.get(key, 0) for name, key in STATS_KEYS.items()}
@@ -0,0 +1,144 @@
+import re
+import threading
+
+from rest_framework.exceptions import ValidationError
+
+from ordering_service import catalog
+from ordering_service.models import Shop, ProductInfoParameter
+from ordering_service.units import parse_numeric
+
+PARAMETER_QUERY = re.compile(r'^param\[(.+?)\](?:\[(gte|gt|lte|lt)\])?$')
+
+
+def parameter_filters(query_params):
+    """
+    Фильтры по значениям параметров из запроса вида ?param[Цвет]=черный&param[Цвет]=белый: {название: [значения]}
+    """
+    filters = {}
+    for key, values in query_params.lists():
+        match = PARAMETER_QUERY.match(key)
+        if match and not match.group(2) and values:
+            filters.setdefault(match.group(1), []).extend(values)
+    return filters
+
+
+def parameter_ranges(query_params):
+    """
+    Диапазоны числовых параметров из запроса вида ?param[Диагональ (дюйм)][gte]=6: {название: {операция: число}}.
+    Числа можно писать с единицами измерения, они приводятся так же, как значения при импорте.
+    """
+    ranges = {}
+    for key, value in query_params.items():
+        match = PARAMETER_QUERY.match(key)
+        if match and match.group(2):
+            number = parse_numeric(value, match.group(1))
+            if number is None:
+                raise ValidationError({key: 'Ожидается число'})
+            ranges.setdefault(match.group(1), {})[match.group(2)] = number
+    return ranges
+
+
+def to_bitset(ids):
+    bits = bytearray()
+    for offer_id in ids:
+        byte = offer_id >> 3
+        if byte >= len(bits):
+            bits.extend(bytes(byte - len(bits) + 1))
+        bits[byte] |= 1 << (offer_id & 7)
+    return int.from_bytes(bits, 'little')
+
+
+class FacetIndex:
+    """
+    Обратный индекс параметров карточек: (параметр, значение) -> битовое множество id карточек (int).
+    Индекс общий для процесса и обновляется по магазинам: если общий счетчик версий индекса
+    изменился, сравниваются счетчики магазинов и перечитываются параметры только тех магазинов,
+    у которых изменились параметры или состав карточек (например, после импорта). Изменение остатков
+    и цен счетчики индекса не меняет. Фильтры по значениям применяются пересечением битовых множеств,
+    а количество карточек выборки с каждым значением - число единиц в пересечении выборки
+    с множеством значения, без GROUP BY по таблице параметров и без обхода карточек выборки.
+    """
+
+    def __init__(self):
+        self._bits = {}
+        self._shop_offers = {}
+        self._versions = {}
+        self._global_version = None
+        self._lock = threading.Lock()
+
+    def sync(self):
+        # общий счетчик увеличивается при любом изменении параметров, поэтому без изменений хватает одного чтения
+        # из кэша; он читается раньше счетчиков магазинов, чтобы изменение между чтениями не потерялось
+        global_version = catalog.get_version(catalog.FACETS_VERSION_KEY)
+        if global_version == self._global_version:
+            return
+        shop_ids = list(Shop.objects.values_list('id', flat=True))
+        versions = dict(zip(shop_ids, catalog.get_versions([catalog.facets_version_key(shop_id)
+                                                            for shop_id in shop_ids])))
+        with self._lock:
+            stale = [shop_id for shop_id in set(self._shop_offers) | set(versions)
+                     if self._global_version is None or self._versions.get(shop_id) != versions.get(shop_id)]
+            if stale:
+                self._reload(stale)
+                self._versions.update({shop_id: versions.get(shop_id) for shop_id in stale})
+            self._global_version = global_version
+
+    def counts(self, offer_ids, filters):
+        """
+        Количество карточек из offer_ids для каждого значения каждого параметра с учетом фильтров filters.
+        Для параметра, по которому задан фильтр, считается без учета его собственного фильтра,
+        чтобы были видны остальные значения, которые можно выбрать.
+        """
+        self.sync()
+        base = to_bitset(offer_ids)
+        with self._lock:
+            masks = {name: self._union(name, values) for name, values in filters.items()}
+            selected = self._intersect(base, masks.values())
+            scopes = {name: self._intersect(base, [mask for other, mask in masks.items() if other != name])
+                      for name in masks}
+            facets = {}
+            for (name, value), bits in self._bits.items():
+                count = (scopes.get(name, selected) & bits).bit_count()
+                if count:
+                    facets.setdefault(name, {})[value] = count
+        return selected.bit_count(), facets
+
+    def _intersect(self, bitset, masks):
+        for mask in masks:
+            bitset &= mask
+        return bitset
+
+    def _union(self, name, values):
+        mask = 0
+        for value in values:
+            mask |= self._bits.get((name, value), 0)
+        return mask
+
+    def _reload(self, shop_ids):
+        offers, shop_offers = {}, {}
+        rows = ProductInfoParameter.objects.filter(product_info__shop_id__in=shop_ids).values_list(
+            'product_info_id', 'product_info__shop_id', 'parameter__name', 'value'
+        )
+        for offer_id, shop_id, name, value in rows.iterator():
+            offers.setdefault((name, value), []).append(offer_id)
+            shop_offers.setdefault(shop_id, []).append(offer_id)
+        shop_offers = {shop_id: to_bitset(ids) for shop_id, ids in shop_offers.items()}
+
+        # карточки магазинов и перечитанные карточки (в том числе перешедшие из другого магазина) убираются из индекса
+        loaded = 0
+        for bits in shop_offers.values():
+            loaded |= bits
+        cleared = loaded
+        for shop_id in shop_ids:
+            cleared |= self._shop_offers.pop(shop_id, 0)
+        keep = ~cleared
+        self._shop_offers = {shop_id: bits & ~loaded for shop_id, bits in self._shop_offers.items()}
+        self._shop_offers.update(shop_offers)
+
+        bits = {key: value_bits & keep for key, value_bits in self._bits.items()}
+        for key, ids in offers.items():
+            bits[key] = bits.get(key, 0) | to_bitset(ids)
+        self._bits = {key: value_bits for key, value_bits in bits.items() if value_bits}
+
+
+facet_index = FacetIndex()
@@ -0,0 +1,137 @@
+import hashlib
+import http.client
+import ipaddress
+import os
+import socket
+import urllib.error
+import urllib.request
+import uuid
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+from ordering_service.readers import detect_format
+
+FEED_SCHEMES = {'http', 'https'}
+
+
+class FeedError(ValueError):
+    """
+    Ссылка на прайс-лист недопустима или ответ слишком большой
+    """
+
+
+def check_address(host):
+    """
+    Запрет обращений к внутренним адресам (loopback, частные сети, link-local, зарезервированные)
+    """
+    if settings.PRICE_LIST_ALLOW_PRIVATE_HOSTS:
+        return
+    address = ipaddress.ip_address(host.split('%')[0])
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    if not address.is_global or address.is_multicast:
+        raise FeedError(f'Адрес {address} недоступен для загрузки прайс-листа')
+
+
+def check_url(url):
+    """
+    Проверка ссылки на прайс-лист: только http(s), а все адреса хоста - внешние
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in FEED_SCHEMES or not parsed.hostname:
+        raise FeedError('Ссылка на прайс-лист должна начинаться с http:// или https://')
+    try:
+        addresses = socket.getaddrinfo(parsed.hostname, parsed.port or parsed.scheme, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise FeedError(f'Не удалось определить адрес {parsed.hostname}')
+    for *_, sockaddr in addresses:
+        check_address(sockaddr[0])
+
+
+class CheckedHTTPConnection(http.client.HTTPConnection):
+    # адрес проверяется после соединения, поэтому его нельзя подменить повторным ответом DNS или перенаправлением
+    def connect(self):
+        super().connect()
+        try:
+            check_address(self.sock.getpeername()[0])
+        except FeedError:
+            self.close()
+            raise
+
+
+class CheckedHTTPSConnection(CheckedHTTPConnection, http.client.HTTPSConnection):
+    pass
+
+
+class CheckedHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, request):
+        return self.do_open(CheckedHTTPConnection, request)
+
+
+class CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, request):
+        return self.do_open(CheckedHTTPSConnection, request, context=self._context)
+
+
+def build_opener():
+    # без обработчиков file:, ftp: и data:, чтобы перенаправление не увело загрузку на другие схемы
+    opener = urllib.request.OpenerDirector()
+    for handler in (CheckedHTTPHandler, CheckedHTTPSHandler, urllib.request.HTTPDefaultErrorHandler,
+                    urllib.request.HTTPRedirectHandler, urllib.request.HTTPErrorProcessor):
+        opener.add_handler(handler())
+    return opener
+
+
+def fetch_price_list(shop, directory):
+    """
+    Условная загрузка прайс-листа магазина по ссылке Shop.url.
+    Формат определяется по Content-Type ответа, имени файла Shop.filename или пути в ссылке.
+    Отправляет If-None-Match / If-Modified-Since и сравнивает хэш содержимого с предыдущей загрузкой,
+    файл сохраняется только если прайс-лист действительно изменился.
+    Загружаются только ссылки http(s) на внешние адреса, ответ больше PRICE_LIST_MAX_SIZE байт отклоняется.
+    Функция не обращается к базе, поэтому её можно вызывать из нескольких потоков.
+    """
+    check_url(shop.url)
+    request = urllib.request.Request(shop.url)
+    if shop.feed_etag:
+        request.add_header('If-None-Match', shop.feed_etag)
+    if shop.feed_last_modified:
+        request.add_header('If-Modified-Since', shop.feed_last_modified)
+
+    try:
+        response = build_opener().open(request, timeout=settings.PRICE_LIST_PULL_TIMEOUT)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return {'shop': shop, 'state': 'not_modified'}
+        raise
+
+    if int(response.headers.get('Content-Length') or 0) > settings.PRICE_LIST_MAX_SIZE:
+        response.close()
+        raise FeedError(f'Прайс-лист больше {settings.PRICE_LIST_MAX_SIZE} байт')
+
+    price_list_format = detect_format(shop.filename or urlparse(shop.url).path,
+                                      response.headers.get('Content-Type')) or 'yaml'
+    digest = hashlib.sha256()
+    path = os.path.join(directory, f'{uuid.uuid4()}.{price_list_format}')
+    size = 0
+    with response, open(path, 'wb') as destination:
+        for block in iter(lambda: response.read(64 * 1024), b''):
+            size += len(block)
+            if size > settings.PRICE_LIST_MAX_SIZE:
+                break
+            digest.update(block)
+            destination.write(block)
+    if size > settings.PRICE_LIST_MAX_SIZE:
+        os.remove(path)
+        raise FeedError(f'Прайс-лист больше {settings.PRICE_LIST_MAX_SIZE} байт')
+
+    feed = {
+        'etag': response.headers.get('ETag', ''),
+        'last_modified': response.headers.get('Last-Modified', ''),
+        'hash': digest.hexdigest(),
+    }
+    if feed['hash'] == shop.feed_hash:
+        os.remove(path)
+        return {'shop': shop, 'state': 'unchanged', 'feed': feed}
+    return {'shop': shop, 'state': 'changed', 'feed': feed, 'file': path, 'format': price_list_format}
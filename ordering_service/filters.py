@@ -0,0 +1,86 @@
+from functools import reduce
+from operator import or_
+
+from django.db import connections
+from django.db.models import Q
+from rest_framework.filters import BaseFilterBackend, SearchFilter
+
+from ordering_service.facets import parameter_filters, parameter_ranges
+from ordering_service.models import ProductInfoParameter
+from ordering_service.names import parameter_ids
+
+# триграммный индекс находит только подстроки длиной от трех символов
+MIN_INDEXED_TERM_LENGTH = 3
+
+
+def fts_query(terms):
+    """
+    Запрос FTS5: каждое слово ищется как подстрока, в карточке должны встретиться все слова
+    """
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+class CatalogSearchFilter(SearchFilter):
+    """
+    Поиск ?search= по карточкам товаров с использованием индекса и сортировкой по релевантности.
+    Запрос выполняется по таблице ProductInfoSearch: на SQLite это таблица FTS5, на PostgreSQL - таблица
+    с документом (название товара и модель в верхнем регистре) под триграммным GIN-индексом, условия LIKE
+    по документу обслуживает индекс, а релевантность считается через pg_trgm.
+    Слова короче трех символов ищутся через LIKE среди найденных по индексу карточек,
+    запросы только из коротких слов и остальные базы обрабатываются обычным SearchFilter.
+    Явная сортировка ?ordering= имеет приоритет над релевантностью.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        indexed = [term for term in terms if len(term) >= MIN_INDEXED_TERM_LENGTH]
+        vendor = connections[queryset.db].vendor
+        if not indexed or vendor not in ('sqlite', 'postgresql'):
+            return super().filter_queryset(request, queryset, view)
+
+        if vendor == 'sqlite':
+            queryset = queryset.filter(search_index__document__match=fts_query(indexed))
+        else:
+            queryset = queryset.filter(*[Q(search_index__document__contains=term.upper()) for term in indexed])
+        lookups = [f'{field}__icontains' for field in self.get_search_fields(view, request)]
+        for term in terms:
+            if len(term) < MIN_INDEXED_TERM_LENGTH:
+                queryset = queryset.filter(reduce(or_, [Q(**{lookup: term}) for lookup in lookups]))
+        if vendor == 'sqlite':
+            return queryset.order_by('search_index__rank')
+        return self.rank_by_similarity(queryset, indexed)
+
+    def rank_by_similarity(self, queryset, terms):
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        rank = TrigramSimilarity('search_index__document', ' '.join(terms).upper())
+        return queryset.annotate(search_rank=rank).order_by('-search_rank')
+
+
+class ParameterFilter(BaseFilterBackend):
+    """
+    Фильтр карточек по параметрам: ?param[Цвет]=черный&param[Память (Гб)]=256.
+    Несколько значений одного параметра объединяются через ИЛИ, разные параметры - через И.
+    Числовые параметры фильтруются по диапазону: ?param[Диагональ (дюйм)][gte]=6&param[Диагональ (дюйм)][lte]=6.5,
+    условие выполняется по индексу (parameter, numeric_value).
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        for name, values in parameter_filters(request.query_params).items():
+            queryset = self.filter_parameter(queryset, name, value__in=values)
+        return self.filter_ranges(request, queryset)
+
+    def filter_ranges(self, request, queryset):
+        for name, bounds in parameter_ranges(request.query_params).items():
+            queryset = self.filter_parameter(queryset, name, **{
+                f'numeric_value__{operation}': number for operation, number in bounds.items()
+            })
+        return queryset
+
+    def filter_parameter(self, queryset, name, **conditions):
+        parameter_id = parameter_ids.find(name)
+        if parameter_id is None:
+            return queryset.none()
+        return queryset.filter(id__in=ProductInfoParameter.objects.filter(
+            parameter_id=parameter_id, **conditions
+        ).values('product_info_id'))
@@ -0,0 +1,278 @@
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+
+from ordering_service.models import (
+    Shop,
+    Category,
+    Product,
+    ProductInfo,
+    ProductInfoParameter,
+    StockBucket
+)
+from ordering_service.names import category_ids, parameter_ids
+from ordering_service.units import parse_numeric
+
+OFFER_FIELDS = ['product', 'model', 'quantity', 'price', 'price_rrc', 'external_id', 'is_active']
+
+
+def chunked(iterable, size):
+    """
+    Разбиение последовательности на списки фиксированного размера
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class GoodsImporter:
+    """
+    Пакетный импорт прайс-листа поставщика.
+    Существующие записи ищутся одним запросом на пачку товаров, новые создаются через bulk_create,
+    поэтому число запросов зависит от количества пачек, а не от количества товаров.
+
+    Карточки товаров сопоставляются по паре (магазин, артикул поставщика): изменившиеся обновляются,
+    неизменившиеся не трогаются, отсутствующие в файле снимаются с продажи.
+    Количество из прайс-листа - весь остаток карточки, поэтому у горячих товаров ячейки StockBucket обнуляются.
+    В режиме dry_run считается только разница, без записи в базу.
+    """
+
+    def __init__(self, user, batch_size=None, dry_run=False):
+        self.user = user
+        self.batch_size = batch_size or settings.GOODS_IMPORT_BATCH_SIZE
+        self.dry_run = dry_run
+        self.shop = None
+        self.categories = {}
+        self.category_names = {}
+        self.stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'removed': 0}
+        self._seen = set()
+        self._has_legacy_offers = False
+
+    def import_shop(self, name):
+        if self.dry_run:
+            self.shop = Shop.objects.filter(name=name, user_id=self.user.id).first()
+        else:
+            self.shop, _ = Shop.objects.get_or_create(name=name, user_id=self.user.id)
+        if self.shop is not None:
+            self._has_legacy_offers = self.shop.products_info.filter(external_id__isnull=True).exists()
+        return self.shop
+
+    def import_categories(self, categories_data):
+        self.category_names = {category_data['id']: category_data['name'] for category_data in categories_data}
+        if self.dry_run:
+            return
+
+        existing = category_ids.get_many(self.category_names.values(), user_id=self.user.id)
+        for category_id, name in self.category_names.items():
+            self.categories[category_id] = existing[name]
+
+        shop_categories = Category.shops.through
+        shop_categories.objects.bulk_create(
+            [shop_categories(shop_id=self.shop.id, category_id=category_id) for category_id in existing.values()],
+            ignore_conflicts=True
+        )
+
+    def import_goods(self, goods):
+        for chunk in chunked(goods, self.batch_size):
+            self.import_chunk(chunk)
+
+    def import_chunk(self, goods):
+        goods = list({product_data['id']: product_data for product_data in goods}.values())
+        offers = self._load_offers(goods)
+
+        inserted, updated = [], []
+        for product_data in goods:
+            self._seen.add(product_data['id'])
+            offer = offers.get(product_data['id'])
+            if offer is None:
+                inserted.append(product_data)
+            elif self._is_changed(offer, product_data):
+                updated.append((offer, product_data))
+            else:
+                self.stats['unchanged'] += 1
+        self.stats['inserted'] += len(inserted)
+        self.stats['updated'] += len(updated)
+
+        if self.dry_run or not (inserted or updated):
+            return
+        changed_goods = inserted + [product_data for _, product_data in updated]
+        products = self._resolve_products(changed_goods)
+        product_infos = self._write_offers(inserted, updated, products)
+        self._import_parameters(changed_goods, product_infos)
+        self._delete_stale_parameters(updated)
+
+    def finish(self):
+        """
+        Снятие с продажи карточек, которых нет в загруженном прайс-листе
+        """
+        if self.shop is None:
+            return self.stats
+        active = ProductInfo.objects.filter(shop=self.shop, is_active=True).values_list('id', 'external_id')
+        missing = [product_info_id for product_info_id, external_id in active if external_id not in self._seen]
+        self.stats['removed'] = len(missing)
+        if not self.dry_run:
+            for ids in chunked(missing, self.batch_size):
+                ProductInfo.objects.filter(id__in=ids).update(is_active=False)
+        return self.stats
+
+    def run(self, price_list):
+        with transaction.atomic():
+            self.import_shop(price_list.shop)
+            self.import_categories(price_list.categories)
+            self.import_goods(price_list.goods())
+            return self.finish()
+
+    def run_in_chunks(self, price_list, progress=None):
+        """
+        Импорт с фиксацией транзакции после каждой пачки товаров.
+        После каждой пачки вызывается progress(количество товаров в пачке).
+        """
+        with transaction.atomic():
+            self.import_shop(price_list.shop)
+            self.import_categories(price_list.categories)
+        for chunk in chunked(price_list.goods(), self.batch_size):
+            with transaction.atomic():
+                self.import_chunk(chunk)
+                if progress is not None:
+                    progress(len(chunk))
+        with transaction.atomic():
+            return self.finish()
+
+    def _load_offers(self, goods):
+        if self.shop is None:
+            return {}
+        fields = ('id', 'external_id', 'product__name', 'product__category__name', 'model', 'quantity', 'price',
+                  'price_rrc', 'is_active')
+        offers = {
+            offer['external_id']: offer for offer in
+            ProductInfo.objects.filter(shop=self.shop, external_id__in=[item['id'] for item in goods]).values(*fields)
+        }
+        if self._has_legacy_offers:
+            self._adopt_legacy_offers(goods, offers, fields)
+
+        by_id = {offer['id']: offer for offer in offers.values()}
+        for offer in by_id.values():
+            offer['parameters'] = {}
+        parameters = ProductInfoParameter.objects.filter(
+            product_info_id__in=list(by_id)
+        ).values_list('id', 'product_info_id', 'parameter__name', 'value')
+        for parameter_id, product_info_id, name, value in parameters:
+            by_id[product_info_id]['parameters'][name] = (parameter_id, value)
+        bucketed = StockBucket.objects.filter(product_info_id__in=list(by_id), quantity__gt=0)
+        for product_info_id in bucketed.values_list('product_info_id', flat=True):
+            by_id[product_info_id]['bucket_stock'] = True
+        return offers
+
+    def _adopt_legacy_offers(self, goods, offers, fields):
+        """
+        Карточки, загруженные до появления артикула поставщика, сопоставляются по товару и модели
+        """
+        unmatched = [product_data for product_data in goods if product_data['id'] not in offers]
+        if not unmatched:
+            return
+        legacy = {}
+        queryset = ProductInfo.objects.filter(
+            shop=self.shop,
+            external_id__isnull=True,
+            model__in={product_data['model'] for product_data in unmatched}
+        ).values(*fields)
+        for offer in queryset:
+            key = (offer['product__name'], offer['product__category__name'], offer['model'])
+            legacy.setdefault(key, []).append(offer)
+        for product_data in unmatched:
+            key = (product_data['name'], self.category_names[product_data['category']], product_data['model'])
+            if legacy.get(key):
+                offers[product_data['id']] = legacy[key].pop()
+
+    def _is_changed(self, offer, product_data):
+        parameters = {name: str(value) for name, value in product_data['parameters'].items()}
+        return (
+            offer['external_id'] != product_data['id']
+            or not offer['is_active']
+            or offer.get('bucket_stock', False)
+            or offer['product__name'] != product_data['name']
+            or offer['product__category__name'] != self.category_names[product_data['category']]
+            or offer['model'] != product_data['model']
+            or offer['quantity'] != product_data['quantity']
+            or offer['price'] != product_data['price']
+            or offer['price_rrc'] != product_data['price_rrc']
+            or {name: value for name, (_, value) in offer['parameters'].items()} != parameters
+        )
+
+    def _resolve_products(self, goods):
+        keys = {(product_data['name'], self.categories[product_data['category']]) for product_data in goods}
+        existing = {}
+        queryset = Product.objects.filter(
+            name__in={name for name, _ in keys},
+            category_id__in={category_id for _, category_id in keys}
+        ).values_list('name', 'category_id', 'id')
+        for name, category_id, product_id in queryset:
+            existing.setdefault((name, category_id), product_id)
+
+        missing = [Product(name=name, category_id=category_id) for name, category_id in keys if
+                   (name, category_id) not in existing]
+        for product in Product.objects.bulk_create(missing):
+            existing[(product.name, product.category_id)] = product.id
+        return existing
+
+    def _build_offer(self, product_data, products, **kwargs):
+        return ProductInfo(
+            product_id=products[(product_data['name'], self.categories[product_data['category']])],
+            shop=self.shop,
+            model=product_data['model'],
+            quantity=product_data['quantity'],
+            price=product_data['price'],
+            price_rrc=product_data['price_rrc'],
+            external_id=product_data['id'],
+            is_active=True,
+            **kwargs
+        )
+
+    def _write_offers(self, inserted, updated, products):
+        product_infos = {}
+        created = ProductInfo.objects.bulk_create(
+            [self._build_offer(product_data, products) for product_data in inserted]
+        )
+        for product_info in created:
+            product_infos[product_info.external_id] = product_info.id
+
+        changed = [self._build_offer(product_data, products, id=offer['id']) for offer, product_data in updated]
+        ProductInfo.objects.bulk_update(changed, OFFER_FIELDS)
+        bucketed = [offer['id'] for offer, _ in updated if offer.get('bucket_stock')]
+        if bucketed:
+            StockBucket.objects.filter(product_info_id__in=bucketed).update(quantity=0)
+        for product_info in changed:
+            product_infos[product_info.external_id] = product_info.id
+        return product_infos
+
+    def _import_parameters(self, goods, product_infos):
+        parameters = parameter_ids.get_many(name for product_data in goods for name in product_data['parameters'])
+
+        values = {}
+        for product_data in goods:
+            product_info_id = product_infos[product_data['id']]
+            for name, value in product_data['parameters'].items():
+                values[(product_info_id, parameters[name])] = (str(value), parse_numeric(value, name))
+
+        ProductInfoParameter.objects.bulk_create(
+            [ProductInfoParameter(product_info_id=product_info_id, parameter_id=parameter_id, value=value,
+                                  numeric_value=numeric_value)
+             for (product_info_id, parameter_id), (value, numeric_value) in values.items()],
+            update_conflicts=True,
+            unique_fields=['product_info', 'parameter'],
+            update_fields=['value', 'numeric_value']
+        )
+
+    def _delete_stale_parameters(self, updated):
+        stale = [
+            parameter_id
+            for offer, product_data in updated
+            for name, (parameter_id, _) in offer['parameters'].items()
+            if name not in product_data['parameters']
+        ]
+        if stale:
+            ProductInfoParameter.objects.filter(id__in=stale).delete()
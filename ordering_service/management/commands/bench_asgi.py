@@ -0,0 +1,195 @@
+import asyncio
+import io
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+
+from ordering_service.models import Shop, Category, Product, ProductInfo, Order, OrderProduct
+
+BENCH_EMAIL_DOMAIN = 'bench.example.com'
+HOST = 'localhost'
+# режимы: точка входа и представления для чтения (ASYNC_READ_VIEWS)
+MODES = {
+    'wsgi': False,
+    'asgi-sync': False,
+    'asgi-async': True,
+}
+
+
+def create_data(offers_count, buyers_count):
+    User = get_user_model()
+    owner = User.objects.create_user(email=f'owner@{BENCH_EMAIL_DOMAIN}', password=None, type='shop')
+    Token.objects.create(user=owner)
+    shops = Shop.objects.bulk_create([Shop(name=f'Бенчмарк {i}', user=owner) for i in range(20)])
+    categories = Category.objects.bulk_create([Category(name=f'Бенчмарк {i}', user=owner) for i in range(20)])
+    for category in categories:
+        category.shops.set(shops[:5])
+    products = Product.objects.bulk_create([Product(name=f'Товар {i}', category=categories[i % len(categories)])
+                                            for i in range(offers_count)])
+    offers = ProductInfo.objects.bulk_create([
+        ProductInfo(product=product, shop=shops[i % len(shops)], model=f'bench/{i}', quantity=100,
+                    price=1000 + i, price_rrc=1000 + i, external_id=i)
+        for i, product in enumerate(products)
+    ])
+    for i in range(buyers_count):
+        buyer = User.objects.create_user(email=f'buyer{i}@{BENCH_EMAIL_DOMAIN}', password=None, type='buyer')
+        Token.objects.create(user=buyer)
+        for j in range(5):
+            order = Order.objects.create(user=buyer, status='new')
+            OrderProduct.objects.bulk_create([
+                OrderProduct(order=order, product_info=offer, quantity=1, price=offer.price)
+                for offer in offers[j * 3:j * 3 + 3]
+            ])
+            order.recalculate_total()
+
+
+def delete_data():
+    get_user_model().objects.filter(email__endswith=f'@{BENCH_EMAIL_DOMAIN}').delete()
+
+
+def endpoints():
+    """
+    Запросы бенчмарка: путь и токены, которыми они подписываются по очереди (None - анонимно)
+    """
+    owner_token = Token.objects.get(user__email=f'owner@{BENCH_EMAIL_DOMAIN}').key
+    buyer_tokens = list(Token.objects.filter(user__email__startswith='buyer', user__email__endswith=BENCH_EMAIL_DOMAIN)
+                        .values_list('key', flat=True))
+    offer_id = ProductInfo.objects.filter(shop__user__email=f'owner@{BENCH_EMAIL_DOMAIN}').values_list(
+        'id', flat=True).first()
+    return [
+        ('/shops/', [None]),
+        ('/categories/', [None]),
+        ('/product_info/?page_size=20', [None]),
+        (f'/product_info/{offer_id}/', [owner_token]),
+        ('/order/', buyer_tokens),
+    ]
+
+
+def request_headers(token, i):
+    headers = [(b'host', HOST.encode())]
+    if token:
+        headers.append((b'authorization', f'Token {token}'.encode()))
+    # у анонимных запросов разные адреса, чтобы в замеры не вмешивалось ограничение частоты запросов
+    return headers, f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}'
+
+
+def call_wsgi(application, path, token, i):
+    path, _, query = path.partition('?')
+    headers, client = request_headers(token, i)
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SERVER_NAME': HOST,
+        'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': client, 'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    environ.update({f'HTTP_{name.decode().upper()}': value.decode() for name, value in headers})
+    statuses = []
+    started = time.perf_counter()
+    response = application(environ, lambda status, response_headers, exc_info=None: statuses.append(status))
+    try:
+        b''.join(response)
+    finally:
+        response.close()
+    return int(statuses[0].split()[0]), time.perf_counter() - started
+
+
+async def call_asgi(application, path, token, i):
+    path, _, query = path.partition('?')
+    headers, client = request_headers(token, i)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': headers, 'client': (client, 50000), 'server': (HOST, 80),
+    }
+    statuses = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    started = time.perf_counter()
+    await application(scope, receive, send)
+    return statuses[0], time.perf_counter() - started
+
+
+def run_wsgi(application, path, tokens, requests, concurrency):
+    with ThreadPoolExecutor(concurrency) as executor:
+        return list(executor.map(lambda i: call_wsgi(application, path, tokens[i % len(tokens)], i), range(requests)))
+
+
+def run_asgi(application, path, tokens, requests, concurrency):
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(i):
+            async with semaphore:
+                return await call_asgi(application, path, tokens[i % len(tokens)], i)
+        return await asyncio.gather(*[call(i) for i in range(requests)])
+    return asyncio.run(run())
+
+
+class Command(BaseCommand):
+    help = 'Пропускная способность чтения каталога и заказов при одновременных запросах: WSGI против ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--offers', type=int, default=1000)
+        parser.add_argument('--buyers', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=300)
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+        parser.add_argument('--silk', action='store_true', help='не отключать профилировщик silk')
+        parser.add_argument('--mode', choices=MODES, help='замер одного режима (запускается в отдельном процессе)')
+
+    def handle(self, *args, **options):
+        if options['mode']:
+            return self.measure(options)
+
+        # у каждого режима свой процесс: urls.py читает ASYNC_READ_VIEWS один раз при загрузке
+        delete_data()
+        create_data(options['offers'], options['buyers'])
+        try:
+            self.stdout.write(f'{"режим":>10} {"запрос":>28} {"клиентов":>9} {"запр./с":>9} {"p95, мс":>9} '
+                              f'{"ошибок":>7}')
+            for mode, async_views in MODES.items():
+                command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'bench_asgi', '--mode', mode,
+                           '--requests', str(options['requests']), '--concurrency',
+                           *map(str, options['concurrency'])] + (['--silk'] if options['silk'] else [])
+                env = dict(os.environ, ASYNC_READ_VIEWS='1' if async_views else '0')
+                result = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+                self.stdout.write(result.stdout, ending='')
+        finally:
+            delete_data()
+
+    def measure(self, options):
+        middleware = settings.MIDDLEWARE
+        if not options['silk']:
+            # silk записывает каждый запрос в базу и работает только синхронно
+            middleware = [name for name in middleware if not name.startswith('silk.')]
+        with override_settings(MIDDLEWARE=middleware):
+            if options['mode'] == 'wsgi':
+                application, run = get_wsgi_application(), run_wsgi
+            else:
+                application, run = get_asgi_application(), run_asgi
+            for path, tokens in endpoints():
+                run(application, path, tokens, len(tokens), 1)
+                for concurrency in options['concurrency']:
+                    started = time.perf_counter()
+                    results = run(application, path, tokens, options['requests'], concurrency)
+                    elapsed = time.perf_counter() - started
+                    errors = sum(status != 200 for status, _ in results)
+                    p95 = statistics.quantiles([duration for _, duration in results], n=20)[-1] * 1000
+                    self.stdout.write(f'{options["mode"]:>10} {path:>28} {concurrency:>9} '
+                                      f'{options["requests"] / elapsed:>9.0f} {p95:>9.1f} {errors:>7}')
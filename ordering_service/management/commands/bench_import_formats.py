@@ -0,0 +1,105 @@
+import csv
+import json
+import os
+import tempfile
+import time
+
+import yaml
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ordering_service.importer import GoodsImporter, chunked
+from ordering_service.readers import READERS
+
+PARAMETERS = {'Диагональ (дюйм)': 6.1, 'Разрешение (пикс)': '1792x828', 'Встроенная память (Гб)': 256,
+              'Цвет': 'синий'}
+
+
+def make_goods(goods_count):
+    for i in range(goods_count):
+        yield {
+            'id': i,
+            'category': 224,
+            'model': f'apple/iphone/{i}',
+            'name': f'Смартфон Apple iPhone XR {i}',
+            'price': 60000 + i % 1000,
+            'price_rrc': 64990,
+            'quantity': i % 20,
+            'parameters': PARAMETERS,
+        }
+
+
+def write_price_list(path, price_list_format, goods_count):
+    """
+    Генерация одинакового прайс-листа в каждом из поддерживаемых форматов
+    """
+    header = {'shop': 'Бенчмарк', 'categories': [{'id': 224, 'name': 'Смартфоны'}]}
+    with open(path, 'w', encoding='utf-8', newline='') as price_list:
+        if price_list_format == 'yaml':
+            price_list.write(yaml.dump(header, allow_unicode=True) + 'goods:\n')
+            for product_data in make_goods(goods_count):
+                price_list.write(yaml.dump([product_data], allow_unicode=True, default_flow_style=False))
+        elif price_list_format == 'json':
+            json.dump(dict(header, goods=list(make_goods(goods_count))), price_list, ensure_ascii=False)
+        elif price_list_format == 'ndjson':
+            price_list.write(json.dumps(header, ensure_ascii=False) + '\n')
+            for product_data in make_goods(goods_count):
+                price_list.write(json.dumps(product_data, ensure_ascii=False) + '\n')
+        elif price_list_format == 'csv':
+            writer = csv.writer(price_list)
+            writer.writerow(['shop', 'category_id', 'category', 'id', 'name', 'model', 'price', 'price_rrc',
+                             'quantity', *PARAMETERS])
+            for product_data in make_goods(goods_count):
+                writer.writerow(['Бенчмарк', 224, 'Смартфоны', product_data['id'], product_data['name'],
+                                 product_data['model'], product_data['price'], product_data['price_rrc'],
+                                 product_data['quantity'], *PARAMETERS.values()])
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Скорость разбора и импорта прайс-листа (товаров в секунду) для каждого формата'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--goods', type=int, default=20000)
+        parser.add_argument('--formats', nargs='+', default=list(READERS), choices=list(READERS))
+        parser.add_argument('--with-db', action='store_true',
+                            help='Выполнить также запись в базу (в транзакции, которая затем откатывается)')
+
+    def handle(self, *args, **options):
+        goods_count = options['goods']
+        header = f'{"формат":>8} {"размер, МБ":>11} {"разбор, товаров/с":>18}'
+        if options['with_db']:
+            header += f' {"импорт, товаров/с":>18}'
+        self.stdout.write(header)
+
+        with tempfile.TemporaryDirectory() as directory:
+            for price_list_format in options['formats']:
+                path = os.path.join(directory, f'price_list.{price_list_format}')
+                write_price_list(path, price_list_format, goods_count)
+                line = f'{price_list_format:>8} {os.path.getsize(path) / 2 ** 20:>11.1f}'
+
+                started = time.perf_counter()
+                with open(path, 'rb') as price_list:
+                    for _ in chunked(READERS[price_list_format](price_list).goods(), 1000):
+                        pass
+                line += f' {goods_count / (time.perf_counter() - started):>18.0f}'
+
+                if options['with_db']:
+                    line += f' {goods_count / self.import_price_list(path, price_list_format):>18.0f}'
+                self.stdout.write(line)
+
+    def import_price_list(self, path, price_list_format):
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                user = get_user_model().objects.create_user(email='bench@example.com', password=None, type='shop')
+                with open(path, 'rb') as price_list:
+                    GoodsImporter(user).run(READERS[price_list_format](price_list))
+                elapsed = time.perf_counter() - started
+                raise Rollback
+        except Rollback:
+            return elapsed
@@ -0,0 +1,68 @@
+import tempfile
+import time
+import tracemalloc
+
+import yaml
+from django.core.management.base import BaseCommand
+
+from ordering_service.importer import chunked
+from ordering_service.readers import YamlPriceListReader
+
+
+def write_price_list(path, goods_count):
+    """
+    Генерация прайс-листа в формате shop1.yaml с заданным количеством товаров
+    """
+    with open(path, 'w', encoding='utf-8') as price_list:
+        price_list.write('shop: Связной\ncategories:\n  - id: 224\n    name: Смартфоны\n\ngoods:\n')
+        for i in range(goods_count):
+            price_list.write(
+                f'  - id: {i}\n'
+                f'    category: 224\n'
+                f'    model: apple/iphone/{i}\n'
+                f'    name: Смартфон Apple iPhone XR {i}\n'
+                f'    price: {60000 + i % 1000}\n'
+                f'    price_rrc: 64990\n'
+                f'    quantity: {i % 20}\n'
+                f'    parameters:\n'
+                f'      "Диагональ (дюйм)": 6.1\n'
+                f'      "Разрешение (пикс)": 1792x828\n'
+                f'      "Встроенная память (Гб)": 256\n'
+                f'      "Цвет": синий\n'
+            )
+
+
+def full_loader(path, chunk_size):
+    with open(path, 'rb') as price_list:
+        data = yaml.load(price_list.read(), Loader=yaml.FullLoader)
+    return sum(len(chunk) for chunk in chunked(data['goods'], chunk_size))
+
+
+def streaming_reader(path, chunk_size):
+    with open(path, 'rb') as price_list:
+        reader = YamlPriceListReader(price_list)
+        return sum(len(chunk) for chunk in chunked(reader.goods(), chunk_size))
+
+
+class Command(BaseCommand):
+    help = 'Сравнение пикового потребления памяти и времени разбора прайс-листа'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--goods', type=int, nargs='+', default=[1000, 5000, 20000])
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"товаров":>10} {"загрузчик":>12} {"время, с":>10} {"пик памяти, МБ":>16}')
+        for goods_count in options['goods']:
+            with tempfile.NamedTemporaryFile(suffix='.yaml') as price_list:
+                write_price_list(price_list.name, goods_count)
+                for name, load in (('FullLoader', full_loader), ('streaming', streaming_reader)):
+                    started = time.perf_counter()
+                    load(price_list.name, options['chunk_size'])
+                    elapsed = time.perf_counter() - started
+
+                    tracemalloc.start()
+                    load(price_list.name, options['chunk_size'])
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    self.stdout.write(f'{goods_count:>10} {name:>12} {elapsed:>10.2f} {peak / 2 ** 20:>16.1f}')
@@ -0,0 +1,71 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.filters import SearchFilter
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from ordering_service.filters import CatalogSearchFilter
+from ordering_service.importer import chunked
+from ordering_service.models import Shop, Category, Product, ProductInfo
+from ordering_service.views import ProductInfoViewSet
+
+BRANDS = ['Apple iPhone', 'Samsung Galaxy', 'Xiaomi Redmi', 'Huawei Nova', 'Honor Magic', 'Realme Note']
+QUERIES = ['galaxy', 'xiaomi/redmi/4242', 'honor magic 77']
+
+
+class Rollback(Exception):
+    pass
+
+
+def create_offers(offers_count):
+    user = get_user_model().objects.create_user(email='bench@example.com', password=None, type='shop')
+    shop = Shop.objects.create(name='Бенчмарк', user=user)
+    category = Category.objects.create(name='Бенчмарк', user=user)
+    for numbers in chunked(range(offers_count), 5000):
+        products = Product.objects.bulk_create(
+            [Product(name=f'{BRANDS[i % len(BRANDS)]} {i % 1000}', category=category) for i in numbers]
+        )
+        ProductInfo.objects.bulk_create([
+            ProductInfo(product=product, shop=shop, model=f'{BRANDS[i % len(BRANDS)].lower().replace(" ", "/")}/{i}',
+                        quantity=1, price=1000 + i % 50000, price_rrc=1000 + i % 50000, external_id=i)
+            for i, product in zip(numbers, products)
+        ])
+
+
+class Command(BaseCommand):
+    help = 'Задержка поиска ?search= по карточкам товаров: индекс против LIKE'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--offers', type=int, nargs='+', default=[10000, 100000, 1000000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"карточек":>10} {"запрос":>20} {"LIKE, мс":>10} {"индекс, мс":>11} {"найдено":>8}')
+        for offers_count in options['offers']:
+            try:
+                with transaction.atomic():
+                    create_offers(offers_count)
+                    for query in QUERIES:
+                        like, _ = self.measure(SearchFilter(), query, options['repeat'])
+                        indexed, found = self.measure(CatalogSearchFilter(), query, options['repeat'])
+                        self.stdout.write(f'{offers_count:>10} {query:>20} {like:>10.1f} {indexed:>11.1f} {found:>8}')
+                    raise Rollback
+            except Rollback:
+                pass
+
+    def measure(self, backend, query, repeat):
+        """
+        Медиана времени получения первой страницы (20 карточек) результатов поиска
+        """
+        request = Request(APIRequestFactory().get('/', {'search': query}))
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            queryset = backend.filter_queryset(request, ProductInfoViewSet.queryset.all(), ProductInfoViewSet)
+            found = len(list(queryset[:20]))
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), found
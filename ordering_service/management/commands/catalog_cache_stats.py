@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from ordering_service import catalog
+
+
+class Command(BaseCommand):
+    help = 'Счетчики попаданий и промахов кэша каталога'
+
+    def handle(self, *args, **options):
+        counters = catalog.stats()
+        total = counters['hits'] + counters['misses']
+        ratio = counters['hits'] / total * 100 if total else 0
+        self.stdout.write(f'попаданий: {counters["hits"]}, промахов: {counters["misses"]}, доля попаданий: {ratio:.1f}%')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ordering_service.models import ProductInfo
+from ordering_service.stock import set_buckets
+
+
+class Command(BaseCommand):
+    help = 'Перевод карточки товара в режим горячего товара: остаток списывается из нескольких ячеек'
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_info_id', type=int)
+        parser.add_argument('--buckets', type=int, default=8, help='количество ячеек, 0 - обычный режим')
+
+    def handle(self, *args, **options):
+        try:
+            set_buckets(options['product_info_id'], options['buckets'])
+        except ProductInfo.DoesNotExist:
+            raise CommandError(f'Карточка товара {options["product_info_id"]} не найдена')
+        self.stdout.write(f'ячеек остатка: {options["buckets"]}')
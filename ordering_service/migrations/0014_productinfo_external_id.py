@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0013_remove_order_total_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinfo',
+            name='external_id',
+            field=models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Артикул поставщика'),
+        ),
+        migrations.AddField(
+            model_name='productinfo',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='Есть в прайс-листе'),
+        ),
+        migrations.AddConstraint(
+            model_name='productinfo',
+            constraint=models.UniqueConstraint(fields=('shop', 'external_id'), name='unique_shop_external_id'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0014_productinfo_external_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file', models.CharField(max_length=255, verbose_name='Путь к файлу')),
+                ('dry_run', models.BooleanField(default=False, verbose_name='Без записи в базу')),
+                ('state', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершен'), ('failed', 'Ошибка')], default='pending', max_length=15, verbose_name='Состояние')),
+                ('rows_processed', models.PositiveIntegerField(default=0, verbose_name='Обработано товаров')),
+                ('stats', models.JSONField(blank=True, default=dict, verbose_name='Результат')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Ошибки')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Импорт товаров',
+                'verbose_name_plural': 'Импорты товаров',
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0015_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='feed',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Заголовки загруженного прайс-листа'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='shop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='ordering_service.shop', verbose_name='Магазин'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_etag',
+            field=models.CharField(blank=True, max_length=255, verbose_name='ETag прайс-листа'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_hash',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Хэш прайс-листа'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_last_modified',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Last-Modified прайс-листа'),
+        ),
+    ]
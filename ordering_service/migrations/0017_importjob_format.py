@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0016_shop_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='format',
+            field=models.CharField(default='yaml', max_length=10, verbose_name='Формат файла'),
+        ),
+    ]
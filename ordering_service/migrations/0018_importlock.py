@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0017_importjob_format'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportLock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shop_name', models.CharField(max_length=50, unique=True, verbose_name='Название магазина')),
+                ('acquired_at', models.DateTimeField(verbose_name='Время захвата')),
+            ],
+            options={
+                'verbose_name': 'Блокировка импорта',
+                'verbose_name_plural': 'Блокировки импорта',
+            },
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='shop_name',
+            field=models.CharField(blank=True, max_length=50, verbose_name='Название магазина в прайс-листе'),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='state',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершен'), ('failed', 'Ошибка'), ('superseded', 'Заменен более новым прайс-листом')], default='pending', max_length=15, verbose_name='Состояние'),
+        ),
+        migrations.AddIndex(
+            model_name='importjob',
+            index=models.Index(fields=['shop_name', 'state'], name='import_job_shop_state_idx'),
+        ),
+        migrations.AddField(
+            model_name='importlock',
+            name='job',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='lock', to='ordering_service.importjob', verbose_name='Задача импорта'),
+        ),
+    ]
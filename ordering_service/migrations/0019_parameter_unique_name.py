@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:44
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_parameters(apps, schema_editor):
+    """
+    Параметры с одинаковым названием сливаются в параметр с наименьшим id
+    """
+    Parameter = apps.get_model('ordering_service', 'Parameter')
+    ProductInfoParameter = apps.get_model('ordering_service', 'ProductInfoParameter')
+    duplicates = Parameter.objects.values('name').annotate(count=Count('id'), keep=Min('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        keep = duplicate['keep']
+        for parameter_id in Parameter.objects.filter(name=duplicate['name']).exclude(id=keep).values_list('id', flat=True):
+            kept_offers = ProductInfoParameter.objects.filter(parameter_id=keep).values('product_info_id')
+            ProductInfoParameter.objects.filter(parameter_id=parameter_id, product_info_id__in=kept_offers).delete()
+            ProductInfoParameter.objects.filter(parameter_id=parameter_id).update(parameter_id=keep)
+        Parameter.objects.filter(name=duplicate['name']).exclude(id=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0018_importlock'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_parameters, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='parameter',
+            name='name',
+            field=models.CharField(max_length=50, unique=True, verbose_name='Название параметра'),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+import ordering_service.models
+
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE ordering_service_productinfo_search "
+    "USING fts5(product_name, model, price, tokenize='trigram')",
+    "INSERT INTO ordering_service_productinfo_search (rowid, product_name, model, price) "
+    "SELECT pi.id, p.name, pi.model, pi.price FROM ordering_service_productinfo pi "
+    "JOIN ordering_service_product p ON p.id = pi.product_id",
+    "CREATE TRIGGER ordering_service_productinfo_search_insert AFTER INSERT ON ordering_service_productinfo BEGIN "
+    "INSERT INTO ordering_service_productinfo_search (rowid, product_name, model, price) "
+    "SELECT new.id, name, new.model, new.price FROM ordering_service_product WHERE id = new.product_id; END",
+    "CREATE TRIGGER ordering_service_productinfo_search_update "
+    "AFTER UPDATE OF product_id, model, price ON ordering_service_productinfo BEGIN "
+    "DELETE FROM ordering_service_productinfo_search WHERE rowid = old.id; "
+    "INSERT INTO ordering_service_productinfo_search (rowid, product_name, model, price) "
+    "SELECT new.id, name, new.model, new.price FROM ordering_service_product WHERE id = new.product_id; END",
+    "CREATE TRIGGER ordering_service_productinfo_search_delete AFTER DELETE ON ordering_service_productinfo BEGIN "
+    "DELETE FROM ordering_service_productinfo_search WHERE rowid = old.id; END",
+    "CREATE TRIGGER ordering_service_product_search_update AFTER UPDATE OF name ON ordering_service_product BEGIN "
+    "UPDATE ordering_service_productinfo_search SET product_name = new.name "
+    "WHERE rowid IN (SELECT id FROM ordering_service_productinfo WHERE product_id = new.id); END",
+]
+
+SQLITE_DROP_INDEX = [
+    'DROP TRIGGER IF EXISTS ordering_service_product_search_update',
+    'DROP TRIGGER IF EXISTS ordering_service_productinfo_search_delete',
+    'DROP TRIGGER IF EXISTS ordering_service_productinfo_search_update',
+    'DROP TRIGGER IF EXISTS ordering_service_productinfo_search_insert',
+    'DROP TABLE IF EXISTS ordering_service_productinfo_search',
+]
+
+POSTGRESQL_INDEX = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX ordering_service_product_name_trgm ON ordering_service_product '
+    'USING gin (UPPER(name) gin_trgm_ops)',
+    'CREATE INDEX ordering_service_productinfo_model_trgm ON ordering_service_productinfo '
+    'USING gin (UPPER(model) gin_trgm_ops)',
+]
+
+POSTGRESQL_DROP_INDEX = [
+    'DROP INDEX IF EXISTS ordering_service_productinfo_model_trgm',
+    'DROP INDEX IF EXISTS ordering_service_product_name_trgm',
+]
+
+
+def execute(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0019_parameter_unique_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductInfoSearch',
+            fields=[
+                ('product_info', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='ordering_service.productinfo', verbose_name='Карточка товара')),
+                ('product_name', models.TextField(verbose_name='Имя товара')),
+                ('model', models.TextField(verbose_name='Модель')),
+                ('price', models.TextField(verbose_name='Цена')),
+                ('document', ordering_service.models.SearchField(db_column='ordering_service_productinfo_search')),
+                ('rank', models.FloatField(verbose_name='Релевантность')),
+            ],
+            options={
+                'verbose_name': 'Поисковый индекс карточки товара',
+                'verbose_name_plural': 'Поисковый индекс карточек товаров',
+                'db_table': 'ordering_service_productinfo_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(
+            execute({'sqlite': SQLITE_INDEX, 'postgresql': POSTGRESQL_INDEX}),
+            execute({'sqlite': SQLITE_DROP_INDEX, 'postgresql': POSTGRESQL_DROP_INDEX}),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0020_productinfo_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productinfoparameter',
+            index=models.Index(fields=['parameter', 'value'], name='parameter_value_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:52
+
+import re
+
+from django.db import migrations, models
+
+# копия ordering_service.units на момент миграции: миграция должна давать тот же результат,
+# даже если правила разбора значений и список единиц потом изменятся
+NUMBER = re.compile(r'^\s*([-+]?\d+(?:[.,]\d+)?)\s*(.*?)\s*$')
+NAME_UNIT = re.compile(r'\(([^()]+)\)\s*$')
+UNIT_FAMILIES = [
+    {'гб': 1, 'gb': 1, 'мб': 1 / 1024, 'mb': 1 / 1024, 'кб': 1 / 1024 ** 2, 'kb': 1 / 1024 ** 2,
+     'тб': 1024, 'tb': 1024},
+    {'дюйм': 1, 'дюйма': 1, 'дюймов': 1, 'in': 1, '"': 1, '″': 1, 'мм': 1 / 25.4, 'mm': 1 / 25.4,
+     'см': 1 / 2.54, 'cm': 1 / 2.54},
+    {'г': 1, 'гр': 1, 'g': 1, 'кг': 1000, 'kg': 1000},
+    {'мгц': 1, 'mhz': 1, 'ггц': 1000, 'ghz': 1000},
+    {'мач': 1, 'mah': 1},
+    {'вт': 1, 'w': 1},
+    {'пикс': 1, 'px': 1},
+    {'мп': 1, 'mp': 1},
+]
+UNITS = {unit: (family, factor) for family, units in enumerate(UNIT_FAMILIES) for unit, factor in units.items()}
+
+
+def normalize_unit(unit):
+    return unit.strip().lower().rstrip('.')
+
+
+def parse_numeric(value, parameter_name=''):
+    match = NUMBER.match(str(value))
+    if match is None:
+        return None
+    number = float(match.group(1).replace(',', '.'))
+    unit = normalize_unit(match.group(2))
+
+    name_match = NAME_UNIT.search(parameter_name)
+    target = UNITS.get(normalize_unit(name_match.group(1))) if name_match else None
+    if not unit:
+        return number
+    if unit not in UNITS:
+        return None
+    family, factor = UNITS[unit]
+    if target is not None and target[0] == family:
+        return number * factor / target[1]
+    return number * factor
+
+
+def fill_numeric_values(apps, schema_editor):
+    ProductInfoParameter = apps.get_model('ordering_service', 'ProductInfoParameter')
+    batch = []
+    for parameter in ProductInfoParameter.objects.select_related('parameter').iterator(chunk_size=2000):
+        parameter.numeric_value = parse_numeric(parameter.value, parameter.parameter.name)
+        if parameter.numeric_value is not None:
+            batch.append(parameter)
+        if len(batch) >= 2000:
+            ProductInfoParameter.objects.bulk_update(batch, ['numeric_value'])
+            batch = []
+    ProductInfoParameter.objects.bulk_update(batch, ['numeric_value'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0021_productinfoparameter_value_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinfoparameter',
+            name='numeric_value',
+            field=models.FloatField(blank=True, null=True, verbose_name='Числовое значение'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfoparameter',
+            index=models.Index(fields=['parameter', 'numeric_value'], name='parameter_numeric_value_idx'),
+        ),
+        migrations.RunPython(fill_numeric_values, migrations.RunPython.noop),
+    ]
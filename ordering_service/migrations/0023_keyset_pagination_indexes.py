@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0022_productinfoparameter_numeric_value'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(fields=['price', 'id'], name='productinfo_price_id_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:05
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_prices_and_totals(apps, schema_editor):
+    Order = apps.get_model('ordering_service', 'Order')
+    OrderProduct = apps.get_model('ordering_service', 'OrderProduct')
+    OrderProduct.objects.update(
+        price=Subquery(OrderProduct.objects.filter(id=OuterRef('id')).values('product_info__price')[:1])
+    )
+    totals = OrderProduct.objects.filter(order_id=OuterRef('id')).values('order_id').annotate(
+        total=Sum(F('quantity') * F('price'))
+    ).values('total')
+    Order.objects.update(total_price=Coalesce(Subquery(totals), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0023_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.PositiveIntegerField(default=0, verbose_name='Сумма заказа'),
+        ),
+        migrations.AddField(
+            model_name='orderproduct',
+            name='price',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Цена за единицу'),
+        ),
+        migrations.RunPython(fill_prices_and_totals, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderproduct',
+            name='price',
+            field=models.PositiveIntegerField(blank=True, verbose_name='Цена за единицу'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def split_orders_by_shop(apps, schema_editor):
+    Order = apps.get_model('ordering_service', 'Order')
+    OrderProduct = apps.get_model('ordering_service', 'OrderProduct')
+    ShopOrder = apps.get_model('ordering_service', 'ShopOrder')
+    for order in Order.objects.exclude(status='basket').iterator():
+        order_products = list(OrderProduct.objects.filter(order=order).select_related('product_info'))
+        shop_orders = {}
+        for order_product in order_products:
+            shop_id = order_product.product_info.shop_id
+            if shop_id not in shop_orders:
+                shop_orders[shop_id] = ShopOrder.objects.create(order=order, shop_id=shop_id, status=order.status,
+                                                                created_at=order.created_at)
+            shop_orders[shop_id].total_price += order_product.quantity * order_product.price
+            order_product.shop_order = shop_orders[shop_id]
+        ShopOrder.objects.bulk_update(shop_orders.values(), ['total_price'])
+        OrderProduct.objects.bulk_update(order_products, ['shop_order'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0024_order_total_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(verbose_name='Дата оформления')),
+                ('status', models.CharField(choices=[('basket', 'Статус корзины'), ('new', 'Новый'), ('confirmed', 'Подтвержден'), ('assembled', 'Собран'), ('sent', 'Отправлен'), ('delivered', 'Доставлен'), ('canceled', 'Отменен')], default='new', max_length=15, verbose_name='Статус')),
+                ('total_price', models.PositiveIntegerField(default=0, verbose_name='Сумма позиций магазина')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='ordering_service.order', verbose_name='Заказ')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_orders', to='ordering_service.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Заказ магазина',
+                'verbose_name_plural': 'Заказы магазинов',
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.AddField(
+            model_name='orderproduct',
+            name='shop_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_products', to='ordering_service.shoporder', verbose_name='Заказ магазина'),
+        ),
+        migrations.AddIndex(
+            model_name='shoporder',
+            index=models.Index(fields=['shop', 'created_at', 'id'], name='shop_order_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoporder',
+            index=models.Index(fields=['shop', 'status', 'created_at', 'id'], name='shop_order_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoporder',
+            constraint=models.UniqueConstraint(fields=('order', 'shop'), name='unique_shop_order'),
+        ),
+        migrations.RunPython(split_orders_by_shop, migrations.RunPython.noop),
+    ]
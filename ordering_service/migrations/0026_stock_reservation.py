@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0025_shoporder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата резервирования')),
+                ('released', models.BooleanField(default=False, verbose_name='Резерв снят')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='ordering_service.order', verbose_name='Заказ')),
+                ('product_info', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='ordering_service.productinfo', verbose_name='Карточка товара')),
+            ],
+            options={
+                'verbose_name': 'Резерв товара',
+                'verbose_name_plural': 'Резервы товаров',
+            },
+        ),
+        migrations.CreateModel(
+            name='StockBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='Количество')),
+                ('product_info', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_buckets', to='ordering_service.productinfo', verbose_name='Карточка товара')),
+            ],
+            options={
+                'verbose_name': 'Ячейка остатка горячего товара',
+                'verbose_name_plural': 'Ячейки остатков горячих товаров',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0026_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient', models.EmailField(max_length=254, verbose_name='Получатель')),
+                ('old_status', models.CharField(choices=[('basket', 'Статус корзины'), ('new', 'Новый'), ('confirmed', 'Подтвержден'), ('assembled', 'Собран'), ('sent', 'Отправлен'), ('delivered', 'Доставлен'), ('canceled', 'Отменен')], max_length=15, verbose_name='Прежний статус')),
+                ('new_status', models.CharField(choices=[('basket', 'Статус корзины'), ('new', 'Новый'), ('confirmed', 'Подтвержден'), ('assembled', 'Собран'), ('sent', 'Отправлен'), ('delivered', 'Доставлен'), ('canceled', 'Отменен')], max_length=15, verbose_name='Новый статус')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата изменения')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата отправки')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_notifications', to='ordering_service.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Уведомление об изменении статуса',
+                'verbose_name_plural': 'Уведомления об изменении статуса',
+                'indexes': [models.Index(fields=['sent_at', 'id'], name='notification_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0027_status_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=50, verbose_name='Тип события')),
+                ('payload', models.JSONField(verbose_name='Данные события')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('dispatched_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата передачи в очередь')),
+            ],
+            options={
+                'verbose_name': 'Событие заказа',
+                'verbose_name_plural': 'События заказов',
+                'indexes': [models.Index(fields=['dispatched_at', 'id'], name='outbox_pending_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='statusnotification',
+            name='event',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notification', to='ordering_service.outboxevent', verbose_name='Событие'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:40
+
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Exists, F, OuterRef, Q, Window
+from django.db.models.functions import RowNumber
+import django.db.models.deletion
+
+
+def fill_best_offers(apps, schema_editor):
+    BestOffer = apps.get_model('ordering_service', 'BestOffer')
+    ProductInfo = apps.get_model('ordering_service', 'ProductInfo')
+    StockBucket = apps.get_model('ordering_service', 'StockBucket')
+    in_stock = Q(quantity__gt=0) | Exists(StockBucket.objects.filter(product_info=OuterRef('pk'), quantity__gt=0))
+    offers = ProductInfo.objects.filter(in_stock, is_active=True, shop__state=True).annotate(
+        rank=Window(RowNumber(), partition_by=F('product_id'), order_by=[F('price').asc(), F('id').asc()])
+    ).filter(rank__lte=settings.BEST_OFFERS_SIZE).values_list('product_id', 'rank', 'id', 'shop_id', 'price')
+    offers = offers.iterator(chunk_size=1000)
+    while batch := list(islice(offers, 1000)):
+        BestOffer.objects.bulk_create([
+            BestOffer(product_id=product_id, rank=rank, product_info_id=product_info_id, shop_id=shop_id, price=price)
+            for product_id, rank, product_info_id, shop_id, price in batch
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0028_outbox_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BestOffer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='Место по цене')),
+                ('price', models.PositiveIntegerField(verbose_name='Цена')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='best_offers', to='ordering_service.product', verbose_name='Товар')),
+                ('product_info', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='best_offers', to='ordering_service.productinfo', verbose_name='Карточка товара')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='best_offers', to='ordering_service.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Лучшее предложение',
+                'verbose_name_plural': 'Лучшие предложения',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='bestoffer',
+            constraint=models.UniqueConstraint(fields=('product', 'rank'), name='unique_best_offer_rank'),
+        ),
+        migrations.RunPython(fill_best_offers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0029_best_offer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statusnotification',
+            name='claim',
+            field=models.UUIDField(blank=True, null=True, verbose_name='Отправка, захватившая уведомление'),
+        ),
+        migrations.AddField(
+            model_name='statusnotification',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата захвата'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0030_status_notification_claim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Ключ')),
+                ('value', models.BigIntegerField(verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия кэша каталога',
+                'verbose_name_plural': 'Версии кэша каталога',
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:35
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0031_catalog_version'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='CatalogVersion',
+        ),
+    ]
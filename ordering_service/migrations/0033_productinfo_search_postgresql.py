@@ -0,0 +1,68 @@
+from django.db import migrations
+
+# на PostgreSQL поисковая таблица - обычная таблица с одной колонкой документа (название товара и модель
+# в верхнем регистре) под триграммным GIN-индексом; колонка документа называется, как скрытая колонка FTS5,
+# поэтому модель ProductInfoSearch одна для обеих баз. Цена в документ не входит.
+POSTGRESQL_INDEX = [
+    'DROP INDEX IF EXISTS ordering_service_productinfo_model_trgm',
+    'DROP INDEX IF EXISTS ordering_service_product_name_trgm',
+    'CREATE TABLE ordering_service_productinfo_search (rowid bigint PRIMARY KEY, product_name text NOT NULL, '
+    'model text NOT NULL, price text NOT NULL, ordering_service_productinfo_search text NOT NULL)',
+    "INSERT INTO ordering_service_productinfo_search "
+    "SELECT pi.id, p.name, pi.model, pi.price::text, UPPER(p.name || ' ' || pi.model) "
+    "FROM ordering_service_productinfo pi JOIN ordering_service_product p ON p.id = pi.product_id",
+    'CREATE INDEX ordering_service_productinfo_search_trgm ON ordering_service_productinfo_search '
+    'USING gin (ordering_service_productinfo_search gin_trgm_ops)',
+    "CREATE FUNCTION ordering_service_productinfo_search_sync() RETURNS trigger AS $$ BEGIN "
+    "IF TG_OP = 'DELETE' THEN "
+    "DELETE FROM ordering_service_productinfo_search WHERE rowid = OLD.id; RETURN OLD; END IF; "
+    "INSERT INTO ordering_service_productinfo_search "
+    "SELECT NEW.id, name, NEW.model, NEW.price::text, UPPER(name || ' ' || NEW.model) "
+    "FROM ordering_service_product WHERE id = NEW.product_id "
+    "ON CONFLICT (rowid) DO UPDATE SET product_name = excluded.product_name, model = excluded.model, "
+    "price = excluded.price, ordering_service_productinfo_search = excluded.ordering_service_productinfo_search; "
+    "RETURN NEW; END $$ LANGUAGE plpgsql",
+    'CREATE TRIGGER ordering_service_productinfo_search_sync '
+    'AFTER INSERT OR UPDATE OF product_id, model, price OR DELETE ON ordering_service_productinfo '
+    'FOR EACH ROW EXECUTE FUNCTION ordering_service_productinfo_search_sync()',
+    "CREATE FUNCTION ordering_service_product_search_sync() RETURNS trigger AS $$ BEGIN "
+    "UPDATE ordering_service_productinfo_search SET product_name = NEW.name, "
+    "ordering_service_productinfo_search = UPPER(NEW.name || ' ' || model) "
+    "WHERE rowid IN (SELECT id FROM ordering_service_productinfo WHERE product_id = NEW.id); "
+    "RETURN NEW; END $$ LANGUAGE plpgsql",
+    'CREATE TRIGGER ordering_service_product_search_sync AFTER UPDATE OF name ON ordering_service_product '
+    'FOR EACH ROW EXECUTE FUNCTION ordering_service_product_search_sync()',
+]
+
+POSTGRESQL_DROP_INDEX = [
+    'DROP TRIGGER IF EXISTS ordering_service_product_search_sync ON ordering_service_product',
+    'DROP FUNCTION IF EXISTS ordering_service_product_search_sync()',
+    'DROP TRIGGER IF EXISTS ordering_service_productinfo_search_sync ON ordering_service_productinfo',
+    'DROP FUNCTION IF EXISTS ordering_service_productinfo_search_sync()',
+    'DROP TABLE IF EXISTS ordering_service_productinfo_search',
+    'CREATE INDEX ordering_service_product_name_trgm ON ordering_service_product '
+    'USING gin (UPPER(name) gin_trgm_ops)',
+    'CREATE INDEX ordering_service_productinfo_model_trgm ON ordering_service_productinfo '
+    'USING gin (UPPER(model) gin_trgm_ops)',
+]
+
+
+def execute(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0032_delete_catalog_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            execute({'postgresql': POSTGRESQL_INDEX}),
+            execute({'postgresql': POSTGRESQL_DROP_INDEX}),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shops(apps, schema_editor):
+    OutboxEvent = apps.get_model('ordering_service', 'OutboxEvent')
+    Shop = apps.get_model('ordering_service', 'Shop')
+    shop_ids = set(Shop.objects.values_list('id', flat=True))
+    batch = []
+    for event in OutboxEvent.objects.only('id', 'payload').iterator(chunk_size=2000):
+        shop_id = event.payload.get('shop_id') if isinstance(event.payload, dict) else None
+        if shop_id in shop_ids:
+            event.shop_id = shop_id
+            batch.append(event)
+        if len(batch) >= 2000:
+            OutboxEvent.objects.bulk_update(batch, ['shop'])
+            batch = []
+    OutboxEvent.objects.bulk_update(batch, ['shop'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordering_service', '0033_productinfo_search_postgresql'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='shop',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='events', to='ordering_service.shop', verbose_name='Магазин'),
+        ),
+        migrations.AddIndex(
+            model_name='outboxevent',
+            index=models.Index(fields=['shop', 'id'], name='outbox_shop_idx'),
+        ),
+        migrations.RunPython(fill_shops, migrations.RunPython.noop),
+    ]
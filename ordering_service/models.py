@@ -1,5 +1,10 @@
+import uuid
+
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.db import models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from ordering_service.managers import CustomUserManager
 
@@ -68,6 +73,17 @@ class Shop(models.Model):
     url = models.URLField(verbose_name='Ссылка', null=True, blank=True)
     filename = models.TextField(max_length=100, verbose_name='Имя файла', null=True, blank=True)
     state = models.BooleanField(verbose_name='Открыт для получения заказов', default=True)
+    feed_etag = models.CharField(max_length=255, verbose_name='ETag прайс-листа', blank=True)
+    feed_last_modified = models.CharField(max_length=64, verbose_name='Last-Modified прайс-листа', blank=True)
+    feed_hash = models.CharField(max_length=64, verbose_name='Хэш прайс-листа', blank=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'state' in field_names:
+            # состояние при загрузке: по нему видно, что магазин открылся или закрылся
+            instance.saved_state = instance.state
+        return instance
 
     def __str__(self):
         return self.name
@@ -115,14 +131,22 @@ class ProductInfo(models.Model):
     quantity = models.PositiveIntegerField(verbose_name='Количество')
     price = models.PositiveIntegerField(verbose_name='Цена')
     price_rrc = models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')
+    external_id = models.PositiveBigIntegerField(verbose_name='Артикул поставщика', null=True, blank=True)
+    is_active = models.BooleanField(verbose_name='Есть в прайс-листе', default=True)
 
     class Meta:
         verbose_name = 'Карточка товара'
         verbose_name_plural = 'Карточки товаров'
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'external_id'], name='unique_shop_external_id'),
+        ]
+        indexes = [
+            models.Index(fields=['price', 'id'], name='productinfo_price_id_idx'),
+        ]
 
 
 class Parameter(models.Model):
-    name = models.CharField(max_length=50, verbose_name='Название параметра')
+    name = models.CharField(max_length=50, verbose_name='Название параметра', unique=True)
 
     def __str__(self):
         return self.name
@@ -139,6 +163,7 @@ class ProductInfoParameter(models.Model):
     parameter = models.ForeignKey(Parameter, verbose_name='Название параметра',
                                   related_name='product_info_parameters', on_delete=models.CASCADE)
     value = models.CharField(max_length=100, verbose_name='Значение')
+    numeric_value = models.FloatField(verbose_name='Числовое значение', null=True, blank=True)
 
     class Meta:
         verbose_name = 'Параметр'
@@ -146,11 +171,59 @@ class ProductInfoParameter(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product_info', 'parameter'], name='unique_product_parameter'),
         ]
+        indexes = [
+            models.Index(fields=['parameter', 'value'], name='parameter_value_idx'),
+            models.Index(fields=['parameter', 'numeric_value'], name='parameter_numeric_value_idx'),
+        ]
 
     def __str__(self):
         return f'{self.parameter}: {self.value}'
 
 
+class SearchField(models.TextField):
+    """
+    Колонка полнотекстового индекса, поддерживает поиск field__match=query
+    """
+
+
+@SearchField.register_lookup
+class Match(models.Lookup):
+    """
+    Поиск по полнотекстовому индексу: column MATCH query
+    """
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class ProductInfoSearch(models.Model):
+    """
+    Полнотекстовый индекс карточек товаров: виртуальная таблица FTS5 с триграммным токенизатором на SQLite,
+    таблица с триграммным GIN-индексом на PostgreSQL. Таблица заполняется триггерами базы данных,
+    поэтому индекс обновляется и при импорте через bulk-операции и промежуточные таблицы.
+    Поле document - скрытая колонка FTS5 с именем таблицы, по которой ищется во всех колонках сразу
+    (на PostgreSQL - колонка с названием товара и моделью в верхнем регистре),
+    rank - релевантность (bm25, меньше - лучше), есть только на SQLite.
+    """
+    product_info = models.OneToOneField(ProductInfo, verbose_name='Карточка товара', primary_key=True,
+                                        db_column='rowid', related_name='search_index',
+                                        on_delete=models.DO_NOTHING)
+    product_name = models.TextField(verbose_name='Имя товара')
+    model = models.TextField(verbose_name='Модель')
+    price = models.TextField(verbose_name='Цена')
+    document = SearchField(db_column='ordering_service_productinfo_search')
+    rank = models.FloatField(verbose_name='Релевантность')
+
+    class Meta:
+        managed = False
+        db_table = 'ordering_service_productinfo_search'
+        verbose_name = 'Поисковый индекс карточки товара'
+        verbose_name_plural = 'Поисковый индекс карточек товаров'
+
+
 class Order(models.Model):
     STATE_CHOICES = (
         ('basket', 'Статус корзины'),
@@ -168,14 +241,87 @@ class Order(models.Model):
     status = models.CharField(verbose_name='Статус', choices=STATE_CHOICES, default='basket', max_length=15)
     contact = models.ForeignKey(Contact, verbose_name='Контакты покупателя',
                                 on_delete=models.CASCADE, blank=True, null=True)
+    total_price = models.PositiveIntegerField(verbose_name='Сумма заказа', default=0)
 
     def __str__(self):
         return self.created_at
 
+    def set_products(self, products):
+        """
+        Пакетное изменение позиций: products - список {'product_info': карточка, 'quantity': количество}.
+        Все позиции записываются одним INSERT ... ON CONFLICT по unique_order_product,
+        позиции с нулевым количеством удаляются. Сумма заказа пересчитывается одним запросом.
+        """
+        # количество можно не указывать, как и у OrderProduct.quantity по умолчанию оно равно 1
+        lines = [(product['product_info'], product.get('quantity', 1)) for product in products]
+        removed = [product_info.id for product_info, quantity in lines if not quantity]
+        if removed:
+            OrderProduct.objects.filter(order=self, product_info_id__in=removed).delete()
+        OrderProduct.objects.bulk_create(
+            [OrderProduct(order=self, product_info=product_info, quantity=quantity, price=product_info.price)
+             for product_info, quantity in lines if quantity],
+            update_conflicts=True, unique_fields=['order', 'product_info'], update_fields=['quantity', 'price'],
+        )
+        self.recalculate_total()
+
+    def recalculate_total(self):
+        totals = OrderProduct.objects.filter(order_id=OuterRef('id')).values('order_id').annotate(
+            total=Sum(F('quantity') * F('price'))
+        ).values('total')
+        Order.objects.filter(id=self.id).update(total_price=Coalesce(Subquery(totals), 0))
+        self.refresh_from_db(fields=['total_price'])
+
+    def checkout(self):
+        """
+        Оформление заказа: цены позиций фиксируются по текущим ценам карточек (после этого изменение
+        цены поставщиком не меняет сумму заказа), а позиции раскладываются по заказам магазинов.
+        Возвращает позиции заказа.
+        """
+        order_products = list(self.order_products.select_related('product_info'))
+        subtotals = {}
+        for order_product in order_products:
+            order_product.price = order_product.product_info.price
+            shop_id = order_product.product_info.shop_id
+            subtotals[shop_id] = subtotals.get(shop_id, 0) + order_product.total
+        self.total_price = sum(subtotals.values())
+
+        shop_orders = ShopOrder.objects.bulk_create([
+            ShopOrder(order=self, shop_id=shop_id, status=self.status, created_at=self.created_at, total_price=total)
+            for shop_id, total in subtotals.items()
+        ])
+        shop_order_ids = {shop_order.shop_id: shop_order.id for shop_order in shop_orders}
+        for order_product in order_products:
+            order_product.shop_order_id = shop_order_ids[order_product.product_info.shop_id]
+        OrderProduct.objects.bulk_update(order_products, ['price', 'shop_order'])
+        return order_products
+
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
         ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_at_idx'),
+        ]
+
+
+class ShopOrder(models.Model):
+    order = models.ForeignKey(Order, verbose_name='Заказ', related_name='shop_orders', on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='shop_orders', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(verbose_name='Дата оформления')
+    status = models.CharField(verbose_name='Статус', choices=Order.STATE_CHOICES, default='new', max_length=15)
+    total_price = models.PositiveIntegerField(verbose_name='Сумма позиций магазина', default=0)
+
+    class Meta:
+        verbose_name = 'Заказ магазина'
+        verbose_name_plural = 'Заказы магазинов'
+        ordering = ('-created_at',)
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'shop'], name='unique_shop_order'),
+        ]
+        indexes = [
+            models.Index(fields=['shop', 'created_at', 'id'], name='shop_order_created_at_idx'),
+            models.Index(fields=['shop', 'status', 'created_at', 'id'], name='shop_order_status_idx'),
+        ]
 
 
 class OrderProduct(models.Model):
@@ -184,6 +330,26 @@ class OrderProduct(models.Model):
     product_info = models.ForeignKey(ProductInfo, verbose_name='Заказываемый товар', related_name='order_products',
                                      on_delete=models.CASCADE, blank=True)
     quantity = models.PositiveIntegerField(verbose_name='Количество', default=1)
+    price = models.PositiveIntegerField(verbose_name='Цена за единицу', blank=True)
+    shop_order = models.ForeignKey(ShopOrder, verbose_name='Заказ магазина', related_name='order_products',
+                                   on_delete=models.SET_NULL, blank=True, null=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if {'quantity', 'price'} <= set(field_names):
+            # сумма позиции, уже учтенная в Order.total_price
+            instance.saved_total = instance.total
+        return instance
+
+    @property
+    def total(self):
+        return self.quantity * self.price
+
+    def save(self, *args, **kwargs):
+        if self.price is None:
+            self.price = self.product_info.price
+        super().save(*args, **kwargs)
 
     class Meta:
         verbose_name = 'Заказанный товар'
@@ -191,3 +357,149 @@ class OrderProduct(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['order', 'product_info'], name='unique_order_product'),
         ]
+
+
+class OutboxEvent(models.Model):
+    topic = models.CharField(verbose_name='Тип события', max_length=50)
+    payload = models.JSONField(verbose_name='Данные события')
+    # магазин события (копия payload['shop_id']) для выборки пропущенных событий потока поставщика
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='events', blank=True, null=True,
+                             on_delete=models.SET_NULL, db_index=False)
+    created_at = models.DateTimeField(verbose_name='Дата создания', auto_now_add=True)
+    dispatched_at = models.DateTimeField(verbose_name='Дата передачи в очередь', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Событие заказа'
+        verbose_name_plural = 'События заказов'
+        indexes = [
+            models.Index(fields=['dispatched_at', 'id'], name='outbox_pending_idx'),
+            models.Index(fields=['shop', 'id'], name='outbox_shop_idx'),
+        ]
+
+
+class StatusNotification(models.Model):
+    order = models.ForeignKey(Order, verbose_name='Заказ', related_name='status_notifications',
+                              on_delete=models.CASCADE)
+    recipient = models.EmailField(verbose_name='Получатель')
+    event = models.OneToOneField(OutboxEvent, verbose_name='Событие', related_name='notification',
+                                 on_delete=models.SET_NULL, blank=True, null=True)
+    old_status = models.CharField(verbose_name='Прежний статус', choices=Order.STATE_CHOICES, max_length=15)
+    new_status = models.CharField(verbose_name='Новый статус', choices=Order.STATE_CHOICES, max_length=15)
+    created_at = models.DateTimeField(verbose_name='Дата изменения', auto_now_add=True)
+    sent_at = models.DateTimeField(verbose_name='Дата отправки', blank=True, null=True)
+    claim = models.UUIDField(verbose_name='Отправка, захватившая уведомление', blank=True, null=True)
+    claimed_at = models.DateTimeField(verbose_name='Дата захвата', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Уведомление об изменении статуса'
+        verbose_name_plural = 'Уведомления об изменении статуса'
+        indexes = [
+            models.Index(fields=['sent_at', 'id'], name='notification_pending_idx'),
+        ]
+
+
+class StockBucket(models.Model):
+    product_info = models.ForeignKey(ProductInfo, verbose_name='Карточка товара', related_name='stock_buckets',
+                                     on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(verbose_name='Количество', default=0)
+
+    class Meta:
+        verbose_name = 'Ячейка остатка горячего товара'
+        verbose_name_plural = 'Ячейки остатков горячих товаров'
+
+
+class BestOffer(models.Model):
+    """
+    Индекс лучших предложений: для товара - самые дешевые карточки открытых магазинов, которые есть
+    в наличии, по возрастанию цены (rank 1 - лучшее). Пересчитывается модулем best_offers.
+    """
+    product = models.ForeignKey(Product, verbose_name='Товар', related_name='best_offers', on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField(verbose_name='Место по цене')
+    product_info = models.ForeignKey(ProductInfo, verbose_name='Карточка товара', related_name='best_offers',
+                                     on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='best_offers', on_delete=models.CASCADE)
+    price = models.PositiveIntegerField(verbose_name='Цена')
+
+    class Meta:
+        verbose_name = 'Лучшее предложение'
+        verbose_name_plural = 'Лучшие предложения'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_best_offer_rank'),
+        ]
+
+
+class StockReservation(models.Model):
+    order = models.ForeignKey(Order, verbose_name='Заказ', related_name='stock_reservations',
+                              on_delete=models.CASCADE)
+    product_info = models.ForeignKey(ProductInfo, verbose_name='Карточка товара', related_name='stock_reservations',
+                                     on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    created_at = models.DateTimeField(verbose_name='Дата резервирования', auto_now_add=True)
+    released = models.BooleanField(verbose_name='Резерв снят', default=False)
+
+    class Meta:
+        verbose_name = 'Резерв товара'
+        verbose_name_plural = 'Резервы товаров'
+
+
+class ImportJob(models.Model):
+    STATE_CHOICES = (
+        ('pending', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Завершен'),
+        ('failed', 'Ошибка'),
+        ('superseded', 'Заменен более новым прайс-листом'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(CustomUser, verbose_name='Пользователь', related_name='import_jobs',
+                             on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='import_jobs', on_delete=models.CASCADE,
+                             null=True, blank=True)
+    shop_name = models.CharField(max_length=50, verbose_name='Название магазина в прайс-листе', blank=True)
+    file = models.CharField(max_length=255, verbose_name='Путь к файлу')
+    format = models.CharField(max_length=10, verbose_name='Формат файла', default='yaml')
+    feed = models.JSONField(verbose_name='Заголовки загруженного прайс-листа', default=dict, blank=True)
+    dry_run = models.BooleanField(verbose_name='Без записи в базу', default=False)
+    state = models.CharField(verbose_name='Состояние', choices=STATE_CHOICES, default='pending', max_length=15)
+    rows_processed = models.PositiveIntegerField(verbose_name='Обработано товаров', default=0)
+    stats = models.JSONField(verbose_name='Результат', default=dict, blank=True)
+    errors = models.JSONField(verbose_name='Ошибки', default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'Импорт {self.id} ({self.state})'
+
+    @property
+    def throughput(self):
+        """
+        Скорость обработки, товаров в секунду
+        """
+        if not self.started_at:
+            return 0
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return round(self.rows_processed / elapsed, 1) if elapsed else 0
+
+    class Meta:
+        verbose_name = 'Импорт товаров'
+        verbose_name_plural = 'Импорты товаров'
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['shop_name', 'state'], name='import_job_shop_state_idx'),
+        ]
+
+
+class ImportLock(models.Model):
+    shop_name = models.CharField(max_length=50, verbose_name='Название магазина', unique=True)
+    job = models.OneToOneField(ImportJob, verbose_name='Задача импорта', related_name='lock',
+                               on_delete=models.CASCADE)
+    acquired_at = models.DateTimeField(verbose_name='Время захвата')
+
+    def __str__(self):
+        return f'Импорт магазина {self.shop_name}'
+
+    class Meta:
+        verbose_name = 'Блокировка импорта'
+        verbose_name_plural = 'Блокировки импорта'
@@ -0,0 +1,130 @@
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from ordering_service import catalog
+from ordering_service.models import Category, Parameter
+
+
+class NameCache:
+    """
+    Общий для процесса кэш соответствия названия и id для справочников с уникальным полем name.
+    Справочник загружается целиком одним запросом и перезагружается, когда меняется его счетчик версии
+    в кэше каталога: счетчик увеличивается после фиксации сохранения и удаления записей через ORM
+    и создания недостающих записей, поэтому при общем кэше (Redis) изменения из других процессов тоже видны.
+    После загрузки повторные обращения к известным и отсутствующим названиям не выполняют запросов к базе.
+    Недостающие записи создаются одним bulk_create с ignore_conflicts, поэтому
+    одновременное создание одного названия из разных процессов не приводит к ошибке.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.version_key = f'names:{model._meta.model_name}'
+        self._ids = {}
+        self._missing = set()
+        self._version = None
+        self._lock = threading.Lock()
+        post_save.connect(self._changed, sender=model, weak=False, dispatch_uid=f'name_cache_save_{model.__name__}')
+        post_delete.connect(self._changed, sender=model, weak=False,
+                            dispatch_uid=f'name_cache_delete_{model.__name__}')
+
+    def preload(self, version=None):
+        version = version if version is not None else catalog.get_version(self.version_key)
+        ids = dict(self.model.objects.values_list('name', 'id'))
+        with self._lock:
+            self._ids = ids
+            self._missing = set()
+            self._version = version
+
+    def sync(self):
+        """
+        Перезагрузка справочника, если его версия изменилась с момента загрузки
+        """
+        version = catalog.get_version(self.version_key)
+        if version != self._version:
+            self.preload(version)
+
+    def find(self, name):
+        """
+        id записи с названием name или None, записи не создаются
+        """
+        self.sync()
+        if name in self._ids:
+            return self._ids[name]
+        if name in self._missing:
+            return None
+        found = dict(self.model.objects.filter(name=name).values_list('name', 'id'))
+        if found:
+            self._remember(found)
+        else:
+            with self._lock:
+                self._missing = self._missing | {name}
+        return found.get(name)
+
+    def get(self, name, **defaults):
+        return self.get_many([name], **defaults)[name]
+
+    def get_many(self, names, **defaults):
+        """
+        Словарь {название: id}, отсутствующие в базе названия создаются со значениями полей из defaults
+        """
+        self.sync()
+        names = set(names)
+        ids = self._ids
+        missing = [name for name in names if name not in ids]
+        if not missing:
+            return {name: ids[name] for name in names}
+
+        found = dict(self.model.objects.filter(name__in=missing).values_list('name', 'id'))
+        self._remember(found)
+        absent = [name for name in missing if name not in found]
+        if absent:
+            self.model.objects.bulk_create([self.model(name=name, **defaults) for name in absent],
+                                           ignore_conflicts=True)
+            created = dict(self.model.objects.filter(name__in=absent).values_list('name', 'id'))
+            self._created(created)
+            found.update(created)
+        return {name: ids[name] if name in ids else found[name] for name in names}
+
+    def changed(self):
+        """
+        Увеличение версии справочника после фиксации транзакции: другие процессы перезагрузят его
+        при следующем обращении и уже увидят изменения.
+        """
+        transaction.on_commit(lambda: catalog.bump_keys([self.version_key]))
+
+    def invalidate(self):
+        with self._lock:
+            self._ids = {}
+            self._missing = set()
+            self._version = None
+
+    def _remember(self, ids):
+        with self._lock:
+            self._ids = {**self._ids, **ids}
+            self._missing = self._missing - set(ids)
+
+    def _created(self, ids):
+        """
+        bulk_create не отправляет сигналов, а новые названия могут быть запомнены другими процессами
+        как отсутствующие, поэтому версия увеличивается явно. Если до этого ее никто не менял,
+        свой справочник не перезагружается, а дополняется созданными записями.
+        """
+        known = self._version
+
+        def bump():
+            catalog.bump_keys([self.version_key])
+            version = catalog.get_version(self.version_key)
+            with self._lock:
+                if known is not None and self._version == known and version == known + 1:
+                    self._version = version
+        transaction.on_commit(bump)
+        self._remember(ids)
+
+    def _changed(self, sender, instance, **kwargs):
+        self.changed()
+
+
+parameter_ids = NameCache(Parameter)
+category_ids = NameCache(Category)
@@ -0,0 +1,111 @@
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from ordering_service import outbox
+from ordering_service.importer import chunked
+from ordering_service.models import Order, StatusNotification
+
+logger = logging.getLogger(__name__)
+
+STATUS_NAMES = dict(Order.STATE_CHOICES)
+
+
+@outbox.handler(outbox.ORDER_STATUS_CHANGED)
+def buffer_status_changes(events):
+    """
+    Изменения статуса заказов откладываются в буфер уведомлений. Письма отправляет периодическая
+    задача send_status_notifications: одно письмо на покупателя за все изменения за период.
+    Повторно доставленные события пропускаются по id события.
+    """
+    StatusNotification.objects.bulk_create([
+        StatusNotification(event_id=event['id'], order_id=event['payload']['order_id'],
+                           recipient=event['payload']['recipient'], old_status=event['payload']['old_status'],
+                           new_status=event['payload']['new_status'])
+        for event in events
+    ], ignore_conflicts=True)
+
+
+def coalesce(notifications):
+    """
+    Изменения по получателям: {email: {id заказа: (первый прежний статус, последний новый статус)}}.
+    Заказы, статус которых в итоге не изменился, пропускаются.
+    """
+    changes = {}
+    for notification in sorted(notifications, key=lambda notification: notification.id):
+        orders = changes.setdefault(notification.recipient, {})
+        old_status = orders[notification.order_id][0] if notification.order_id in orders else notification.old_status
+        orders[notification.order_id] = (old_status, notification.new_status)
+    for recipient, orders in changes.items():
+        changes[recipient] = {order_id: change for order_id, change in orders.items() if change[0] != change[1]}
+    return {recipient: orders for recipient, orders in changes.items() if orders}
+
+
+def build_message(recipient, orders, connection):
+    lines = [f'Заказ №{order_id}: статус изменен с "{STATUS_NAMES[old_status]}" на "{STATUS_NAMES[new_status]}".'
+             for order_id, (old_status, new_status) in sorted(orders.items())]
+    subject = 'Изменение статуса заказа' if len(orders) == 1 else 'Изменение статуса заказов'
+    return EmailMessage(subject, '\n'.join(lines), settings.DEFAULT_FROM_EMAIL, [recipient], connection=connection)
+
+
+def claim_pending():
+    """
+    Захват неотправленных уведомлений одним UPDATE, чтобы параллельные запуски не отправили одно письмо дважды:
+    уведомления, захваченные другим запуском, пропускаются. Захват, не завершившийся за
+    NOTIFICATION_CLAIM_TIMEOUT (например, процесс упал во время отправки), считается брошенным.
+    """
+    claim = uuid.uuid4()
+    now = timezone.now()
+    abandoned = now - timedelta(seconds=settings.NOTIFICATION_CLAIM_TIMEOUT)
+    StatusNotification.objects.filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=abandoned),
+                                      sent_at__isnull=True).update(claim=claim, claimed_at=now)
+    return claim, list(StatusNotification.objects.filter(claim=claim).order_by('id'))
+
+
+def send_pending(batch_size=None):
+    """
+    Отправка накопленных уведомлений. Письма отправляются пачками по NOTIFICATION_BATCH_SIZE
+    через одно соединение с почтовым сервером, после каждой пачки ее уведомления отмечаются отправленными.
+    Если пачка не отправилась, ее уведомления освобождаются и остаются в буфере до следующего запуска.
+    Возвращает метрики по каждой пачке.
+    """
+    batch_size = batch_size or settings.NOTIFICATION_BATCH_SIZE
+    claim, pending = claim_pending()
+    if not pending:
+        return []
+    by_recipient = {}
+    for notification in pending:
+        by_recipient.setdefault(notification.recipient, []).append(notification)
+    changes = coalesce(pending)
+
+    metrics = []
+    connection = get_connection()
+    connection.open()
+    try:
+        for recipients in chunked(sorted(by_recipient), batch_size):
+            started = time.perf_counter()
+            messages = [build_message(recipient, changes[recipient], connection)
+                        for recipient in recipients if recipient in changes]
+            notifications = [notification.id for recipient in recipients for notification in by_recipient[recipient]]
+            batch = {'notifications': len(notifications), 'messages': len(messages), 'sent': 0, 'failed': False}
+            try:
+                if messages:
+                    batch['sent'] = connection.send_messages(messages) or 0
+            except Exception:
+                logger.exception('Не удалось отправить пачку уведомлений о статусе заказов')
+                batch['failed'] = True
+            else:
+                StatusNotification.objects.filter(id__in=notifications).update(sent_at=timezone.now())
+            batch['seconds'] = round(time.perf_counter() - started, 3)
+            logger.info('Уведомления о статусе заказов: %s', batch)
+            metrics.append(batch)
+    finally:
+        connection.close()
+        StatusNotification.objects.filter(claim=claim, sent_at__isnull=True).update(claim=None, claimed_at=None)
+    return metrics
@@ -0,0 +1,107 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ordering_service.models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+ORDER_CREATED = 'order.created'
+ORDER_STATUS_CHANGED = 'order.status_changed'
+SHOP_STATE_CHANGED = 'shop.state_changed'
+OFFERS_CHANGED = 'offers.changed'
+
+# обработчики событий по типам: функции, которые получают список событий одного типа
+HANDLERS = {}
+
+
+def handler(topic):
+    def register(func):
+        HANDLERS.setdefault(topic, []).append(func)
+        return func
+    return register
+
+
+def publish(topic, payload):
+    """
+    Запись события в outbox. Вызывается в той же транзакции, что и изменение заказа:
+    если транзакция откатится, события не будет, а брокер в обработке запроса не участвует.
+    """
+    return OutboxEvent.objects.create(topic=topic, payload=payload, shop_id=payload.get('shop_id'))
+
+
+def publish_order_created(order, shop_orders):
+    OutboxEvent.objects.bulk_create([
+        OutboxEvent(topic=ORDER_CREATED, shop_id=shop_order.shop_id,
+                    payload={'order_id': order.id, 'shop_id': shop_order.shop_id, 'shop_order_id': shop_order.id,
+                             'status': shop_order.status, 'total_price': shop_order.total_price})
+        for shop_order in shop_orders
+    ])
+
+
+def publish_status_changed(order, old_status, new_status, shop_id=None):
+    return publish(ORDER_STATUS_CHANGED, {'order_id': order.id, 'shop_id': shop_id, 'recipient': order.user.email,
+                                          'old_status': old_status, 'new_status': new_status})
+
+
+def publish_offers_changed(product_info_ids=(), product_ids=()):
+    publish(OFFERS_CHANGED, {'product_info_ids': list(product_info_ids), 'product_ids': list(product_ids)})
+
+
+def dispatch(send, batch_size=None):
+    """
+    Передача накопленных событий в очередь пачками: send(events) вызывается один раз на пачку.
+    Пачка отмечается переданной в той же транзакции, в которой была выбрана, поэтому при недоступном
+    брокере события остаются в outbox, а параллельные запуски не берут одни и те же строки.
+    Событие может быть передано повторно, если транзакция не зафиксировалась после отправки,
+    поэтому обработчики должны быть идемпотентны по id события. Возвращает количество переданных событий.
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    dispatched = 0
+    while True:
+        with transaction.atomic():
+            events = list(OutboxEvent.objects.select_for_update(skip_locked=True).filter(
+                dispatched_at__isnull=True).order_by('id')[:batch_size])
+            if not events:
+                return dispatched
+            send([{'id': event.id, 'topic': event.topic, 'payload': event.payload} for event in events])
+            OutboxEvent.objects.filter(id__in=[event.id for event in events]).update(dispatched_at=timezone.now())
+        dispatched += len(events)
+
+
+def purge(retention_days=None, batch_size=None):
+    """
+    Удаление событий, переданных в очередь раньше, чем retention_days дней назад. Удаляется пачками,
+    чтобы не держать блокировку на всей таблице. После удаления поток событий поставщика не может
+    восстановить пропущенные события старше этого срока. Возвращает количество удаленных событий.
+    """
+    retention_days = settings.OUTBOX_RETENTION_DAYS if retention_days is None else retention_days
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    before = timezone.now() - timedelta(days=retention_days)
+    purged = 0
+    while True:
+        ids = list(OutboxEvent.objects.filter(dispatched_at__lt=before).order_by('id')
+                   .values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return purged
+        purged += OutboxEvent.objects.filter(id__in=ids).delete()[1].get(OutboxEvent._meta.label, 0)
+
+
+def handle(events):
+    by_topic = {}
+    for event in events:
+        by_topic.setdefault(event['topic'], []).append(event)
+    # ошибка одного обработчика не мешает остальным, задача завершается первой ошибкой после всех обработчиков
+    error = None
+    for topic, topic_events in by_topic.items():
+        for func in HANDLERS.get(topic, []):
+            try:
+                func(topic_events)
+            except Exception as exc:
+                logger.exception('Обработчик %s событий %s завершился ошибкой', func.__name__, topic)
+                error = error or exc
+    if error is not None:
+        raise error
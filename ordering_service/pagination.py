@@ -0,0 +1,188 @@
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# до скольких записей считается точное количество, если база не умеет оценивать его по плану запроса
+COUNT_ESTIMATE_LIMIT = 10000
+
+
+def estimate_count(queryset):
+    """
+    Оценка количества записей без COUNT(*) по всей выборке: на PostgreSQL - по плану запроса,
+    на остальных базах - точный подсчет, ограниченный COUNT_ESTIMATE_LIMIT записями.
+    Возвращает пару (количество, это оценка).
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows']), True
+    count = queryset.order_by()[:COUNT_ESTIMATE_LIMIT + 1].count()
+    return min(count, COUNT_ESTIMATE_LIMIT), count > COUNT_ESTIMATE_LIMIT
+
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничный вывод по ключу сортировки (keyset). Следующая страница выбирается условием
+    (ключ, id) > (ключ последней записи, id последней записи), поэтому глубокие страницы стоят
+    столько же, сколько первая. Сортировка берется из queryset (в том числе из ?ordering=),
+    к ней добавляется id, чтобы порядок был однозначным. Курсор непрозрачный (base64 от JSON).
+    Если выборка отсортирована не по полям модели (например, по релевантности поиска),
+    курсор хранит смещение. С параметром ?count=estimate в ответ добавляется оценка количества записей.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Некорректный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.page_queryset(queryset, request)
+        if request.query_params.get(self.count_query_param) == 'estimate':
+            self.count = estimate_count(queryset)
+        return self.get_page(list(page_queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        То же для асинхронных представлений: страница читается асинхронным ORM
+        """
+        page_queryset = self.page_queryset(queryset, request)
+        if request.query_params.get(self.count_query_param) == 'estimate':
+            self.count = await sync_to_async(estimate_count)(queryset)
+        return self.get_page([obj async for obj in page_queryset])
+
+    def page_queryset(self, queryset, request):
+        """
+        Запрос страницы по курсору: на одну запись больше размера страницы, чтобы узнать, есть ли следующая
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.count = None
+
+        self.keys = self.get_keys(queryset)
+        cursor = self.decode_cursor(request)
+        if self.keys is None:
+            offset = cursor.get('o', 0) if cursor else 0
+            if not isinstance(offset, int) or offset < 0:
+                raise NotFound(self.invalid_cursor_message)
+            self.next_position = {'o': offset + self.page_size}
+            return queryset[offset:offset + self.page_size + 1]
+        queryset = queryset.order_by(*self.keys)
+        if cursor:
+            queryset = queryset.filter(self.after(cursor.get('k')))
+        return queryset[:self.page_size + 1]
+
+    def get_page(self, page):
+        if self.keys is not None and page:
+            last = page[min(len(page), self.page_size) - 1]
+            self.next_position = {'k': [self.dump_value(getattr(last, self.model._meta.get_field(key.lstrip('-')).attname))
+                                        for key in self.keys]}
+        self.has_next = len(page) > self.page_size
+        return page[:self.page_size]
+
+    def get_paginated_response(self, data):
+        response = {'next': self.get_next_link()}
+        if self.count is not None:
+            response['count'], response['count_is_estimate'] = self.count
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer'},
+                'count_is_estimate': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_keys(self, queryset):
+        """
+        Поля сортировки с добавленным id или None, если сортировка не по полям модели
+        """
+        opts = queryset.model._meta
+        ordering = []
+        for key in queryset.query.order_by or opts.ordering:
+            if not isinstance(key, str):
+                return None
+            descending, name = key.startswith('-'), key.lstrip('-')
+            if name == 'pk':
+                name = opts.pk.name
+            try:
+                opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            ordering.append(f'-{name}' if descending else name)
+        if opts.pk.name not in [key.lstrip('-') for key in ordering]:
+            descending = ordering and ordering[0].startswith('-')
+            ordering.append(f'-{opts.pk.name}' if descending else opts.pk.name)
+        self.model = queryset.model
+        return ordering
+
+    def after(self, values):
+        """
+        Условие "строго после" позиции курсора в лексикографическом порядке ключей
+        """
+        if not isinstance(values, list) or len(values) != len(self.keys):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            values = [self.model._meta.get_field(key.lstrip('-')).to_python(value)
+                      for key, value in zip(self.keys, values)]
+        except DjangoValidationError:
+            raise NotFound(self.invalid_cursor_message)
+        conditions = []
+        for i, key in enumerate(self.keys):
+            name = key.lstrip('-')
+            lookup = 'lt' if key.startswith('-') else 'gt'
+            equal = {prefix.lstrip('-'): value for prefix, value in zip(self.keys[:i], values[:i])}
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': values[i]}))
+        return reduce(or_, conditions)
+
+    def dump_value(self, value):
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(cursor, dict):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        encoded = base64.urlsafe_b64encode(json.dumps(self.next_position).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
@@ -0,0 +1,391 @@
+import csv
+import io
+import json
+import os
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+class PriceListError(ValueError):
+    """
+    Ошибка структуры прайс-листа. В line - номер строки файла, если его удалось определить.
+    """
+
+    def __init__(self, message, line=None):
+        super().__init__(message)
+        self.line = line
+
+
+def yaml_error(error):
+    mark = getattr(error, 'problem_mark', None) or getattr(error, 'context_mark', None)
+    return PriceListError(f'Некорректный YAML: {error}', line=mark.line + 1 if mark else None)
+
+
+def compose_scalar(loader, event):
+    tag = event.tag
+    if tag is None or tag == '!':
+        tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+    return yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+
+
+class YamlPriceListReader:
+    """
+    Потоковое чтение прайс-листа в формате YAML.
+    Файл разбирается по событиям парсера, поэтому в памяти одновременно находится только один товар из goods.
+    Ключи shop и categories читаются сразу, товары отдаются генератором goods(),
+    а вместе с номерами строк - генератором numbered_goods().
+    """
+
+    def __init__(self, stream):
+        self.loader = SafeLoader(stream)
+        self.shop = None
+        self.categories = None
+        self._buffered_goods = None
+        try:
+            self._read_header()
+        except yaml.YAMLError as e:
+            raise yaml_error(e)
+
+    def goods(self):
+        for _, item in self.numbered_goods():
+            yield item
+
+    def numbered_goods(self):
+        try:
+            if self._buffered_goods is not None:
+                for node in self._buffered_goods.value:
+                    yield node.start_mark.line + 1, self._construct(node)
+                self._buffered_goods = None
+                return
+            if not self._goods_started:
+                return
+            while not self.loader.check_event(yaml.SequenceEndEvent):
+                node = self._compose_node()
+                yield node.start_mark.line + 1, self._construct(node)
+            self.loader.get_event()
+            self._read_rest()
+        except yaml.YAMLError as e:
+            raise yaml_error(e)
+        finally:
+            self.loader.dispose()
+
+    def _read_header(self):
+        self._expect(yaml.StreamStartEvent)
+        self._expect(yaml.DocumentStartEvent)
+        self._expect(yaml.MappingStartEvent)
+        self._goods_started = False
+        while not self.loader.check_event(yaml.MappingEndEvent):
+            key = self._construct(self._compose_node())
+            if key == 'goods':
+                if self.shop is not None and self.categories is not None:
+                    self._expect(yaml.SequenceStartEvent)
+                    self._goods_started = True
+                    return
+                # товары идут раньше магазина и категорий, поэтому их приходится держать в памяти
+                self._buffered_goods = self._compose_node()
+                if not isinstance(self._buffered_goods, yaml.SequenceNode):
+                    raise PriceListError('goods должен быть списком товаров',
+                                         line=self._buffered_goods.start_mark.line + 1)
+            elif key == 'shop':
+                self.shop = self._construct(self._compose_node())
+            elif key == 'categories':
+                self.categories = self._construct(self._compose_node())
+            else:
+                self._compose_node()
+        self.loader.get_event()
+        if self.shop is None or self.categories is None:
+            raise PriceListError('В прайс-листе должны быть указаны shop и categories')
+
+    def _read_rest(self):
+        while not self.loader.check_event(yaml.MappingEndEvent):
+            self._compose_node()
+
+    def _expect(self, event_class):
+        event = self.loader.get_event()
+        if not isinstance(event, event_class):
+            raise PriceListError(f'Неверная структура прайс-листа (строка {event.start_mark.line + 1})',
+                                 line=event.start_mark.line + 1)
+        return event
+
+    def _compose_node(self):
+        event = self.loader.get_event()
+        if isinstance(event, yaml.ScalarEvent):
+            return compose_scalar(self.loader, event)
+        if isinstance(event, yaml.SequenceStartEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = self.loader.resolve(yaml.SequenceNode, None, event.implicit)
+            node = yaml.SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            while not self.loader.check_event(yaml.SequenceEndEvent):
+                node.value.append(self._compose_node())
+            node.end_mark = self.loader.get_event().end_mark
+            return node
+        if isinstance(event, yaml.MappingStartEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = self.loader.resolve(yaml.MappingNode, None, event.implicit)
+            node = yaml.MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            while not self.loader.check_event(yaml.MappingEndEvent):
+                node.value.append((self._compose_node(), self._compose_node()))
+            node.end_mark = self.loader.get_event().end_mark
+            return node
+        raise PriceListError(f'Ссылки и якоря в прайс-листе не поддерживаются (строка {event.start_mark.line + 1})',
+                             line=event.start_mark.line + 1)
+
+    def _construct(self, node):
+        return self.loader.construct_document(node)
+
+
+class JsonPriceListReader:
+    """
+    Чтение прайс-листа в формате JSON с той же структурой, что и YAML (shop, categories, goods).
+    Документ JSON разбирается целиком, для больших прайс-листов лучше подходит NDJSON.
+    Номера строк товаров в JSON не сохраняются, numbered_goods() отдает вместо них None.
+    """
+
+    def __init__(self, stream):
+        try:
+            data = json.load(io.TextIOWrapper(stream, encoding='utf-8-sig'))
+        except json.JSONDecodeError as e:
+            raise PriceListError(f'Некорректный JSON: {e}', line=e.lineno)
+        except ValueError as e:
+            raise PriceListError(f'Некорректный JSON: {e}')
+        if not isinstance(data, dict) or 'shop' not in data or 'categories' not in data:
+            raise PriceListError('В прайс-листе должны быть указаны shop и categories')
+        self.shop = data['shop']
+        self.categories = data['categories']
+        self._goods = data.get('goods') or []
+
+    def goods(self):
+        yield from self._goods
+
+    def numbered_goods(self):
+        for item in self._goods:
+            yield None, item
+
+
+class NdjsonPriceListReader:
+    """
+    Потоковое чтение прайс-листа в формате NDJSON.
+    Первая строка содержит объект с ключами shop и categories, каждая следующая строка - один товар.
+    """
+
+    def __init__(self, stream):
+        self.lines = io.TextIOWrapper(stream, encoding='utf-8-sig')
+        self.line_number = 0
+        header = next(self._records(), None)
+        if not isinstance(header, dict) or 'shop' not in header or 'categories' not in header:
+            raise PriceListError('Первая строка прайс-листа должна содержать shop и categories')
+        self.shop = header['shop']
+        self.categories = header['categories']
+
+    def goods(self):
+        yield from self._records()
+
+    def numbered_goods(self):
+        for item in self._records():
+            yield self.line_number, item
+
+    def _records(self):
+        for line in self.lines:
+            self.line_number += 1
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise PriceListError(f'Некорректный JSON в строке {self.line_number}: {e}', line=self.line_number)
+
+
+class CsvPriceListReader:
+    """
+    Чтение прайс-листа в формате CSV: одна строка - один товар.
+    Обязательные колонки: shop, category_id, category, id, name, model, price, price_rrc, quantity,
+    остальные колонки считаются параметрами товара, пустые значения параметров пропускаются.
+    Файл читается два раза: первый проход собирает магазин и категории, второй отдает товары.
+    Значения, которые не удалось привести к числу, остаются строками и отклоняются при проверке прайс-листа.
+    """
+    columns = ('shop', 'category_id', 'category', 'id', 'name', 'model', 'price', 'price_rrc', 'quantity')
+    integer_columns = ('id', 'price', 'price_rrc', 'quantity')
+
+    def __init__(self, stream):
+        self.lines = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        self.shop = None
+        categories = {}
+        for _, row in self._rows():
+            self.shop = self.shop or row['shop']
+            categories.setdefault(row['category_id'], row['category'])
+        if self.shop is None:
+            raise PriceListError('В прайс-листе должны быть указаны shop и categories')
+        self.categories = [{'id': category_id, 'name': name} for category_id, name in categories.items()]
+
+    def goods(self):
+        for _, item in self.numbered_goods():
+            yield item
+
+    def numbered_goods(self):
+        for line, row in self._rows():
+            yield line, {
+                'id': row['id'],
+                'category': row['category_id'],
+                'model': row['model'],
+                'name': row['name'],
+                'price': row['price'],
+                'price_rrc': row['price_rrc'],
+                'quantity': row['quantity'],
+                'parameters': {name: value for name, value in row.items() if name not in self.columns and value},
+            }
+
+    def _rows(self):
+        self.lines.seek(0)
+        reader = csv.DictReader(self.lines)
+        missing = set(self.columns) - set(reader.fieldnames or ())
+        if missing:
+            raise PriceListError(f'В прайс-листе нет колонок: {", ".join(sorted(missing))}', line=1)
+        for row in reader:
+            for column in ('category_id',) + self.integer_columns:
+                try:
+                    row[column] = int(row[column])
+                except (TypeError, ValueError):
+                    pass
+            yield reader.line_num, row
+
+
+READERS = {
+    'yaml': YamlPriceListReader,
+    'json': JsonPriceListReader,
+    'ndjson': NdjsonPriceListReader,
+    'csv': CsvPriceListReader,
+}
+
+CONTENT_TYPES = {
+    'application/yaml': 'yaml',
+    'application/x-yaml': 'yaml',
+    'text/yaml': 'yaml',
+    'text/x-yaml': 'yaml',
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+}
+
+EXTENSIONS = {
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.json': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+}
+
+
+def skip_yaml_node(loader, event):
+    """
+    Пропуск узла YAML, который начинается событием event, без построения узлов
+    """
+    depth = int(isinstance(event, (yaml.SequenceStartEvent, yaml.MappingStartEvent)))
+    while depth:
+        event = loader.get_event()
+        if isinstance(event, (yaml.SequenceStartEvent, yaml.MappingStartEvent)):
+            depth += 1
+        elif isinstance(event, (yaml.SequenceEndEvent, yaml.MappingEndEvent)):
+            depth -= 1
+
+
+def yaml_shop_name(stream):
+    loader = SafeLoader(stream)
+    try:
+        loader.get_event()
+        loader.get_event()
+        if not isinstance(loader.get_event(), yaml.MappingStartEvent):
+            return None
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = loader.get_event()
+            if isinstance(key, yaml.ScalarEvent) and key.value == 'shop':
+                event = loader.get_event()
+                if not isinstance(event, yaml.ScalarEvent):
+                    raise PriceListError('shop должен быть строкой', line=event.start_mark.line + 1)
+                return loader.construct_document(compose_scalar(loader, event))
+            skip_yaml_node(loader, key)
+            skip_yaml_node(loader, loader.get_event())
+    except yaml.YAMLError as e:
+        raise yaml_error(e)
+    finally:
+        loader.dispose()
+    return None
+
+
+def json_shop_name(stream, chunk_size=65536):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    depth, in_string, escape = 0, False, False
+    # ключ объекта верхнего уровня: последняя строка на первом уровне вложенности перед двоеточием
+    token, key = None, None
+    while chunk := text.read(chunk_size):
+        for position, char in enumerate(chunk):
+            if in_string:
+                if escape:
+                    escape = False
+                elif char == '\\':
+                    escape = True
+                elif char == '"':
+                    in_string = False
+                    if token is not None:
+                        key, token = ''.join(token), None
+                    continue
+                if token is not None:
+                    token.append(char)
+            elif char == '"':
+                in_string = True
+                token = [] if depth == 1 else None
+            elif char in '{[':
+                depth += 1
+            elif char in '}]':
+                depth -= 1
+                if depth == 0:
+                    return None
+            elif char == ':' and depth == 1 and key == 'shop':
+                # значение shop - короткая строка: хватает остатка куска и еще одного куска
+                rest = (chunk[position + 1:] + text.read(chunk_size)).lstrip()
+                try:
+                    return json.JSONDecoder().raw_decode(rest)[0]
+                except json.JSONDecodeError as e:
+                    raise PriceListError(f'Некорректный JSON: {e}')
+    return None
+
+
+def read_shop_name(stream, price_list_format):
+    """
+    Название магазина из прайс-листа. YAML и JSON читаются только до ключа shop верхнего уровня:
+    значения, которые идут раньше (например, товары), пропускаются без разбора и не держатся в памяти
+    """
+    if price_list_format == 'csv':
+        row = next(csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')), None)
+        shop = row.get('shop') if row else None
+    elif price_list_format == 'yaml':
+        shop = yaml_shop_name(stream)
+    elif price_list_format == 'json':
+        shop = json_shop_name(stream)
+    else:
+        shop = READERS[price_list_format](stream).shop
+    if not shop:
+        raise PriceListError('В прайс-листе должны быть указаны shop и categories')
+    return shop
+
+
+def detect_format(filename=None, content_type=None):
+    """
+    Определение формата прайс-листа по типу содержимого, а если он не указан - по расширению файла
+    """
+    if content_type:
+        price_list_format = CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+        if price_list_format:
+            return price_list_format
+    if filename:
+        return EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+    return None
@@ -0,0 +1,134 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS, ManyRelatedField
+
+
+def to_key(field, value):
+    """
+    Значение id, приведенное к типу первичного ключа, или None, если значение не разбирается
+    """
+    if isinstance(value, bool):
+        return None
+    try:
+        if field.pk_field is not None:
+            value = field.pk_field.to_internal_value(value)
+        return field.get_queryset().model._meta.pk.to_python(value)
+    except (DjangoValidationError, serializers.ValidationError, TypeError, ValueError):
+        return None
+
+
+def resolve(field, values):
+    """
+    Поиск объектов по списку id одним запросом in_bulk.
+    Возвращает словарь {id: объект} и список значений, по которым ничего не нашлось.
+    """
+    keys = [(value, to_key(field, value)) for value in values]
+    objects = field.get_queryset().in_bulk({key for value, key in keys if key is not None})
+    return objects, [value for value, key in keys if key not in objects]
+
+
+def not_found_message(missing):
+    return f"Объекты не найдены: {', '.join(dict.fromkeys(map(str, missing)))}"
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Связь по id, которая не делает запрос на каждое значение: если поле находится внутри BulkListSerializer
+    (или это список many=True), объекты заранее загружены одним запросом на все значения.
+    """
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def resolved(self):
+        """
+        Объекты, загруженные ближайшим BulkListSerializer для этого поля, или None
+        """
+        name = self.field_name if not isinstance(self.parent, BulkManyRelatedField) else self.parent.field_name
+        parent = self.parent
+        while parent is not None:
+            if getattr(parent, 'resolved', None) is not None and name in parent.resolved:
+                return parent.resolved[name]
+            parent = parent.parent
+        return None
+
+    def to_internal_value(self, data):
+        resolved = self.resolved()
+        if resolved is None:
+            return super().to_internal_value(data)
+        key = to_key(self, data)
+        if key is None:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if key not in resolved:
+            self.fail('does_not_exist', pk_value=data)
+        return resolved[key]
+
+
+class BulkManyRelatedField(ManyRelatedField):
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        if self.child_relation.resolved() is None:
+            objects, missing = resolve(self.child_relation, data)
+            if missing:
+                raise serializers.ValidationError(not_found_message(missing))
+            return [objects[to_key(self.child_relation, value)] for value in data]
+        return [self.child_relation.to_internal_value(value) for value in data]
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    Список вложенных объектов, в котором все id связанных объектов (BulkPrimaryKeyRelatedField)
+    собираются по всему списку и загружаются одним запросом in_bulk на каждое поле.
+    Ненайденные id сообщаются все сразу.
+    """
+
+    def to_internal_value(self, data):
+        self.resolved = None
+        if isinstance(data, list):
+            self.resolved = self.preload(data)
+        return super().to_internal_value(data)
+
+    def bulk_fields(self):
+        fields = {}
+        for name, field in self.child.fields.items():
+            if field.read_only:
+                continue
+            if isinstance(field, BulkManyRelatedField):
+                fields[name] = (field.child_relation, True)
+            elif isinstance(field, BulkPrimaryKeyRelatedField):
+                fields[name] = (field, False)
+        return fields
+
+    def preload(self, data):
+        resolved, errors = {}, {}
+        for name, (field, many) in self.bulk_fields().items():
+            values = []
+            for item in data:
+                value = item.get(name) if isinstance(item, dict) else None
+                if many and isinstance(value, list):
+                    values.extend(value)
+                elif not many and value is not None:
+                    values.append(value)
+            resolved[name], missing = resolve(field, values)
+            if missing:
+                errors[name] = [not_found_message(missing)]
+        if errors:
+            raise serializers.ValidationError(errors)
+        return resolved
+
+
+class BulkModelSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer, у которого связи по id разрешаются пакетно. Чтобы пакетно загружался и список
+    таких объектов (many=True), в Meta указывается list_serializer_class = BulkListSerializer.
+    """
+    serializer_related_field = BulkPrimaryKeyRelatedField
@@ -11,8 +11,15 @@ from ordering_service.models import (
     ProductInfoParameter,
     OrderProduct,
     Order,
-    Parameter
+    ShopOrder,
+    Parameter,
+    BestOffer,
+    ImportJob
 )
+from ordering_service.feeds import FeedError, check_url
+from ordering_service.names import parameter_ids
+from ordering_service.relations import BulkListSerializer, BulkModelSerializer, BulkPrimaryKeyRelatedField
+from ordering_service.units import parse_numeric
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -55,9 +62,18 @@ class ContactSerializer(serializers.ModelSerializer):
 class ShopSerializer(serializers.ModelSerializer):
     class Meta:
         model = Shop
-        fields = ['id', 'user', 'name', 'state']
+        fields = ['id', 'user', 'name', 'url', 'state']
         read_only_fields = ['user']
 
+    def validate_url(self, value):
+        # по ссылке прайс-лист загружается с сервера, поэтому внутренние адреса запрещены
+        if value:
+            try:
+                check_url(value)
+            except FeedError as e:
+                raise serializers.ValidationError(str(e))
+        return value
+
 
 class CategorySerializer(serializers.ModelSerializer):
     shops = ShopSerializer(many=True)
@@ -82,50 +98,57 @@ class ProductInfoParameterSerializer(serializers.ModelSerializer):
         fields = ['parameter', 'value']
 
 
-class ProductInfoSerializer(serializers.ModelSerializer):
+class ProductInfoSerializer(BulkModelSerializer):
     product_info_parameters = ProductInfoParameterSerializer(many=True)
 
     class Meta:
         model = ProductInfo
         fields = ['id', 'product', 'shop', 'model', 'quantity', 'price', 'price_rrc', 'product_info_parameters']
+        list_serializer_class = BulkListSerializer
 
     def create(self, validated_data):
         parameters_data = validated_data.pop('product_info_parameters')
         product_info = ProductInfo.objects.create(**validated_data)
         for parameter_data in parameters_data:
             parameter = parameter_data.pop('parameter')
-            parameter_obj, _ = Parameter.objects.get_or_create(name=parameter['name'])
-            ProductInfoParameter.objects.create(product_info=product_info, parameter=parameter_obj, **parameter_data)
+            ProductInfoParameter.objects.create(product_info=product_info,
+                                                parameter_id=parameter_ids.get(parameter['name']),
+                                                numeric_value=parse_numeric(parameter_data['value'], parameter['name']),
+                                                **parameter_data)
         return product_info
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(BulkModelSerializer):
     class Meta:
         model = Product
         fields = ['id', 'name', 'category', 'products_info']
+        list_serializer_class = BulkListSerializer
 
 
-class OrderProductSerializer(serializers.ModelSerializer):
+class BestOfferSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BestOffer
+        fields = ['rank', 'product_info', 'shop', 'price']
+
+
+class OrderProductSerializer(BulkModelSerializer):
     class Meta:
         model = OrderProduct
-        fields = ['id', 'order', 'product_info', 'quantity']
+        fields = ['id', 'order', 'product_info', 'quantity', 'price']
+        read_only_fields = ['price']
+        # снятые с продажи карточки нельзя добавить в заказ
+        extra_kwargs = {'product_info': {'queryset': ProductInfo.objects.filter(is_active=True)}}
+        list_serializer_class = BulkListSerializer
 
 
 class OrderSerializer(serializers.ModelSerializer):
     order_products = OrderProductSerializer(many=True)
     contact = ContactSerializer(required=False)
-    total_price = serializers.SerializerMethodField()
 
     class Meta:
         model = Order
         fields = ['id', 'user', 'created_at', 'status', 'contact', 'order_products', 'total_price']
-        read_only_fields = ['user', 'contact']
-
-    def get_total_price(self, obj):
-        total = 0
-        for order_product in obj.order_products.all():
-            total += order_product.quantity * order_product.product_info.price
-        return total
+        read_only_fields = ['user', 'contact', 'total_price']
 
     def create(self, validated_data):
         products_data = validated_data.pop('order_products')
@@ -137,45 +160,75 @@ class OrderSerializer(serializers.ModelSerializer):
 
         if basket_order:
             basket = basket_order
-            for product in products_data:
-                OrderProduct.objects.update_or_create(
-                    order=basket,
-                    product_info=product['product_info'],
-                    defaults={'order': basket, 'product_info': product['product_info'], 'quantity': product['quantity']}
-                )
-
         else:
             basket = Order.objects.create(**validated_data)
-            for product in products_data:
-                OrderProduct.objects.create(order=basket, **product)
-
+        basket.set_products(products_data)
         return basket
 
     def update(self, instance, validated_data):
         products_data = validated_data.pop('order_products')
         basket, _ = Order.objects.get_or_create(**validated_data)
-
-        for product in products_data:
-            product_obj, _ = OrderProduct.objects.update_or_create(
-                order=basket,
-                product_info=product['product_info'],
-                defaults={'order': basket, 'product_info': product['product_info'], 'quantity': product['quantity']}
-            )
+        basket.set_products(products_data)
         return basket
 
 
+class BasketLineSerializer(serializers.Serializer):
+    product_info = BulkPrimaryKeyRelatedField(queryset=ProductInfo.objects.filter(is_active=True).only(
+        'id', 'shop_id', 'price'))
+    quantity = serializers.IntegerField(min_value=0)
+
+    class Meta:
+        list_serializer_class = BulkListSerializer
+
+
+class BasketBatchSerializer(serializers.Serializer):
+    """
+    Пакетное изменение корзины: все карточки товаров проверяются одним запросом
+    """
+    order_products = BasketLineSerializer(many=True, allow_empty=False)
+
+    def validate_order_products(self, value):
+        ids = [line['product_info'].id for line in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError("Товар указан в списке несколько раз")
+        return value
+
+
 class OrderNewSerializer(serializers.ModelSerializer):
     order_products = OrderProductSerializer(many=True)
     contact = ContactSerializer(required=False)
-    total_price = serializers.SerializerMethodField()
 
     class Meta:
         model = Order
         fields = ['id', 'user', 'created_at', 'status', 'contact', 'order_products', 'total_price']
-        read_only_fields = ['user', 'contact']
+        read_only_fields = ['user', 'contact', 'total_price']
+
+
+class ShopOrderSerializer(serializers.ModelSerializer):
+    order_products = OrderProductSerializer(many=True, read_only=True)
+    contact = ContactSerializer(source='order.contact', read_only=True)
 
-    def get_total_price(self, obj):
-        total = 0
-        for order_product in obj.order_products.all():
-            total += order_product.quantity * order_product.product_info.price
-        return total
+    class Meta:
+        model = ShopOrder
+        fields = ['id', 'order', 'shop', 'created_at', 'status', 'contact', 'order_products', 'total_price']
+        read_only_fields = ['order', 'shop', 'created_at', 'total_price']
+
+    def validate_status(self, value):
+        """
+        Отмененный заказ не возвращается в работу: товар при отмене вернулся на склад и снова не резервируется.
+        Вернуть заказ в корзину тоже нельзя.
+        """
+        if value == 'basket':
+            raise serializers.ValidationError('Заказ нельзя вернуть в корзину')
+        if self.instance is not None and self.instance.status == 'canceled' and value != 'canceled':
+            raise serializers.ValidationError('Отмененный заказ нельзя вернуть в работу')
+        return value
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    throughput = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'state', 'dry_run', 'rows_processed', 'throughput', 'stats', 'errors', 'created_at',
+                  'started_at', 'finished_at']
@@ -0,0 +1,73 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from ordering_service import catalog, outbox
+from ordering_service.models import Shop, ProductInfo, ProductInfoParameter, Order, OrderProduct
+
+# отправляется после фиксации изменений карточек товаров, shop_ids - магазины, чьи карточки изменились,
+# parameters - могли измениться параметры или состав карточек (а не только остатки и цены)
+offers_changed = Signal()
+
+
+def send_offers_changed(shop_ids, parameters=True):
+    transaction.on_commit(lambda: offers_changed.send(sender=ProductInfo, shop_ids=list(shop_ids),
+                                                      parameters=parameters))
+
+
+@receiver([post_save, post_delete], sender=ProductInfo)
+def offer_changed(sender, instance, created=False, **kwargs):
+    # параметры карточки сохраняются отдельно, поэтому для индекса параметров важны только создание и удаление
+    send_offers_changed([instance.shop_id], parameters=created or kwargs['signal'] is post_delete)
+
+
+@receiver(post_save, sender=ProductInfo)
+def offer_saved(sender, instance, **kwargs):
+    outbox.publish_offers_changed(product_info_ids=[instance.id])
+
+
+@receiver(post_delete, sender=ProductInfo)
+def offer_deleted(sender, instance, **kwargs):
+    outbox.publish_offers_changed(product_ids=[instance.product_id])
+
+
+@receiver(post_save, sender=Shop)
+def shop_saved(sender, instance, created, **kwargs):
+    if not created and getattr(instance, 'saved_state', None) != instance.state:
+        outbox.publish(outbox.SHOP_STATE_CHANGED, {'shop_id': instance.id, 'state': instance.state})
+    instance.saved_state = instance.state
+
+
+@receiver([post_save, post_delete], sender=ProductInfoParameter)
+def offer_parameter_changed(sender, instance, **kwargs):
+    shop_id = ProductInfo.objects.filter(id=instance.product_info_id).values_list('shop_id', flat=True).first()
+    send_offers_changed([shop_id])
+
+
+@receiver(offers_changed)
+def reset_catalog_cache(sender, shop_ids, parameters=True, **kwargs):
+    catalog.bump_versions(shop_ids)
+    if parameters:
+        catalog.bump_facet_versions(shop_ids)
+
+
+def add_to_order_total(order_id, delta):
+    if delta:
+        Order.objects.filter(id=order_id).update(total_price=F('total_price') + delta)
+
+
+@receiver(post_save, sender=OrderProduct)
+def order_product_saved(sender, instance, created, **kwargs):
+    if created:
+        add_to_order_total(instance.order_id, instance.total)
+    elif hasattr(instance, 'saved_total'):
+        add_to_order_total(instance.order_id, instance.total - instance.saved_total)
+    else:
+        Order(id=instance.order_id).recalculate_total()
+    instance.saved_total = instance.total
+
+
+@receiver(post_delete, sender=OrderProduct)
+def order_product_deleted(sender, instance, **kwargs):
+    add_to_order_total(instance.order_id, -getattr(instance, 'saved_total', instance.total))
@@ -0,0 +1,286 @@
+import csv
+import io
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+from ordering_service.importer import GoodsImporter, chunked
+from ordering_service.models import (
+    Category, Product, ProductInfo, Parameter, ProductInfoParameter, StockBucket
+)
+from ordering_service.names import parameter_ids
+from ordering_service.units import parse_numeric
+
+OFFER_COLUMNS = ('external_id', 'seq', 'category_name', 'product_name', 'model', 'quantity', 'price', 'price_rrc')
+PARAMETER_COLUMNS = ('external_id', 'seq', 'name', 'value', 'numeric_value')
+
+
+def copy_rows(table, columns, rows):
+    """
+    Загрузка строк в промежуточную таблицу: COPY на PostgreSQL, многострочный INSERT на остальных базах
+    """
+    quote = connection.ops.quote_name
+    column_list = ', '.join(quote(column) for column in columns)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor.copy_expert(f'COPY {quote(table)} ({column_list}) FROM STDIN WITH (FORMAT csv)', buffer)
+            return
+        row_placeholder = '(' + ', '.join(['%s'] * len(columns)) + ')'
+        rows_per_statement = (connection.features.max_query_params or 999) // len(columns)
+        for batch in chunked(rows, rows_per_statement):
+            cursor.execute(
+                f'INSERT INTO {quote(table)} ({column_list}) VALUES {", ".join([row_placeholder] * len(batch))}',
+                [value for row in batch for value in row]
+            )
+
+
+def stage_group(tables, offers, parameters):
+    """
+    Загрузка группы товаров одной категории из пачки. Выполняется в отдельном процессе со своим соединением с базой.
+    """
+    try:
+        copy_rows(tables['offers'], OFFER_COLUMNS, offers)
+        copy_rows(tables['parameters'], PARAMETER_COLUMNS, parameters)
+    finally:
+        connection.close()
+    return len(offers)
+
+
+class StagedGoodsImporter(GoodsImporter):
+    """
+    Импорт через промежуточные таблицы для самых больших прайс-листов.
+    Товары загружаются в промежуточные таблицы по мере чтения файла, пачка за пачкой, группами по категориям
+    (на PostgreSQL при GOODS_IMPORT_STAGING_WORKERS > 1 запись групп идет параллельно в пуле процессов,
+    но чтение и разбор файла остаются последовательными в основном процессе),
+    после чего несколькими запросами INSERT ... SELECT / UPDATE ... FROM сливаются
+    в Product, ProductInfo, Parameter и ProductInfoParameter. Промежуточные таблицы удаляются после слияния.
+
+    В отличие от GoodsImporter изменение только параметров товара не учитывается в счетчике updated,
+    а карточки без артикула поставщика не сопоставляются с товарами файла, а снимаются с продажи.
+    """
+
+    def __init__(self, user, batch_size=None, dry_run=False, workers=None):
+        super().__init__(user, batch_size=batch_size, dry_run=dry_run)
+        self.workers = workers or settings.GOODS_IMPORT_STAGING_WORKERS
+        # номер строки в файле: из повторов одного артикула остается последний
+        self.seq = 0
+        suffix = uuid.uuid4().hex[:12]
+        self.tables = {
+            'offers': f'ordering_service_staging_{suffix}',
+            'parameters': f'ordering_service_staging_{suffix}_parameters',
+        }
+
+    def run(self, price_list):
+        return self.run_in_chunks(price_list)
+
+    def run_in_chunks(self, price_list, progress=None):
+        """
+        После загрузки каждой пачки в промежуточные таблицы вызывается progress(количество товаров в пачке)
+        """
+        with transaction.atomic():
+            self.import_shop(price_list.shop)
+            self.import_categories(price_list.categories)
+        self._create_tables()
+        try:
+            if self._parallel():
+                self._stage_in_pool(price_list, progress)
+            else:
+                for chunk in chunked(price_list.goods(), self.batch_size):
+                    self.import_chunk(chunk)
+                    if progress is not None:
+                        progress(len(chunk))
+            with transaction.atomic():
+                self._deduplicate()
+                self._count()
+                if not self.dry_run:
+                    self._merge()
+        finally:
+            self._drop_tables()
+        return self.stats
+
+    def import_chunk(self, goods):
+        for offers, parameters in self._groups(goods):
+            copy_rows(self.tables['offers'], OFFER_COLUMNS, offers)
+            copy_rows(self.tables['parameters'], PARAMETER_COLUMNS, parameters)
+
+    def _groups(self, goods):
+        groups = {}
+        for product_data in goods:
+            self.seq += 1
+            category = self.category_names[product_data['category']]
+            offers, parameters = groups.setdefault(category, ([], []))
+            offers.append((product_data['id'], self.seq, category, product_data['name'], product_data['model'],
+                           product_data['quantity'], product_data['price'], product_data['price_rrc']))
+            parameters.extend((product_data['id'], self.seq, name, str(value), parse_numeric(value, name))
+                              for name, value in product_data['parameters'].items())
+        return groups.values()
+
+    def _parallel(self):
+        """
+        Пул процессов имеет смысл только там, где запись в таблицы идет параллельно: на SQLite пишущие
+        транзакции выполняются по одной, и процессы только ждали бы блокировку базы.
+        Дочерние процессы не видят таблицы, созданные в незафиксированной транзакции.
+        """
+        return self.workers > 1 and connection.vendor == 'postgresql' and not connection.in_atomic_block
+
+    def _stage_in_pool(self, price_list, progress):
+        """
+        Параллельно выполняется только запись групп в промежуточные таблицы (COPY/INSERT).
+        Файл читается одним потоком в основном процессе: price_list.goods() и разбиение на группы
+        идут последовательно, поэтому на медленном разборе (YAML) пул почти не ускоряет импорт.
+        """
+        # дочерние процессы открывают собственные соединения
+        connections.close_all()
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for chunk in chunked(price_list.goods(), self.batch_size):
+                pending.extend(executor.submit(stage_group, self.tables, offers, parameters)
+                               for offers, parameters in self._groups(chunk))
+                # в очереди не больше двух групп на процесс, чтобы файл не оказался в памяти целиком
+                while len(pending) > self.workers * 2:
+                    rows = pending.popleft().result()
+                    if progress is not None:
+                        progress(rows)
+            while pending:
+                rows = pending.popleft().result()
+                if progress is not None:
+                    progress(rows)
+
+    def _deduplicate(self):
+        """
+        Из строк с одним артикулом остается последняя в файле
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(self._sql(
+                'DELETE FROM {s} WHERE EXISTS '
+                '(SELECT 1 FROM {s} d WHERE d.external_id = {s}.external_id AND d.seq > {s}.seq)'
+            ))
+            if cursor.rowcount:
+                cursor.execute(self._sql(
+                    'DELETE FROM {sp} WHERE NOT EXISTS '
+                    '(SELECT 1 FROM {s} s WHERE s.external_id = {sp}.external_id AND s.seq = {sp}.seq)'
+                ))
+
+    def _create_tables(self):
+        unlogged = 'UNLOGGED ' if connection.vendor == 'postgresql' else ''
+        offers, parameters = self.tables['offers'], self.tables['parameters']
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE {unlogged}TABLE {offers} (external_id bigint NOT NULL, seq bigint NOT NULL, '
+                f'category_name varchar(50) NOT NULL, product_name varchar(50) NOT NULL, model varchar(100) NOT NULL, '
+                f'quantity integer NOT NULL, price integer NOT NULL, price_rrc integer NOT NULL, '
+                f'product_id bigint NULL)'
+            )
+            cursor.execute(f'CREATE INDEX {offers}_external_id ON {offers} (external_id)')
+            cursor.execute(
+                f'CREATE {unlogged}TABLE {parameters} (external_id bigint NOT NULL, seq bigint NOT NULL, '
+                f'name varchar(50) NOT NULL, value varchar(100) NOT NULL, numeric_value double precision NULL)'
+            )
+            cursor.execute(f'CREATE INDEX {parameters}_external_id ON {parameters} (external_id)')
+
+    def _drop_tables(self):
+        with connection.cursor() as cursor:
+            for table in self.tables.values():
+                cursor.execute(f'DROP TABLE IF EXISTS {table}')
+
+    def _sql(self, statement):
+        return statement.format(
+            s=self.tables['offers'],
+            sp=self.tables['parameters'],
+            c=Category._meta.db_table,
+            p=Product._meta.db_table,
+            pi=ProductInfo._meta.db_table,
+            prm=Parameter._meta.db_table,
+            pip=ProductInfoParameter._meta.db_table,
+            sb=StockBucket._meta.db_table,
+        )
+
+    def _count(self):
+        changed = self._sql(
+            '{pi}.model <> s.model OR {pi}.quantity <> s.quantity OR {pi}.price <> s.price '
+            'OR {pi}.price_rrc <> s.price_rrc OR NOT {pi}.is_active OR p.name <> s.product_name '
+            'OR c.name <> s.category_name '
+            'OR EXISTS (SELECT 1 FROM {sb} b WHERE b.product_info_id = {pi}.id AND b.quantity > 0)'
+        )
+        shop_id = self.shop.id if self.shop is not None else None
+        with connection.cursor() as cursor:
+            cursor.execute(self._sql('SELECT COUNT(*) FROM {s}'))
+            total = cursor.fetchone()[0]
+            cursor.execute(self._sql(
+                'SELECT COUNT(*) FROM {s} s WHERE NOT EXISTS '
+                '(SELECT 1 FROM {pi} WHERE {pi}.shop_id = %s AND {pi}.external_id = s.external_id)'
+            ), [shop_id])
+            self.stats['inserted'] = cursor.fetchone()[0]
+            cursor.execute(self._sql(
+                'SELECT COUNT(*) FROM {s} s JOIN {pi} ON {pi}.shop_id = %s AND {pi}.external_id = s.external_id '
+                'JOIN {p} p ON p.id = {pi}.product_id JOIN {c} c ON c.id = p.category_id WHERE '
+            ) + changed, [shop_id])
+            self.stats['updated'] = cursor.fetchone()[0]
+            self.stats['unchanged'] = total - self.stats['inserted'] - self.stats['updated']
+            cursor.execute(self._sql(
+                'SELECT COUNT(*) FROM {pi} WHERE {pi}.shop_id = %s AND {pi}.is_active = %s AND NOT EXISTS '
+                '(SELECT 1 FROM {s} s WHERE s.external_id = {pi}.external_id)'
+            ), [shop_id, True])
+            self.stats['removed'] = cursor.fetchone()[0]
+
+    def _merge(self):
+        shop_id = self.shop.id
+        with connection.cursor() as cursor:
+            cursor.execute(self._sql(
+                'INSERT INTO {p} (name, category_id) SELECT DISTINCT s.product_name, c.id FROM {s} s '
+                'JOIN {c} c ON c.name = s.category_name '
+                'WHERE NOT EXISTS (SELECT 1 FROM {p} p WHERE p.name = s.product_name AND p.category_id = c.id)'
+            ))
+            cursor.execute(self._sql(
+                'UPDATE {s} SET product_id = (SELECT MIN(p.id) FROM {p} p JOIN {c} c ON c.id = p.category_id '
+                'WHERE p.name = {s}.product_name AND c.name = {s}.category_name)'
+            ))
+            cursor.execute(self._sql(
+                'UPDATE {pi} SET product_id = s.product_id, model = s.model, quantity = s.quantity, '
+                'price = s.price, price_rrc = s.price_rrc, is_active = %s FROM {s} s '
+                'WHERE {pi}.shop_id = %s AND {pi}.external_id = s.external_id AND ('
+                '{pi}.product_id <> s.product_id OR {pi}.model <> s.model OR {pi}.quantity <> s.quantity '
+                'OR {pi}.price <> s.price OR {pi}.price_rrc <> s.price_rrc OR NOT {pi}.is_active '
+                'OR EXISTS (SELECT 1 FROM {sb} b WHERE b.product_info_id = {pi}.id AND b.quantity > 0))'
+            ), [True, shop_id])
+            # количество из прайс-листа - весь остаток, ячейки горячих товаров обнуляются
+            cursor.execute(self._sql(
+                'UPDATE {sb} SET quantity = 0 WHERE quantity > 0 AND product_info_id IN '
+                '(SELECT o.id FROM {pi} o JOIN {s} s ON o.shop_id = %s AND o.external_id = s.external_id)'
+            ), [shop_id])
+            cursor.execute(self._sql(
+                'INSERT INTO {pi} (product_id, shop_id, model, quantity, price, price_rrc, external_id, is_active) '
+                'SELECT s.product_id, %s, s.model, s.quantity, s.price, s.price_rrc, s.external_id, %s FROM {s} s '
+                'WHERE NOT EXISTS (SELECT 1 FROM {pi} WHERE {pi}.shop_id = %s AND {pi}.external_id = s.external_id)'
+            ), [shop_id, True, shop_id])
+            cursor.execute(self._sql(
+                'UPDATE {pi} SET is_active = %s WHERE shop_id = %s AND is_active = %s AND NOT EXISTS '
+                '(SELECT 1 FROM {s} s WHERE s.external_id = {pi}.external_id)'
+            ), [False, shop_id, True])
+
+            cursor.execute(self._sql(
+                'INSERT INTO {prm} (name) SELECT DISTINCT sp.name FROM {sp} sp '
+                'WHERE NOT EXISTS (SELECT 1 FROM {prm} p WHERE p.name = sp.name)'
+            ))
+            if cursor.rowcount:
+                parameter_ids.changed()
+            cursor.execute(self._sql(
+                'INSERT INTO {pip} (product_info_id, parameter_id, value, numeric_value) '
+                'SELECT o.id, (SELECT MIN(p.id) FROM {prm} p WHERE p.name = sp.name), sp.value, sp.numeric_value '
+                'FROM {sp} sp JOIN {pi} o ON o.shop_id = %s AND o.external_id = sp.external_id WHERE 1 = 1 '
+                'ON CONFLICT (product_info_id, parameter_id) DO UPDATE SET value = excluded.value, '
+                'numeric_value = excluded.numeric_value'
+            ), [shop_id])
+            cursor.execute(self._sql(
+                'DELETE FROM {pip} WHERE product_info_id IN '
+                '(SELECT o.id FROM {pi} o JOIN {s} s ON o.shop_id = %s AND o.external_id = s.external_id) '
+                'AND NOT EXISTS (SELECT 1 FROM {sp} sp JOIN {prm} p ON p.name = sp.name '
+                'JOIN {pi} o ON o.shop_id = %s AND o.external_id = sp.external_id '
+                'WHERE o.id = {pip}.product_info_id AND p.id = {pip}.parameter_id)'
+            ), [shop_id, shop_id])
@@ -0,0 +1,139 @@
+import random
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from ordering_service import outbox
+from ordering_service.models import ProductInfo, StockBucket, StockReservation
+from ordering_service.signals import send_offers_changed
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_info_ids):
+        super().__init__(f'Недостаточно товара на складе: {", ".join(map(str, product_info_ids))}')
+        self.product_info_ids = product_info_ids
+
+
+def take(queryset, quantity):
+    """
+    Условное списание одной строки: остаток уменьшается, только если его хватает
+    """
+    return queryset.filter(quantity__gte=quantity).update(quantity=F('quantity') - quantity) == 1
+
+
+def reserve(order, order_products):
+    """
+    Резервирование остатков под позиции заказа. Вызывается внутри транзакции оформления:
+    если какого-то товара не хватает или карточка снята с продажи, выбрасывается OutOfStock
+    и транзакция откатывается целиком.
+    Карточки списываются условным UPDATE ... WHERE quantity >= n в порядке id, чтобы параллельные
+    оформления не блокировали друг друга крест-накрест. Горячие карточки (с ячейками StockBucket)
+    списываются из случайной ячейки, поэтому параллельные оформления ждут разные строки.
+    """
+    quantities = Counter()
+    for order_product in order_products:
+        quantities[order_product.product_info_id] += order_product.quantity
+    buckets = {}
+    for bucket_id, product_info_id in StockBucket.objects.filter(
+            product_info_id__in=quantities, product_info__is_active=True).order_by('id').values_list(
+            'id', 'product_info_id'):
+        buckets.setdefault(product_info_id, []).append(bucket_id)
+
+    short = []
+    for product_info_id in sorted(quantities):
+        if product_info_id in buckets:
+            reserved = take_from_buckets(product_info_id, buckets[product_info_id], quantities[product_info_id])
+        else:
+            # снятая с продажи карточка не списывается, как будто ее нет на складе
+            reserved = take(ProductInfo.objects.filter(id=product_info_id, is_active=True),
+                            quantities[product_info_id])
+        if not reserved:
+            short.append(product_info_id)
+    if short:
+        raise OutOfStock(short)
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_info_id=product_info_id, quantity=quantity)
+        for product_info_id, quantity in quantities.items()
+    ])
+    # остатки изменены UPDATE-запросами без сигналов модели, поэтому кэш каталога сбрасывается явно,
+    # а закончившийся товар уходит из лучших предложений
+    offers = list(ProductInfo.objects.filter(id__in=quantities).values_list('id', 'shop_id', 'quantity'))
+    send_offers_changed({shop_id for _, shop_id, _ in offers}, parameters=False)
+    sold_out = [product_info_id for product_info_id, _, quantity in offers if quantity == 0]
+    if sold_out:
+        outbox.publish_offers_changed(product_info_ids=sold_out)
+
+
+def take_from_buckets(product_info_id, bucket_ids, quantity):
+    """
+    Списание горячего товара. Сначала пробуются ячейки, начиная со случайной. Если ни в одной
+    не хватает, из карточки в ячейку переносится сразу STOCK_BUCKET_REFILL единиц, так что строка
+    карточки блокируется раз в несколько оформлений, а не на каждом. Если остаток рассыпан по ячейкам
+    мельче заказа, он собирается под блокировкой всех ячеек.
+    """
+    start = random.randrange(len(bucket_ids))
+    bucket_ids = bucket_ids[start:] + bucket_ids[:start]
+    for bucket_id in bucket_ids:
+        if take(StockBucket.objects.filter(id=bucket_id), quantity):
+            return True
+
+    product_info = ProductInfo.objects.filter(id=product_info_id)
+    refill = max(quantity, settings.STOCK_BUCKET_REFILL)
+    if take(product_info, refill):
+        StockBucket.objects.filter(id=bucket_ids[0]).update(quantity=F('quantity') + refill - quantity)
+        return True
+    if take(product_info, quantity):
+        return True
+    return gather(product_info_id, quantity)
+
+
+def gather(product_info_id, quantity):
+    product_info = ProductInfo.objects.select_for_update().get(id=product_info_id)
+    buckets = list(StockBucket.objects.select_for_update().filter(product_info_id=product_info_id).order_by('id'))
+    if product_info.quantity + sum(bucket.quantity for bucket in buckets) < quantity:
+        return False
+    for bucket in buckets:
+        taken = min(bucket.quantity, quantity)
+        bucket.quantity -= taken
+        quantity -= taken
+    StockBucket.objects.bulk_update(buckets, ['quantity'])
+    ProductInfo.objects.filter(id=product_info_id).update(quantity=F('quantity') - quantity)
+    return True
+
+
+def release(order, shop_id=None):
+    """
+    Возврат зарезервированного товара при отмене заказа (или части заказа одного магазина).
+    Товар возвращается в остаток карточки, каждый резерв снимается один раз.
+    """
+    with transaction.atomic():
+        reservations = StockReservation.objects.select_for_update(of=('self',)).filter(order=order, released=False)
+        if shop_id is not None:
+            reservations = reservations.filter(product_info__shop_id=shop_id)
+        reservations = list(reservations.order_by('product_info_id'))
+        for reservation in reservations:
+            ProductInfo.objects.filter(id=reservation.product_info_id).update(
+                quantity=F('quantity') + reservation.quantity
+            )
+        StockReservation.objects.filter(id__in=[reservation.id for reservation in reservations]).update(released=True)
+        returned = [reservation.product_info_id for reservation in reservations]
+        if returned:
+            send_offers_changed(set(ProductInfo.objects.filter(id__in=returned).values_list('shop_id', flat=True)),
+                                parameters=False)
+            outbox.publish_offers_changed(product_info_ids=returned)
+
+
+def set_buckets(product_info_id, count):
+    """
+    Перевод карточки в режим горячего товара с count ячейками (0 - обратно в обычный режим).
+    Остатки из прежних ячеек возвращаются в карточку.
+    """
+    with transaction.atomic():
+        ProductInfo.objects.select_for_update().get(id=product_info_id)
+        buckets = StockBucket.objects.select_for_update().filter(product_info_id=product_info_id)
+        returned = sum(buckets.values_list('quantity', flat=True))
+        buckets.delete()
+        ProductInfo.objects.filter(id=product_info_id).update(quantity=F('quantity') + returned)
+        StockBucket.objects.bulk_create([StockBucket(product_info_id=product_info_id) for _ in range(count)])
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import threading
+from contextlib import asynccontextmanager
+
+import redis
+import redis.asyncio
+from celery import current_app
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from ordering_service import outbox
+from ordering_service.models import OutboxEvent
+
+STREAM_TOPICS = [outbox.ORDER_CREATED, outbox.ORDER_STATUS_CHANGED]
+# поля событий, которые не показываются поставщикам
+PRIVATE_FIELDS = {'recipient'}
+
+
+class Subscription:
+    def __init__(self, shop_ids):
+        self.shop_ids = set(shop_ids)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=settings.ORDER_EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # клиент не успевает читать: поток завершается, при переподключении клиент догонит по Last-Event-ID
+            self.overflowed = True
+
+
+class LocalBroker:
+    """
+    Раздача событий подписчикам внутри процесса: у каждого соединения своя очередь asyncio,
+    событие кладется в очереди подписчиков магазина события. Публиковать можно из любого потока.
+    Подходит для одного процесса, в котором задачи Celery выполняются сразу (разработка, тесты):
+    события публикует обработчик outbox в процессе Celery, и между процессами их передает RedisBroker.
+    """
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        self.fan_out(event)
+
+    def fan_out(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(event['payload'].get('shop_id'), ()))
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.put, event)
+
+    @asynccontextmanager
+    async def subscribe(self, shop_ids):
+        subscription = Subscription(shop_ids)
+        with self._lock:
+            for shop_id in subscription.shop_ids:
+                self._subscriptions.setdefault(shop_id, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                for shop_id in subscription.shop_ids:
+                    self._subscriptions[shop_id].discard(subscription)
+                    if not self._subscriptions[shop_id]:
+                        del self._subscriptions[shop_id]
+
+
+class RedisBroker(LocalBroker):
+    """
+    События публикуются в канал Redis, а каждый процесс веб-сервера держит одну подписку на канал
+    и раздает полученные события своим соединениям через LocalBroker.
+    """
+    channel = 'ordering_service:order-events'
+
+    def __init__(self, url):
+        super().__init__()
+        self.url = url
+        self._client = None
+        self._listeners = {}
+
+    def publish(self, event):
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(self.channel, json.dumps(event))
+
+    async def listen(self):
+        client = redis.asyncio.Redis.from_url(self.url)
+        async with client.pubsub() as pubsub:
+            await pubsub.subscribe(self.channel)
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    self.fan_out(json.loads(message['data']))
+
+    @asynccontextmanager
+    async def subscribe(self, shop_ids):
+        loop = asyncio.get_running_loop()
+        listener = self._listeners.get(loop)
+        if listener is None or listener.done():
+            self._listeners[loop] = loop.create_task(self.listen())
+        async with super().subscribe(shop_ids) as subscription:
+            yield subscription
+
+
+broker = None
+
+
+def get_broker():
+    """
+    Брокер событий процесса. Без ORDER_EVENTS_REDIS_URL события остаются в процессе, поэтому с отдельным
+    процессом Celery (задачи не выполняются сразу) брокер не создается, а не теряет события молча.
+    """
+    global broker
+    if broker is None:
+        url = settings.ORDER_EVENTS_REDIS_URL
+        if not url and not current_app.conf.task_always_eager:
+            raise ImproperlyConfigured('ORDER_EVENTS_REDIS_URL не задан: события заказов публикуются в процессе '
+                                       'Celery и без Redis не дойдут до потоков событий веб-сервера')
+        broker = RedisBroker(url) if url else LocalBroker()
+    return broker
+
+
+@outbox.handler(outbox.ORDER_CREATED)
+@outbox.handler(outbox.ORDER_STATUS_CHANGED)
+def publish_to_streams(events):
+    for event in events:
+        get_broker().publish(event)
+
+
+def format_event(event):
+    payload = {key: value for key, value in event['payload'].items() if key not in PRIVATE_FIELDS}
+    return f'id: {event["id"]}\nevent: {event["topic"]}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n'
+
+
+async def missed_events(shop_ids, last_event_id):
+    events = OutboxEvent.objects.filter(shop_id__in=list(shop_ids), id__gt=last_event_id,
+                                        topic__in=STREAM_TOPICS).order_by('id')
+    async for event in events:
+        yield {'id': event.id, 'topic': event.topic, 'payload': event.payload}
+
+
+async def event_stream(shop_ids, last_event_id=None):
+    """
+    Поток событий заказов магазинов shop_ids в формате server-sent events.
+    С last_event_id сначала отдаются пропущенные события из outbox, затем новые. Переданные события хранятся
+    OUTBOX_RETENTION_DAYS дней, поэтому пропущенные события восстанавливаются не дальше этого срока. Если событий нет
+    ORDER_EVENTS_HEARTBEAT секунд, отправляется комментарий, чтобы прокси не закрывали соединение.
+    """
+    async with get_broker().subscribe(shop_ids) as subscription:
+        yield f'retry: {settings.ORDER_EVENTS_RETRY * 1000}\n\n'
+        if last_event_id is not None:
+            async for event in missed_events(shop_ids, last_event_id):
+                last_event_id = event['id']
+                yield format_event(event)
+        while not subscription.overflowed:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), settings.ORDER_EVENTS_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ': heartbeat\n\n'
+                continue
+            if last_event_id is not None and event['id'] <= last_event_id:
+                continue
+            last_event_id = event['id']
+            yield format_event(event)
@@ -1,17 +1,197 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
 from celery import shared_task
-from django.core.mail import send_mail
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from ordering_service import best_offers, outbox
+from ordering_service.feeds import fetch_price_list
+from ordering_service.importer import GoodsImporter
+from ordering_service.models import ImportJob, ImportLock, Shop
+from ordering_service.notifications import send_pending
+from ordering_service.readers import READERS, PriceListError, read_shop_name
+from ordering_service.signals import send_offers_changed
+from ordering_service.staging import StagedGoodsImporter
+from ordering_service.validation import PriceListValidator
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def dispatch_outbox():
+    """
+    Передача событий заказов из outbox в очередь (запускается Celery beat)
+    """
+    return outbox.dispatch(handle_order_events.delay)
+
+
+@shared_task
+def purge_outbox():
+    """
+    Удаление давно переданных событий из outbox (запускается Celery beat)
+    """
+    return outbox.purge()
+
+
+@shared_task
+def handle_order_events(events):
+    outbox.handle(events)
+
+
+@shared_task
+def send_status_notifications():
+    """
+    Отправка накопленных уведомлений об изменении статуса заказов (запускается Celery beat)
+    """
+    return send_pending()
+
+
+def enqueue_import_job(job):
+    """
+    Сохранение задачи импорта и постановка её в очередь после фиксации транзакции.
+    Название магазина читается из заголовка файла, по нему задачи одного магазина выполняются по очереди.
+    Прайс-лист, загруженный по ссылке магазина, должен быть прайс-листом этого магазина: импорт идет
+    по названию из файла, и чужое название создало бы другой магазин или изменило бы его товары.
+    """
+    with open(job.file, 'rb') as price_list:
+        job.shop_name = read_shop_name(price_list, job.format)
+    if job.shop is not None and job.shop_name != job.shop.name:
+        raise PriceListError(f'Прайс-лист магазина "{job.shop_name}" загружен по ссылке магазина "{job.shop.name}"')
+    job.save()
+    transaction.on_commit(lambda: import_goods.delay(str(job.id)))
+    return job
+
+
+def acquire_import_lock(job):
+    """
+    Захват блокировки импорта магазина. Блокировка, которую не продлевали дольше GOODS_IMPORT_LOCK_TIMEOUT,
+    считается брошенной упавшим воркером и снимается.
+    """
+    expired = timezone.now() - timedelta(seconds=settings.GOODS_IMPORT_LOCK_TIMEOUT)
+    ImportLock.objects.filter(shop_name=job.shop_name, acquired_at__lt=expired).delete()
+    try:
+        with transaction.atomic():
+            ImportLock.objects.create(shop_name=job.shop_name, job=job, acquired_at=timezone.now())
+    except IntegrityError:
+        return False
+    return True
+
+
+def supersede_import_job(job):
+    job.state = 'superseded'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['state', 'finished_at'])
+    if os.path.exists(job.file):
+        os.remove(job.file)
+
+
+@shared_task(bind=True, max_retries=None)
+def import_goods(self, job_id):
+    """
+    Фоновый импорт прайс-листа, загруженного через GoodsImportAPIView.
+    Импорты одного магазина выполняются по очереди, а ожидающая задача, для которой уже загружен
+    более новый прайс-лист, не выполняется, чтобы не перезаписать новые цены старыми. Импорты разных магазинов идут параллельно.
+    """
+    job = ImportJob.objects.select_related('user').get(id=job_id)
+    if job.state != 'pending':
+        return job.state
+    if not job.dry_run:
+        newer = ImportJob.objects.filter(shop_name=job.shop_name, dry_run=False,
+                                         state__in=['pending', 'running', 'done'], created_at__gt=job.created_at)
+        if newer.exists():
+            supersede_import_job(job)
+            return job.state
+        if not acquire_import_lock(job):
+            raise self.retry(countdown=settings.GOODS_IMPORT_LOCK_RETRY_DELAY)
+    try:
+        run_import_job(job)
+    finally:
+        ImportLock.objects.filter(job=job).delete()
+    return job.state
+
+
+def run_import_job(job):
+    job.state = 'running'
+    job.started_at = timezone.now()
+    job.save(update_fields=['state', 'started_at'])
+
+    importer_class = StagedGoodsImporter if settings.GOODS_IMPORT_BACKEND == 'staged' else GoodsImporter
+    importer = importer_class(job.user, dry_run=job.dry_run)
+
+    def progress(rows):
+        job.rows_processed += rows
+        job.stats = importer.stats
+        job.save(update_fields=['rows_processed', 'stats'])
+        ImportLock.objects.filter(job=job).update(acquired_at=timezone.now())
+        if not job.dry_run:
+            send_offers_changed([importer.shop.id])
+
+    try:
+        # прайс-лист с ошибками отклоняется целиком до первой записи в базу
+        with open(job.file, 'rb') as price_list:
+            errors = PriceListValidator().validate(READERS[job.format](price_list))
+        if errors:
+            job.state = 'failed'
+            job.errors = errors
+            return
+        with open(job.file, 'rb') as price_list:
+            job.stats = importer.run_in_chunks(READERS[job.format](price_list), progress)
+        job.state = 'done'
+        if job.shop_id and job.feed and not job.dry_run:
+            Shop.objects.filter(id=job.shop_id).update(feed_etag=job.feed['etag'],
+                                                      feed_last_modified=job.feed['last_modified'],
+                                                      feed_hash=job.feed['hash'])
+    except Exception as e:
+        job.state = 'failed'
+        job.errors.append({'line': getattr(e, 'line', None), 'message': str(e)})
+    finally:
+        job.finished_at = timezone.now()
+        job.save(update_fields=['state', 'stats', 'errors', 'finished_at'])
+        if importer.shop is not None and not job.dry_run:
+            send_offers_changed([importer.shop.id])
+            best_offers.refresh_shops([importer.shop.id])
+        if os.path.exists(job.file):
+            os.remove(job.file)
 
 
 @shared_task
-def send_status_change_email(current_status, new_status, recipient_email):
-    subject = 'Изменение статуса заказа'
-    message = f'Статус заказа изменен с {current_status} на {new_status}.'
-    from_email = 'noreply@myshop.com'
-    recipient_list = [recipient_email]
-    send_mail(
-        subject,
-        message,
-        from_email,
-        recipient_list,
-        fail_silently=False,
-    )
\ No newline at end of file
+def pull_price_lists():
+    """
+    Периодическая загрузка прайс-листов открытых магазинов по ссылке Shop.url.
+    Загрузка идет параллельно с ограничением PRICE_LIST_PULL_CONCURRENCY,
+    импорт запускается только для изменившихся прайс-листов.
+    """
+    shops = Shop.objects.filter(state=True, url__isnull=False).exclude(url='').select_related('user')
+    os.makedirs(settings.GOODS_IMPORT_DIR, exist_ok=True)
+    summary = {'not_modified': 0, 'unchanged': 0, 'changed': 0, 'failed': 0}
+
+    with ThreadPoolExecutor(max_workers=settings.PRICE_LIST_PULL_CONCURRENCY) as executor:
+        futures = {executor.submit(fetch_price_list, shop, settings.GOODS_IMPORT_DIR): shop for shop in shops}
+        for future in as_completed(futures):
+            shop = futures[future]
+            try:
+                result = future.result()
+            except Exception:
+                # в том числе FeedError: ссылка на внутренний адрес или слишком большой прайс-лист
+                logger.exception('Не удалось загрузить прайс-лист магазина %s', shop)
+                summary['failed'] += 1
+                continue
+
+            summary[result['state']] += 1
+            if result['state'] == 'unchanged':
+                Shop.objects.filter(id=shop.id).update(feed_etag=result['feed']['etag'],
+                                                      feed_last_modified=result['feed']['last_modified'])
+            elif result['state'] == 'changed':
+                try:
+                    enqueue_import_job(ImportJob(user=shop.user, shop=shop, file=result['file'],
+                                                 feed=result['feed'], format=result['format']))
+                except PriceListError:
+                    logger.exception('Некорректный прайс-лист магазина %s', shop)
+                    os.remove(result['file'])
+                    summary['changed'] -= 1
+                    summary['failed'] += 1
+    return summary
@@ -1,6 +1,56 @@
-from django.test import TestCase
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import yaml
+from asgiref.sync import async_to_sync
+from celery.exceptions import Retry
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import get_connection
+from django.db import OperationalError, connection, transaction
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from orders.celery import celery_app
+from ordering_service import catalog, outbox, streams
+from ordering_service.async_views import (
+    read_view, shop_list, category_list, product_info_list, product_info_detail, order_list
+)
+from ordering_service.facets import facet_index
+from ordering_service.filters import CatalogSearchFilter
+from ordering_service.importer import GoodsImporter
+from ordering_service.models import (
+    Shop, Category, Product, Parameter, ProductInfo, ProductInfoParameter, ImportJob, ImportLock, Order,
+    OrderProduct, Contact, ShopOrder, StockBucket, StockReservation, StatusNotification, OutboxEvent
+)
+from ordering_service.names import NameCache, category_ids, parameter_ids
+from ordering_service.notifications import send_pending
+from ordering_service.outbox import ORDER_CREATED, ORDER_STATUS_CHANGED, publish, publish_status_changed
+from ordering_service.serializers import OrderSerializer, ProductSerializer, ShopSerializer
+from ordering_service.readers import YamlPriceListReader, PriceListError, detect_format, read_shop_name
+from ordering_service.streams import LocalBroker
+from ordering_service.stock import OutOfStock, reserve as reserve_stock, release as release_stock, set_buckets
+from ordering_service.tasks import (
+    pull_price_lists, import_goods, send_status_notifications, dispatch_outbox, handle_order_events, purge_outbox
+)
+from ordering_service.units import parse_numeric
+from ordering_service.views import ProductInfoViewSet, ShopViewSet
 
 
 class UsersManagersTests(TestCase):
@@ -40,4 +90,1225 @@ class UsersManagersTests(TestCase):
             pass
         with self.assertRaises(ValueError):
             User.objects.create_superuser(
-                email='super@user.com', password='foo', is_superuser=False)
\ No newline at end of file
+                email='super@user.com', password='foo', is_superuser=False)
+
+
+class GoodsImportTests(APITestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='shop@user.com', password='foo', type='shop')
+        self.client.force_authenticate(self.user)
+        # кэш справочников общий для процесса, а записи тестов откатываются
+        self.addCleanup(parameter_ids.invalidate)
+        self.addCleanup(category_ids.invalidate)
+        self.addCleanup(catalog.get_cache().clear)
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        import_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(import_dir.cleanup)
+        self.settings_override = override_settings(GOODS_IMPORT_DIR=import_dir.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def make_price_list(self, goods_count, shop='Связной'):
+        data = {
+            'shop': shop,
+            'categories': [{'id': 224, 'name': 'Смартфоны'}, {'id': 15, 'name': 'Аксессуары'}],
+            'goods': [
+                {
+                    'id': 1000 + i,
+                    'category': 224 if i % 2 else 15,
+                    'model': f'model/{i}',
+                    'name': f'Товар {i}',
+                    'price': 100 + i,
+                    'price_rrc': 200 + i,
+                    'quantity': 10,
+                    'parameters': {'Цвет': 'черный', 'Память (Гб)': 64 * (i % 4 + 1)},
+                }
+                for i in range(goods_count)
+            ],
+        }
+        return yaml.dump(data, allow_unicode=True).encode()
+
+    def upload(self, content, name='shop.yaml', query=''):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('goods-import') + query, {'file': SimpleUploadedFile(name, content)},
+                                        format='multipart')
+        self.assertEqual(response.status_code, 202, response.data)
+        return self.client.get(reverse('goods-import-job', args=[response.data['job_id']])).data
+
+    def test_import_shop_file(self):
+        with open(settings.BASE_DIR / 'shop1.yaml', 'rb') as price_list:
+            job = self.upload(price_list.read())
+        self.assertEqual(job['state'], 'done', job['errors'])
+        self.assertEqual(job['rows_processed'], 4)
+        shop = Shop.objects.get(name='Связной')
+        self.assertEqual(shop.categories.count(), 3)
+        self.assertEqual(ProductInfo.objects.filter(shop=shop).count(), 4)
+        offer = ProductInfo.objects.get(shop=shop, model='apple/iphone/xs-max')
+        self.assertEqual(offer.price, 110000)
+        self.assertEqual(offer.product_info_parameters.get(parameter__name='Цвет').value, 'золотистый')
+
+    def test_reimport_is_idempotent(self):
+        content = self.make_price_list(10)
+        self.assertEqual(self.upload(content)['stats']['inserted'], 10)
+        self.assertEqual(self.upload(content)['stats']['unchanged'], 10)
+        self.assertEqual(ProductInfo.objects.count(), 10)
+        self.assertEqual(ProductInfoParameter.objects.count(), 20)
+
+    @override_settings(GOODS_IMPORT_BATCH_SIZE=50)
+    def test_query_count_does_not_depend_on_goods_count(self):
+        def run_import(goods_count, shop):
+            price_list = YamlPriceListReader(io.BytesIO(self.make_price_list(goods_count, shop=shop)))
+            with CaptureQueriesContext(connection) as queries:
+                GoodsImporter(self.user).run(price_list)
+            return queries
+
+        with self.captureOnCommitCallbacks(execute=True):
+            run_import(1, 'Магазин 1')
+        small = run_import(5, 'Магазин 2')
+        large = run_import(50, 'Магазин 3')
+        self.assertEqual(len(small), len(large))
+
+    def test_reimport_writes_only_changes(self):
+        data = yaml.safe_load(self.make_price_list(5))
+        self.upload(yaml.dump(data, allow_unicode=True).encode())
+        offer_ids = set(ProductInfo.objects.values_list('id', flat=True))
+
+        data['goods'][0]['price'] = 1
+        data['goods'][1]['parameters'] = {'Цвет': 'белый'}
+        removed = data['goods'].pop()
+        data['goods'].append(dict(removed, id=9999, model='model/new'))
+        content = yaml.dump(data, allow_unicode=True).encode()
+
+        job = self.upload(content, query='?dry_run=1')
+        expected = {'inserted': 1, 'updated': 2, 'unchanged': 2, 'removed': 1}
+        self.assertEqual(job['stats'], expected)
+        self.assertEqual(ProductInfo.objects.get(external_id=1000).price, 100)
+
+        self.assertEqual(self.upload(content)['stats'], expected)
+        self.assertEqual(ProductInfo.objects.count(), 6)
+        self.assertTrue(offer_ids <= set(ProductInfo.objects.values_list('id', flat=True)))
+        self.assertEqual(ProductInfo.objects.get(external_id=1000).price, 1)
+        self.assertFalse(ProductInfo.objects.get(external_id=removed['id']).is_active)
+        self.assertEqual(
+            list(ProductInfoParameter.objects.filter(product_info__external_id=1001).values_list('value', flat=True)),
+            ['белый']
+        )
+
+    def test_failed_job_reports_error(self):
+        response = self.client.post(reverse('goods-import'), {'file': SimpleUploadedFile('shop.yaml', b'shop: [')},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+        job = self.upload(b'shop: Shop\ncategories: []\ngoods:\n  - id: [broken\n')
+        self.assertEqual(job['state'], 'failed')
+        self.assertEqual(len(job['errors']), 1)
+        self.assertFalse(os.listdir(settings.GOODS_IMPORT_DIR))
+
+    def test_invalid_price_list_rejected_before_writes(self):
+        data = yaml.safe_load(self.make_price_list(50))
+        data['goods'][30]['price'] = -1
+        data['goods'][47]['category'] = 999
+        del data['goods'][48]['name']
+        data['goods'][49]['parameters'] = {'Цвет': ['черный']}
+        content = yaml.dump(data, allow_unicode=True).encode()
+
+        job = self.upload(content)
+        self.assertEqual(job['state'], 'failed')
+        self.assertEqual([(error['item'], error['field']) for error in job['errors']],
+                         [(31, 'price'), (48, 'category'), (49, 'name'), (50, 'parameters')])
+        lines = content.decode().splitlines()
+        for error in job['errors']:
+            self.assertEqual(lines[error['line'] - 1].lstrip()[:2], '- ')
+        self.assertFalse(Shop.objects.exists())
+        self.assertFalse(ProductInfo.objects.exists())
+
+        csv_content = ('shop,category_id,category,id,name,model,price,price_rrc,quantity\n'
+                       'Shop,1,Смартфоны,1,Товар,m1,100,120,1\n'
+                       'Shop,1,Смартфоны,2,Товар,m2,сто,120,1\n').encode()
+        job = self.upload(csv_content, name='shop.csv')
+        self.assertEqual([(error['line'], error['field']) for error in job['errors']], [(3, 'price')])
+
+    def test_parameter_filters_and_facets(self):
+        data = yaml.safe_load(self.make_price_list(8))
+        self.upload(yaml.dump(data, allow_unicode=True).encode())
+        memory = {'param[Память (Гб)]': ['64', '128']}
+
+        response = self.client.get(reverse('productinfo-list'), memory)
+        self.assertEqual(sorted(offer['id'] for offer in response.data['results']),
+                         sorted(ProductInfo.objects.filter(external_id__in=[1000, 1001, 1004, 1005])
+                                .values_list('id', flat=True)))
+
+        with CaptureQueriesContext(connection) as queries:
+            facets = self.client.get(reverse('productinfo-facets'), memory).data
+        self.assertFalse([query for query in queries if 'GROUP BY' in query['sql']])
+        self.assertEqual(facets['count'], 4)
+        self.assertEqual(facets['facets'], {
+            'Цвет': {'черный': 4},
+            'Память (Гб)': {'64': 2, '128': 2, '192': 2, '256': 2},
+        })
+
+        data['goods'][0]['parameters']['Цвет'] = 'белый'
+        self.upload(yaml.dump(data, allow_unicode=True).encode())
+        facets = self.client.get(reverse('productinfo-facets')).data
+        self.assertEqual(facets['facets']['Цвет'], {'черный': 7, 'белый': 1})
+
+    def test_facet_index_reloads_only_changed_shops(self):
+        content = self.make_price_list(2, shop='Магазин 2')
+        self.upload(self.make_price_list(2, shop='Магазин 1'))
+        self.upload(content)
+        facet_index.sync()
+        with mock.patch.object(facet_index, '_reload', wraps=facet_index._reload) as reload, \
+                CaptureQueriesContext(connection) as queries:
+            facet_index.sync()
+        self.assertFalse(reload.called)
+        self.assertEqual([query for query in queries if not query['sql'].startswith('EXPLAIN')], [])
+
+        offer = ProductInfo.objects.filter(shop__name='Магазин 1').first()
+        order = Order.objects.create(user=offer.shop.user, status='new')
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock(order, [OrderProduct(order=order, product_info=offer, quantity=1)])
+            release_stock(order)
+            ProductInfo.objects.get(id=offer.id).save()
+        with mock.patch.object(facet_index, '_reload', wraps=facet_index._reload) as reload:
+            facet_index.sync()
+        self.assertFalse(reload.called)
+
+        self.upload(content.replace('черный'.encode(), 'белый'.encode()))
+        with mock.patch.object(facet_index, '_reload', wraps=facet_index._reload) as reload:
+            facet_index.sync()
+        reload.assert_called_once_with([Shop.objects.get(name='Магазин 2').id])
+
+    def test_numeric_parameter_range_filters(self):
+        self.upload(self.make_price_list(8))
+        url = reverse('productinfo-list')
+        self.assertEqual(len(self.client.get(url, {'param[Память (Гб)][gte]': '192'}).data['results']), 4)
+        self.assertEqual(len(self.client.get(url, {'param[Память (Гб)][gt]': '64',
+                                                   'param[Память (Гб)][lte]': '0.125 ТБ'}).data['results']), 2)
+        self.assertEqual(self.client.get(url, {'param[Память (Гб)][gte]': 'много'}).status_code, 400)
+
+        parameter_id = Parameter.objects.get(name='Память (Гб)').id
+        sql, params = ProductInfoParameter.objects.filter(parameter_id=parameter_id, numeric_value__gte=192,
+                                                          numeric_value__lte=256).query.sql_with_params()
+        # queryset.explain() не подходит: silk сам добавляет EXPLAIN к запросам после тестовых запросов к API
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            plan = ' '.join(str(column) for row in cursor.fetchall() for column in row)
+        self.assertIn('parameter_numeric_value_idx', plan)
+
+    def test_parse_numeric_parameter_values(self):
+        self.assertEqual(parse_numeric('6,5"', 'Диагональ (дюйм)'), 6.5)
+        self.assertEqual(parse_numeric('1 ТБ', 'Встроенная память (Гб)'), 1024)
+        self.assertEqual(parse_numeric('512 МБ', 'Оперативная память'), 0.5)
+        self.assertIsNone(parse_numeric('2688x1242', 'Разрешение (пикс)'))
+        self.assertIsNone(parse_numeric('черный', 'Цвет'))
+
+    def test_job_is_visible_only_to_owner(self):
+        job = self.upload(self.make_price_list(1))
+        other = get_user_model().objects.create_user(email='other@user.com', password='foo', type='shop')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(reverse('goods-import-job', args=[job['id']])).status_code, 404)
+
+    def test_staged_backend_matches_bulk_backend(self):
+        data = yaml.safe_load(self.make_price_list(5))
+        changed = yaml.safe_load(self.make_price_list(5))
+        changed['goods'][0]['price'] = 1
+        changed['goods'][1]['parameters'] = {'Цвет': 'белый'}
+        changed['goods'][2]['name'] = 'Новое название'
+        removed = changed['goods'].pop()
+        changed['goods'].append(dict(removed, id=9999, model='model/new'))
+
+        for backend in ('bulk', 'staged'):
+            with self.subTest(backend), override_settings(GOODS_IMPORT_BACKEND=backend):
+                shop = f'Магазин {backend}'
+                self.upload(yaml.dump(dict(data, shop=shop), allow_unicode=True).encode())
+                content = yaml.dump(dict(changed, shop=shop), allow_unicode=True).encode()
+                self.assertEqual(self.upload(content, query='?dry_run=1')['stats']['inserted'], 1)
+                job = self.upload(content)
+                self.assertEqual(job['state'], 'done', job['errors'])
+                self.assertEqual((job['stats']['inserted'], job['stats']['removed']), (1, 1))
+
+                offers = ProductInfo.objects.filter(shop__name=shop)
+                self.assertEqual(offers.filter(is_active=True).count(), 5)
+                self.assertEqual(offers.get(external_id=1000).price, 1)
+                self.assertEqual(offers.get(external_id=1002).product.name, 'Новое название')
+                self.assertEqual(
+                    list(ProductInfoParameter.objects.filter(product_info__in=offers.filter(external_id=1001))
+                         .values_list('value', flat=True)),
+                    ['белый']
+                )
+                self.assertEqual(ProductInfoParameter.objects.filter(product_info__in=offers).count(), 11)
+        self.assertFalse([name for name in connection.introspection.table_names() if 'staging' in name])
+
+    def test_staged_backend_streams_chunks_and_keeps_last_duplicate(self):
+        data = yaml.safe_load(self.make_price_list(4))
+        data['goods'].append(dict(data['goods'][0], price=1, parameters={'Цвет': 'белый'}))
+        with override_settings(GOODS_IMPORT_BACKEND='staged', GOODS_IMPORT_BATCH_SIZE=2):
+            job = self.upload(yaml.dump(data, allow_unicode=True).encode())
+        self.assertEqual(job['state'], 'done', job['errors'])
+        self.assertEqual((job['rows_processed'], job['stats']['inserted']), (5, 4))
+        offer = ProductInfo.objects.get(external_id=1000)
+        self.assertEqual(offer.price, 1)
+        self.assertEqual(list(offer.product_info_parameters.values_list('value', flat=True)), ['белый'])
+
+    def test_reimport_resets_hot_offer_buckets(self):
+        for backend in ('bulk', 'staged'):
+            with self.subTest(backend), override_settings(GOODS_IMPORT_BACKEND=backend):
+                content = self.make_price_list(2, shop=f'Магазин {backend}')
+                self.upload(content)
+                offer = ProductInfo.objects.get(shop__name=f'Магазин {backend}', external_id=1000)
+                set_buckets(offer.id, 2)
+                # часть остатка перенесена в ячейки при оформлении заказов
+                ProductInfo.objects.filter(id=offer.id).update(quantity=6)
+                StockBucket.objects.filter(product_info=offer).update(quantity=2)
+
+                job = self.upload(content)
+                self.assertEqual((job['stats']['updated'], job['stats']['unchanged']), (1, 1))
+                offer.refresh_from_db()
+                self.assertEqual(offer.quantity, 10)
+                self.assertEqual(sum(StockBucket.objects.filter(product_info=offer).values_list('quantity',
+                                                                                               flat=True)), 0)
+
+    def test_imports_of_one_shop_are_serialized_and_coalesced(self):
+        jobs = []
+        for goods_count in (1, 2, 3):
+            with mock.patch.object(import_goods, 'delay'):
+                response = self.client.post(reverse('goods-import'),
+                                            {'file': SimpleUploadedFile('shop.yaml', self.make_price_list(goods_count))},
+                                            format='multipart')
+            jobs.append(response.data['job_id'])
+        other_shop = self.upload(self.make_price_list(1, shop='Другой магазин'))
+        self.assertEqual(other_shop['state'], 'done')
+
+        ImportLock.objects.create(shop_name='Связной', job_id=jobs[2], acquired_at=timezone.now())
+        with mock.patch.object(import_goods, 'retry', side_effect=Retry):
+            with self.assertRaises(Retry):
+                import_goods(str(jobs[2]))
+        ImportLock.objects.all().delete()
+
+        self.assertEqual(import_goods(str(jobs[0])), 'superseded')
+        self.assertEqual(import_goods(str(jobs[2])), 'done')
+        self.assertEqual(import_goods(str(jobs[1])), 'superseded')
+        self.assertEqual(ProductInfo.objects.filter(shop__name='Связной').count(), 3)
+        self.assertFalse(ImportLock.objects.exists())
+
+    def test_import_formats(self):
+        data = yaml.safe_load(self.make_price_list(3))
+        header = {'shop': data['shop'], 'categories': data['categories']}
+        categories = {category['id']: category['name'] for category in data['categories']}
+        csv_lines = ['shop,category_id,category,id,name,model,price,price_rrc,quantity,Цвет,Память (Гб)']
+        csv_lines += [
+            f'{data["shop"]},{item["category"]},{categories[item["category"]]},{item["id"]},{item["name"]},'
+            f'{item["model"]},{item["price"]},{item["price_rrc"]},{item["quantity"]},{item["parameters"]["Цвет"]},'
+            f'{item["parameters"]["Память (Гб)"]}'
+            for item in data['goods']
+        ]
+        price_lists = {
+            'shop.json': json.dumps(data, ensure_ascii=False),
+            'shop.ndjson': '\n'.join(json.dumps(line, ensure_ascii=False) for line in [header, *data['goods']]),
+            'shop.csv': '\n'.join(csv_lines),
+        }
+
+        self.assertEqual(self.upload(self.make_price_list(3))['stats']['inserted'], 3)
+        for name, content in price_lists.items():
+            with self.subTest(name):
+                self.assertEqual(self.upload(content.encode(), name=name)['stats']['unchanged'], 3)
+
+    def test_unknown_format_is_rejected(self):
+        response = self.client.post(reverse('goods-import'), {'file': SimpleUploadedFile('shop.xls', b'')},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+    def test_detect_format(self):
+        self.assertEqual(detect_format('price.yml'), 'yaml')
+        self.assertEqual(detect_format('price.txt', 'application/x-ndjson; charset=utf-8'), 'ndjson')
+        self.assertEqual(detect_format('price.csv', 'application/octet-stream'), 'csv')
+        self.assertIsNone(detect_format('price.txt'))
+
+
+class YamlPriceListReaderTests(TestCase):
+
+    def test_streaming_matches_full_load(self):
+        with open(settings.BASE_DIR / 'shop1.yaml', 'rb') as price_list:
+            data = yaml.safe_load(price_list)
+            price_list.seek(0)
+            reader = YamlPriceListReader(price_list)
+            self.assertEqual(reader.shop, data['shop'])
+            self.assertEqual(reader.categories, data['categories'])
+            self.assertEqual(list(reader.goods()), data['goods'])
+
+    def test_goods_before_header(self):
+        reader = YamlPriceListReader(io.BytesIO(
+            'goods:\n  - id: 1\n    name: Товар\nshop: Магазин\ncategories: []\n'.encode()
+        ))
+        self.assertEqual(reader.shop, 'Магазин')
+        self.assertEqual(list(reader.goods()), [{'id': 1, 'name': 'Товар'}])
+
+    def test_missing_shop(self):
+        with self.assertRaises(PriceListError):
+            YamlPriceListReader(io.BytesIO(b'categories: []\ngoods: []\n'))
+
+    def test_shop_name_is_read_up_to_shop_key(self):
+        data = {'goods': [{'id': i, 'name': f'Товар "{i}" {{[', 'parameters': {'shop': 'нет'}} for i in range(1000)],
+                'shop': 'Магазин', 'categories': []}
+        with mock.patch('ordering_service.readers.json.load', side_effect=AssertionError), \
+                mock.patch.object(YamlPriceListReader, '_compose_node', side_effect=AssertionError):
+            self.assertEqual(read_shop_name(io.BytesIO(json.dumps(data, ensure_ascii=False).encode()), 'json'),
+                             'Магазин')
+            self.assertEqual(read_shop_name(io.BytesIO(yaml.dump(data, allow_unicode=True).encode()), 'yaml'),
+                             'Магазин')
+            with self.assertRaises(PriceListError):
+                read_shop_name(io.BytesIO(b'{"goods": [], "categories": []}'), 'json')
+
+
+class PriceListHandler(BaseHTTPRequestHandler):
+    content = b''
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        if self.etag and self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if self.etag:
+            self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(self.content)))
+        self.end_headers()
+        self.wfile.write(self.content)
+
+    def log_message(self, *args):
+        pass
+
+
+class PullPriceListsTests(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), PriceListHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        PriceListHandler.requests = []
+        with open(settings.BASE_DIR / 'shop1.yaml', 'rb') as price_list:
+            PriceListHandler.content = price_list.read()
+        self.addCleanup(parameter_ids.invalidate)
+        self.addCleanup(category_ids.invalidate)
+
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        import_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(import_dir.cleanup)
+        settings_override = override_settings(GOODS_IMPORT_DIR=import_dir.name, PRICE_LIST_ALLOW_PRIVATE_HOSTS=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = get_user_model().objects.create_user(email='shop@user.com', password='foo', type='shop')
+        self.shop = Shop.objects.create(user=user, name='Связной',
+                                        url=f'http://127.0.0.1:{self.server.server_port}/shop1.yaml')
+        Shop.objects.create(user=user, name='Закрыт', state=False,
+                            url=f'http://127.0.0.1:{self.server.server_port}/closed.yaml')
+
+    def pull(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return pull_price_lists()
+
+    def test_pull_imports_changed_price_list_only(self):
+        self.assertEqual(self.pull()['changed'], 1)
+        self.assertEqual(ProductInfo.objects.filter(shop=self.shop).count(), 4)
+        self.shop.refresh_from_db()
+        self.assertEqual(self.shop.feed_etag, '"v1"')
+
+        self.assertEqual(self.pull()['not_modified'], 1)
+        self.assertEqual(PriceListHandler.requests[-1]['If-None-Match'], '"v1"')
+
+        PriceListHandler.etag = ''
+        self.addCleanup(setattr, PriceListHandler, 'etag', '"v1"')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.pull()['unchanged'], 1)
+        self.assertFalse([query for query in queries if 'productinfo' in query['sql']])
+        self.assertEqual(ImportJob.objects.count(), 1)
+        self.assertEqual(len(PriceListHandler.requests), 3)
+
+    def test_pull_rejects_internal_hosts_and_oversized_price_lists(self):
+        with override_settings(PRICE_LIST_ALLOW_PRIVATE_HOSTS=False), \
+                self.assertLogs('ordering_service.tasks', 'ERROR'):
+            self.assertEqual(self.pull()['failed'], 1)
+        self.assertEqual(PriceListHandler.requests, [])
+
+        with override_settings(PRICE_LIST_MAX_SIZE=len(PriceListHandler.content) - 1), \
+                self.assertLogs('ordering_service.tasks', 'ERROR'):
+            self.assertEqual(self.pull()['failed'], 1)
+        self.assertFalse(os.listdir(settings.GOODS_IMPORT_DIR))
+        self.assertFalse(ImportJob.objects.exists())
+
+        with override_settings(PRICE_LIST_ALLOW_PRIVATE_HOSTS=False):
+            for url in ('http://127.0.0.1/shop.yaml', 'http://[::ffff:10.0.0.1]/shop.yaml', 'file:///etc/passwd',
+                        'ftp://93.184.216.34/shop.yaml'):
+                self.assertFalse(ShopSerializer(data={'name': 'Магазин', 'url': url}).is_valid(), url)
+            serializer = ShopSerializer(data={'name': 'Магазин', 'url': 'http://93.184.216.34/shop.yaml'})
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+
+    def test_pull_rejects_price_list_of_another_shop(self):
+        Shop.objects.filter(id=self.shop.id).update(name='Другой магазин')
+        with self.assertLogs('ordering_service.tasks', 'ERROR'):
+            self.assertEqual(self.pull()['failed'], 1)
+        self.assertFalse(ImportJob.objects.exists())
+        self.assertFalse(Shop.objects.filter(name='Связной').exists())
+
+
+class NameCacheTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='shop@user.com', password='foo', type='shop')
+        self.parameters = NameCache(Parameter)
+
+    def sql(self, queries):
+        return [query['sql'] for query in queries if not query['sql'].startswith('EXPLAIN')]
+
+    def test_lookups_are_cached_after_warm_up(self):
+        Parameter.objects.create(name='Цвет')
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = self.parameters.get_many(['Цвет', 'Диагональ (дюйм)'])
+        self.assertEqual(ids, dict(Parameter.objects.values_list('name', 'id')))
+        # после загрузки счетчик версии справочника читается из кэша, запросов к базе нет
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.parameters.get_many(['Диагональ (дюйм)', 'Цвет']), ids)
+        self.assertEqual(self.sql(queries), [])
+
+    def test_concurrently_created_name_is_reused(self):
+        self.parameters.preload()
+        Parameter.objects.bulk_create([Parameter(name='Цвет')])
+        self.assertEqual(self.parameters.get('Цвет'), Parameter.objects.get(name='Цвет').id)
+        self.assertEqual(Parameter.objects.count(), 1)
+
+    def test_deleted_entry_is_invalidated(self):
+        categories = NameCache(Category)
+        category_id = categories.get('Смартфоны', user_id=self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.filter(id=category_id).delete()
+        self.assertNotEqual(categories.get('Смартфоны', user_id=self.user.id), category_id)
+
+    def test_misses_are_cached_until_version_changes(self):
+        parameter = Parameter.objects.create(name='Цвет')
+        self.assertIsNone(self.parameters.find('Диагональ (дюйм)'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIsNone(self.parameters.find('Диагональ (дюйм)'))
+        self.assertEqual(self.sql(queries), [])
+
+        # после фиксации переименования версия в кэше каталога увеличивается, ее увидит кэш любого процесса
+        version = catalog.get_version(self.parameters.version_key)
+        parameter.name = 'Диагональ (дюйм)'
+        with self.captureOnCommitCallbacks(execute=True):
+            parameter.save()
+            # до фиксации другие процессы не должны перезагрузить справочник без изменения
+            self.assertEqual(catalog.get_version(self.parameters.version_key), version)
+        self.assertEqual(self.parameters.find('Диагональ (дюйм)'), parameter.id)
+        self.assertIsNone(self.parameters.find('Цвет'))
+
+
+class CatalogCacheTests(APITestCase):
+
+    def setUp(self):
+        catalog.get_cache().clear()
+        self.addCleanup(catalog.get_cache().clear)
+        user = get_user_model().objects.create_user(email='shop@user.com', password='foo', type='shop')
+        product = Product.objects.create(name='Смартфон', category=Category.objects.create(name='Смартфоны', user=user))
+        self.offers = [
+            ProductInfo.objects.create(product=product, shop=Shop.objects.create(name=name, user=user),
+                                       model='m', quantity=1, price=100, price_rrc=120)
+            for name in ('Магазин 1', 'Магазин 2')
+        ]
+
+    def get(self, query=''):
+        response = self.client.get(reverse('productinfo-list') + query)
+        self.assertEqual(response.status_code, 200)
+        return response['X-Cache'], response.data['results']
+
+    def change_price(self, offer, price):
+        with self.captureOnCommitCallbacks(execute=True):
+            offer.price = price
+            offer.save()
+
+    def test_list_is_cached_until_offers_change(self):
+        self.assertEqual(self.get()[0], 'MISS')
+        self.assertEqual(self.get()[0], 'HIT')
+        self.assertEqual(catalog.stats(), {'hits': 1, 'misses': 1})
+
+        self.change_price(self.offers[0], 90)
+        state, data = self.get()
+        self.assertEqual(state, 'MISS')
+        self.assertIn(90, [offer['price'] for offer in data])
+
+    def test_shop_listing_depends_only_on_its_shop(self):
+        query = f'?shop={self.offers[0].shop_id}'
+        self.get(query)
+        self.change_price(self.offers[1], 90)
+        self.assertEqual(self.get(query)[0], 'HIT')
+        self.change_price(self.offers[0], 90)
+        self.assertEqual(self.get(query)[0], 'MISS')
+        self.assertEqual(self.get(query + '&ordering=price')[0], 'MISS')
+
+    def test_versions_bumped_in_shared_cache_reset_cache(self):
+        self.get()
+        self.assertEqual(self.get()[0], 'HIT')
+        # импорт в процессе Celery увеличивает версию в общем кэше (Redis), не вызывая сигналов этого процесса
+        catalog.get_cache().incr(catalog.GLOBAL_VERSION_KEY)
+        self.assertEqual(self.get()[0], 'MISS')
+
+    def test_reserved_and_released_stock_resets_cache(self):
+        self.get()
+        order = Order.objects.create(user=self.offers[0].shop.user, status='new')
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock(order, [OrderProduct(order=order, product_info=self.offers[0], quantity=1)])
+        state, data = self.get()
+        self.assertEqual(state, 'MISS')
+        self.assertEqual({offer['id']: offer['quantity'] for offer in data}[self.offers[0].id], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            release_stock(order)
+        self.assertEqual(self.get()[0], 'MISS')
+
+
+class CatalogSearchTests(APITestCase):
+
+    def setUp(self):
+        catalog.get_cache().clear()
+        user = get_user_model().objects.create_user(email='shop@user.com', password='foo', type='shop')
+        self.shop = Shop.objects.create(name='Магазин', user=user)
+        self.category = Category.objects.create(name='Смартфоны', user=user)
+
+    def create_offer(self, name, model, price=100):
+        product = Product.objects.create(name=name, category=self.category)
+        return ProductInfo.objects.create(product=product, shop=self.shop, model=model, quantity=1, price=price,
+                                          price_rrc=price)
+
+    def search(self, query):
+        response = self.client.get(reverse('productinfo-list'), {'search': query})
+        return [offer['id'] for offer in response.data['results']]
+
+    def test_search_uses_index_and_stays_in_sync(self):
+        phone = self.create_offer('Смартфон Apple iPhone XR', 'apple/iphone/xr')
+        case = self.create_offer('Чехол', 'case/iphone-xs')
+        self.assertEqual(self.search('смартфон xr'), [phone.id])
+        self.assertEqual(set(self.search('IPHONE')), {phone.id, case.id})
+        self.assertEqual(self.search('XR'), [phone.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(id=case.product_id).update(name='Чехол для смартфона')
+        self.assertEqual(set(self.search('смартфон')), {phone.id, case.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductInfo.objects.bulk_update([ProductInfo(id=case.id, model='case/galaxy')], ['model'])
+            phone.delete()
+        self.assertEqual(self.search('iphone'), [])
+
+    def test_search_is_ranked_by_relevance(self):
+        weak = self.create_offer('Чехол', 'apple/case')
+        strong = self.create_offer('Apple Watch', 'apple/watch')
+        self.assertEqual(self.search('apple watch'), [strong.id])
+        self.assertEqual(self.search('apple'), [strong.id, weak.id])
+
+    def test_search_query_uses_index(self):
+        self.create_offer('Смартфон Apple iPhone XR', 'apple/iphone/xr')
+        request = Request(APIRequestFactory().get('/', {'search': 'iphone xr'}))
+        queryset = CatalogSearchFilter().filter_queryset(request, ProductInfoViewSet.queryset.all(), ProductInfoViewSet)
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # на нескольких строках планировщик и так выбрал бы последовательное чтение
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            plan = ' '.join(str(column) for row in cursor.fetchall() for column in row)
+        if connection.vendor == 'postgresql':
+            self.assertIn('ordering_service_productinfo_search_trgm', plan)
+        else:
+            self.assertIn('VIRTUAL TABLE INDEX', plan)
+        # карточки читаются по ключу найденных строк индекса, а не перебором таблицы
+        self.assertNotRegex(plan, r'(?i)scan (on )?ordering_service_productinfo\b')
+
+
+class KeysetPaginationTests(APITestCase):
+
+    def setUp(self):
+        catalog.get_cache().clear()
+        self.user = get_user_model().objects.create_user(email='shop@user.com', password='foo', type='shop')
+        shop = Shop.objects.create(name='Магазин', user=self.user)
+        product = Product.objects.create(name='Смартфон', category=Category.objects.create(name='Смартфоны',
+                                                                                           user=self.user))
+        self.offers = [
+            ProductInfo.objects.create(product=product, shop=shop, model=f'm{i}', quantity=1, price=100 + i % 3,
+                                       price_rrc=120)
+            for i in range(7)
+        ]
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, params):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            ids += [item['id'] for item in response.data['results']]
+            url, params, pages = response.data['next'], None, pages + 1
+        return ids, pages
+
+    def test_pages_follow_sort_keys_with_ties(self):
+        ids, pages = self.walk(reverse('productinfo-list'), {'ordering': '-price', 'page_size': 2})
+        expected = sorted(self.offers, key=lambda offer: (-offer.price, -offer.id))
+        self.assertEqual(ids, [offer.id for offer in expected])
+        self.assertEqual(pages, 4)
+
+        response = self.client.get(reverse('productinfo-list'), {'count': 'estimate', 'page_size': 5})
+        self.assertEqual((response.data['count'], response.data['count_is_estimate']), (7, False))
+        self.assertEqual(self.client.get(reverse('productinfo-list'), {'cursor': 'мусор'}).status_code, 404)
+
+    def test_orders_are_paginated(self):
+        orders = [Order.objects.create(user=self.user, status='new') for _ in range(3)]
+        Order.objects.create(user=self.user)
+        ids, pages = self.walk(reverse('order'), {'page_size': 2})
+        self.assertEqual(ids, [order.id for order in reversed(orders)])
+        self.assertEqual(pages, 2)
+
+
+class OrderCheckoutTests(APITestCase):
+
+    def setUp(self):
+        self.shop_users = [
+            get_user_model().objects.create_user(email=f'shop{i}@user.com', password='foo', type='shop')
+            for i in range(2)
+        ]
+        shops = [Shop.objects.create(name=f'Магазин {i}', user=user) for i, user in enumerate(self.shop_users)]
+        product = Product.objects.create(name='Смартфон', category=Category.objects.create(name='Смартфоны',
+                                                                                           user=self.shop_users[0]))
+        self.offers = [
+            ProductInfo.objects.create(product=product, shop=shops[i // 2], model=f'm{i}', quantity=100,
+                                       price=100 * (i + 1), price_rrc=120)
+            for i in range(3)
+        ]
+        self.user = get_user_model().objects.create_user(email='buyer@user.com', password='foo', type='buyer')
+        self.contact = Contact.objects.create(user=self.user, phone='+70000000000')
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        dispatch_outbox()
+        self.client.force_authenticate(self.user)
+
+    def create_order(self):
+        order = Order.objects.create(user=self.user)
+        for offer in self.offers:
+            OrderProduct.objects.create(order=order, product_info=offer, quantity=2)
+        response = self.client.post(reverse('order'), {'order_id': order.id, 'contact_id': self.contact.id})
+        self.assertEqual(response.status_code, 200)
+        return order
+
+    def test_total_is_updated_incrementally_and_frozen_at_checkout(self):
+        order = self.create_order()
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, 1200)
+
+        line = order.order_products.get(product_info=self.offers[0])
+        line.quantity = 5
+        line.save()
+        order.order_products.get(product_info=self.offers[2]).delete()
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, 900)
+
+        ProductInfo.objects.filter(id=self.offers[1].id).update(price=1)
+        response = self.client.get(reverse('order'))
+        self.assertEqual(response.data['results'][0]['total_price'], 900)
+
+    def api_queries(self, method, url, data=None):
+        # CaptureQueriesContext не подходит: журнал запросов сбрасывается в начале каждого запроса к API
+        queries = []
+
+        def log(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(log):
+            self.response = getattr(self.client, method)(url, data, format='json')
+        self.assertEqual(self.response.status_code, 200, self.response.data)
+        return [sql for sql in queries if 'silk_' not in sql and not sql.startswith('EXPLAIN')]
+
+    def test_order_list_query_count_is_constant(self):
+        self.create_order()
+        single = self.api_queries('get', reverse('order'))
+        for _ in range(5):
+            self.create_order()
+        self.assertEqual(len(self.api_queries('get', reverse('order'))), len(single))
+
+    def test_basket_batch_upsert(self):
+        url = reverse('basket-batch')
+        self.api_queries('post', url, {'order_products': [{'product_info': self.offers[0].id, 'quantity': 1}]})
+        one = self.api_queries('post', url, {'order_products': [{'product_info': self.offers[0].id, 'quantity': 2}]})
+        lines = [{'product_info': offer.id, 'quantity': 3} for offer in self.offers]
+        self.assertEqual(len(self.api_queries('post', url, {'order_products': lines})), len(one))
+        self.assertEqual(self.response.data['total_price'], 1800)
+
+        lines = [{'product_info': self.offers[0].id, 'quantity': 0}, {'product_info': self.offers[1].id, 'quantity': 1}]
+        self.api_queries('post', url, {'order_products': lines})
+        self.assertEqual(sorted((line['product_info'], line['quantity'])
+                                for line in self.response.data['order_products']),
+                         [(self.offers[1].id, 1), (self.offers[2].id, 3)])
+        self.assertEqual(self.response.data['total_price'], 1100)
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+
+        response = self.client.post(url, {'order_products': [{'product_info': 0, 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_basket_line_quantity_defaults_to_one(self):
+        response = self.client.post(reverse('basket-list'), {'order_products': [{'product_info': self.offers[0].id}]},
+                                    format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual([line['quantity'] for line in response.data['order_products']], [1])
+        self.assertEqual(response.data['total_price'], 100)
+
+    def validation_queries(self, serializer):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+        return [query for query in queries if not query['sql'].startswith('EXPLAIN')]
+
+    def test_nested_ids_are_resolved_in_bulk(self):
+        lines = [{'product_info': offer.id, 'quantity': 1} for offer in self.offers]
+        serializer = OrderSerializer(data={'order_products': lines})
+        self.assertEqual(len(self.validation_queries(serializer)), 1)
+        self.assertEqual([line['product_info'] for line in serializer.validated_data['order_products']], self.offers)
+
+        serializer = OrderSerializer(data={'order_products': lines + [{'product_info': 0}, {'product_info': 'x'}]})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['order_products']['product_info'], ['Объекты не найдены: 0, x'])
+
+        serializer = ProductSerializer(data={'name': 'Смартфон', 'products_info': [offer.id for offer in self.offers]})
+        self.assertEqual(len(self.validation_queries(serializer)), 1)
+
+    def test_delisted_offer_cannot_be_ordered(self):
+        order = Order.objects.create(user=self.user)
+        OrderProduct.objects.create(order=order, product_info=self.offers[0], quantity=1)
+        ProductInfo.objects.filter(id=self.offers[0].id).update(is_active=False)
+
+        response = self.client.post(reverse('basket-batch'),
+                                    {'order_products': [{'product_info': self.offers[0].id, 'quantity': 1}]},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('order'), {'order_id': order.id, 'contact_id': self.contact.id})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['product_info'], [self.offers[0].id])
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'basket')
+        self.assertEqual(ProductInfo.objects.get(id=self.offers[0].id).quantity, 100)
+
+    def test_suppliers_see_only_their_part_of_order(self):
+        order = self.create_order()
+        self.assertEqual(self.client.post(reverse('order'), {'order_id': order.id, 'contact_id': self.contact.id}
+                                          ).status_code, 400)
+
+        self.client.force_authenticate(self.shop_users[0])
+        results = self.client.get(reverse('shoporder-list')).data['results']
+        self.assertEqual(len(results), 1)
+        self.assertEqual([line['product_info'] for line in results[0]['order_products']],
+                         [self.offers[0].id, self.offers[1].id])
+        self.assertEqual(results[0]['total_price'], 600)
+
+        url = reverse('shoporder-detail', args=[results[0]['id']])
+        self.assertEqual(self.client.post(reverse('shoporder-list'), {'status': 'new'}).status_code, 405)
+        self.assertEqual(self.client.put(url, {'status': 'canceled'}).status_code, 405)
+        self.assertEqual(self.client.delete(url).status_code, 405)
+        self.assertTrue(ShopOrder.objects.filter(id=results[0]['id'], status='new').exists())
+        self.assertEqual(self.client.patch(url, {'status': 'confirmed'}).status_code, 200)
+        self.assertEqual(len(self.client.get(reverse('shoporder-list'), {'status': 'new'}).data['results']), 0)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'new')
+
+        self.client.force_authenticate(self.shop_users[1])
+        results = self.client.get(reverse('shoporder-list'), {'status': 'new'}).data['results']
+        self.assertEqual((len(results), results[0]['total_price']), (1, 600))
+        self.client.patch(reverse('shoporder-detail', args=[results[0]['id']]), {'status': 'confirmed'})
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'confirmed')
+        self.assertFalse(StatusNotification.objects.exists())
+        self.assertEqual(dispatch_outbox(), 4)
+        self.assertEqual(StatusNotification.objects.filter(order=order, sent_at__isnull=True).count(), 2)
+
+    def test_canceled_supplier_order_cannot_be_reopened(self):
+        order = self.create_order()
+        self.client.force_authenticate(self.shop_users[0])
+        url = reverse('shoporder-detail', args=[ShopOrder.objects.get(order=order, shop=self.offers[0].shop).id])
+        self.assertEqual(self.client.patch(url, {'status': 'basket'}).status_code, 400)
+        self.assertEqual(self.client.patch(url, {'status': 'canceled'}).status_code, 200)
+        self.assertEqual(ProductInfo.objects.get(id=self.offers[0].id).quantity, 100)
+
+        for status in ('new', 'confirmed', 'basket'):
+            self.assertEqual(self.client.patch(url, {'status': status}).status_code, 400)
+        self.assertEqual(self.client.patch(url, {'status': 'canceled'}).status_code, 200)
+        self.assertEqual(ProductInfo.objects.get(id=self.offers[0].id).quantity, 100)
+        self.assertEqual(ShopOrder.objects.get(order=order, shop=self.offers[0].shop).status, 'canceled')
+
+
+class StockReservationTests(TransactionTestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(email='shop@user.com', password='foo', type='shop')
+        product = Product.objects.create(name='Смартфон', category=Category.objects.create(name='Смартфоны', user=user))
+        self.offer = ProductInfo.objects.create(product=product, shop=Shop.objects.create(name='Магазин', user=user),
+                                                model='m', quantity=25, price=100, price_rrc=120)
+        buyer = get_user_model().objects.create_user(email='buyer@user.com', password='foo', type='buyer')
+        self.orders = []
+        for _ in range(40):
+            order = Order.objects.create(user=buyer)
+            OrderProduct.objects.create(order=order, product_info=self.offer, quantity=1)
+            self.orders.append(order)
+
+    def checkout_concurrently(self):
+        reserved, errors = [], []
+
+        def checkout(order):
+            try:
+                while True:
+                    try:
+                        with transaction.atomic():
+                            reserve_stock(order, list(order.order_products.all()))
+                        reserved.append(order.id)
+                        return
+                    except OutOfStock:
+                        return
+                    except OperationalError as e:
+                        # SQLite блокирует базу целиком, конфликтующие транзакции повторяются
+                        if 'locked' not in str(e):
+                            raise
+                        time.sleep(random.random() / 1000)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(order,)) for order in self.orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return reserved
+
+    def available(self):
+        return ProductInfo.objects.get(id=self.offer.id).quantity + sum(
+            StockBucket.objects.filter(product_info=self.offer).values_list('quantity', flat=True)
+        )
+
+    def test_concurrent_checkouts_do_not_oversell(self):
+        reserved = self.checkout_concurrently()
+        self.assertEqual(len(reserved), 25)
+        self.assertEqual(self.available(), 0)
+        self.assertEqual(StockReservation.objects.count(), 25)
+
+        release_stock(Order.objects.get(id=reserved[0]))
+        release_stock(Order.objects.get(id=reserved[0]))
+        self.assertEqual(self.available(), 1)
+
+    @override_settings(STOCK_BUCKET_REFILL=3)
+    def test_hot_offer_buckets_do_not_oversell(self):
+        set_buckets(self.offer.id, 4)
+        reserved = self.checkout_concurrently()
+        self.assertEqual(len(reserved), 25)
+        self.assertEqual(self.available(), 0)
+
+        set_buckets(self.offer.id, 0)
+        with self.assertRaises(OutOfStock):
+            reserve_stock(self.orders[0], [OrderProduct(product_info=self.offer, quantity=1)])
+
+
+class BestOfferTests(APITestCase):
+
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(email='shop@user.com', password='foo', type='shop')
+        self.shops = [Shop.objects.create(name=f'Магазин {i}', user=self.owner) for i in range(3)]
+        self.product = Product.objects.create(name='Смартфон', category=Category.objects.create(name='Смартфоны',
+                                                                                                user=self.owner))
+        self.offers = [
+            ProductInfo.objects.create(product=self.product, shop=shop, model='m', quantity=5, price=price,
+                                       price_rrc=price)
+            for shop, price in zip(self.shops, (300, 100, 200))
+        ]
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        dispatch_outbox()
+
+    def best_offers(self):
+        response = self.client.get(reverse('product-offers', args=[self.product.id]))
+        self.assertEqual(response.status_code, 200)
+        return [(offer['rank'], offer['product_info'], offer['price']) for offer in response.data]
+
+    def test_index_follows_price_stock_and_shop_state(self):
+        self.assertEqual(self.best_offers(), [(1, self.offers[1].id, 100), (2, self.offers[2].id, 200),
+                                              (3, self.offers[0].id, 300)])
+
+        self.offers[0].price = 50
+        self.offers[0].save()
+        self.assertEqual(self.best_offers()[0], (1, self.offers[1].id, 100))
+        dispatch_outbox()
+        self.assertEqual(self.best_offers()[0], (1, self.offers[0].id, 50))
+
+        order = Order.objects.create(user=self.owner, status='new')
+        with mock.patch('ordering_service.best_offers.refresh', side_effect=OperationalError) as refresh:
+            with transaction.atomic():
+                reserve_stock(order, [OrderProduct(order=order, product_info=self.offers[0], quantity=5)])
+        # оформление не пересчитывает индекс само, это делает обработчик событий outbox
+        self.assertFalse(refresh.called)
+        dispatch_outbox()
+        self.assertEqual([offer[1] for offer in self.best_offers()], [self.offers[1].id, self.offers[2].id])
+        release_stock(order)
+        dispatch_outbox()
+        self.assertEqual(self.best_offers()[0][1], self.offers[0].id)
+
+        self.client.force_authenticate(self.owner)
+        response = self.client.patch(reverse('shop-detail', args=[self.shops[0].id]), {'state': False})
+        self.assertEqual(response.status_code, 200)
+        dispatch_outbox()
+        self.assertEqual(self.best_offers()[0][1], self.offers[1].id)
+
+        ProductInfo.objects.filter(product=self.product).delete()
+        dispatch_outbox()
+        self.assertEqual(self.best_offers(), [])
+
+    def test_best_offers_for_several_products(self):
+        other = Product.objects.create(name='Чехол', category=self.product.category)
+        url = reverse('product-best-offers')
+        response = self.client.get(url, {'ids': f'{other.id},{self.product.id},{other.id}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['product'], [offer['price'] for offer in item['offers']]) for item in response.data],
+                         [(other.id, []), (self.product.id, [100, 200, 300])])
+
+        self.assertEqual(self.client.get(url, {'ids': '1,x'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'ids': ','.join(map(str, range(1000)))}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('product-offers', args=[other.id + 1])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('product-offers', args=[other.id])).data, [])
+
+
+class StatusNotificationTests(TestCase):
+
+    def setUp(self):
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        self.orders = []
+        for email in ('first@user.com', 'first@user.com', 'second@user.com'):
+            user = get_user_model().objects.get_or_create(email=email, type='buyer')[0]
+            self.orders.append(Order.objects.create(user=user, status='new'))
+
+    def test_changes_are_coalesced_per_recipient(self):
+        first, other, second = self.orders
+        publish_status_changed(first, 'new', 'confirmed')
+        publish_status_changed(first, 'confirmed', 'sent')
+        publish_status_changed(other, 'new', 'sent')
+        publish_status_changed(second, 'new', 'confirmed')
+        publish_status_changed(second, 'confirmed', 'new')
+        self.assertEqual(dispatch_outbox(), 5)
+
+        with mock.patch('ordering_service.notifications.get_connection', wraps=get_connection) as connections:
+            metrics = send_status_notifications()
+        self.assertEqual(connections.call_count, 1)
+        self.assertEqual([(batch['notifications'], batch['messages'], batch['sent']) for batch in metrics], [(5, 1, 1)])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['first@user.com'])
+        self.assertEqual(mail.outbox[0].body.count('"Новый" на "Отправлен"'), 2)
+        self.assertEqual(send_status_notifications(), [])
+
+    def test_failed_batch_stays_buffered(self):
+        for order in self.orders:
+            publish_status_changed(order, 'new', 'sent')
+        dispatch_outbox()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError), \
+                self.assertLogs('ordering_service.notifications', 'ERROR'):
+            metrics = send_pending(batch_size=1)
+        self.assertEqual([batch['failed'] for batch in metrics], [True, True])
+        self.assertEqual([batch['messages'] for batch in send_pending(batch_size=1)], [1, 1])
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_notifications_claimed_by_another_run_are_skipped(self):
+        publish_status_changed(self.orders[0], 'new', 'sent')
+        dispatch_outbox()
+        StatusNotification.objects.update(claimed_at=timezone.now())
+        self.assertEqual(send_pending(), [])
+        self.assertEqual(len(mail.outbox), 0)
+
+        StatusNotification.objects.update(claimed_at=timezone.now() - timedelta(
+            seconds=settings.NOTIFICATION_CLAIM_TIMEOUT + 1))
+        self.assertEqual([batch['sent'] for batch in send_pending()], [1])
+        self.assertEqual(send_pending(), [])
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_outbox_survives_broker_failure_and_redelivery(self):
+        publish_status_changed(self.orders[0], 'new', 'sent')
+        with mock.patch.object(handle_order_events, 'delay', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                dispatch_outbox()
+        self.assertFalse(StatusNotification.objects.exists())
+
+        events = []
+        with mock.patch.object(handle_order_events, 'delay', side_effect=events.extend):
+            self.assertEqual(dispatch_outbox(), 1)
+        self.assertEqual(dispatch_outbox(), 0)
+        handle_order_events(events)
+        handle_order_events(events)
+        self.assertEqual(StatusNotification.objects.count(), 1)
+
+    def test_dispatched_events_purged_after_retention(self):
+        for order in self.orders:
+            publish_status_changed(order, 'new', 'sent')
+        pending = publish_status_changed(self.orders[0], 'sent', 'new')
+        OutboxEvent.objects.exclude(id=pending.id).update(dispatched_at=timezone.now() - timedelta(
+            days=settings.OUTBOX_RETENTION_DAYS, seconds=1))
+        recent = publish_status_changed(self.orders[1], 'sent', 'new')
+        OutboxEvent.objects.filter(id=recent.id).update(dispatched_at=timezone.now())
+
+        self.assertEqual(outbox.purge(batch_size=2), 3)
+        self.assertEqual(set(OutboxEvent.objects.values_list('id', flat=True)), {pending.id, recent.id})
+        self.assertEqual(purge_outbox(), 0)
+
+
+class AsyncReadViewTests(APITestCase):
+
+    def setUp(self):
+        catalog.get_cache().clear()
+        self.addCleanup(catalog.get_cache().clear)
+        owner = get_user_model().objects.create_user(email='shop@user.com', password='foo', type='shop')
+        self.owner_token = Token.objects.create(user=owner)
+        shop = Shop.objects.create(name='Магазин', user=owner)
+        category = Category.objects.create(name='Смартфоны', user=owner)
+        category.shops.add(shop)
+        product = Product.objects.create(name='Смартфон', category=category)
+        self.offer = ProductInfo.objects.create(product=product, shop=shop, model='m', quantity=10, price=100,
+                                                price_rrc=120)
+        ProductInfoParameter.objects.create(product_info=self.offer, value='128 ГБ',
+                                            parameter=Parameter.objects.create(name='Память'))
+        buyer = get_user_model().objects.create_user(email='buyer@user.com', password='foo', type='buyer')
+        self.buyer_token = Token.objects.create(user=buyer)
+        contact = Contact.objects.create(user=buyer, phone='+70000000000')
+        for status in ('new', 'basket'):
+            order = Order.objects.create(user=buyer, contact=contact, status=status)
+            OrderProduct.objects.create(order=order, product_info=self.offer, quantity=2)
+
+    def call(self, view, url, token=None, **kwargs):
+        headers = {'Authorization': f'Token {token.key}'} if token else {}
+        response = async_to_sync(view)(AsyncRequestFactory().get(url, headers=headers), **kwargs)
+        return response.status_code, json.loads(response.content)
+
+    def queries(self, view, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.call(view, url)
+        return [query for query in queries if not query['sql'].startswith('EXPLAIN')]
+
+    def test_async_views_return_same_data_as_sync_views(self):
+        cases = [
+            (shop_list, reverse('shop-list'), None, {}),
+            (category_list, reverse('category-list'), None, {}),
+            (product_info_list, reverse('productinfo-list') + '?ordering=price&page_size=1', None, {}),
+            (product_info_detail, reverse('productinfo-detail', args=[self.offer.id]), self.owner_token,
+             {'pk': self.offer.id}),
+            (order_list, reverse('order'), self.buyer_token, {}),
+        ]
+        for view, url, token, kwargs in cases:
+            with self.subTest(url=url):
+                catalog.get_cache().clear()
+                if token:
+                    self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+                expected = self.client.get(url)
+                self.client.credentials()
+                catalog.get_cache().clear()
+                self.assertEqual(self.call(view, url, token, **kwargs), (200, json.loads(expected.content)))
+        self.assertEqual(len(self.call(order_list, reverse('order'), self.buyer_token)[1]['results']), 1)
+
+    def test_async_views_check_access(self):
+        url = reverse('productinfo-detail', args=[self.offer.id])
+        self.assertEqual(self.call(product_info_detail, url, pk=self.offer.id)[0], 401)
+        self.assertEqual(self.call(product_info_detail, url, self.buyer_token, pk=self.offer.id)[0], 403)
+        self.assertEqual(self.call(product_info_detail, url, self.owner_token, pk=0)[0], 404)
+        self.assertEqual(self.call(order_list, reverse('order'))[0], 401)
+        self.owner_token.key = 'x' * 40
+        self.assertEqual(self.call(shop_list, reverse('shop-list'), self.owner_token)[0], 401)
+
+    def test_cache_hit_and_writes_through_read_view(self):
+        url = reverse('productinfo-list')
+        self.assertEqual(len(self.queries(product_info_list, url)), 3)
+        self.assertEqual(self.queries(product_info_list, url), [])
+        self.assertEqual(self.call(product_info_list, url)[1], json.loads(self.client.get(url).content))
+
+        view = read_view(shop_list, ShopViewSet.as_view({'get': 'list', 'post': 'create'}))
+        request = AsyncRequestFactory().post(reverse('shop-list'), {'name': 'Новый магазин'},
+                                             content_type='application/json',
+                                             headers={'Authorization': f'Token {self.owner_token.key}'})
+        self.assertEqual(async_to_sync(view)(request).status_code, 201)
+        self.assertEqual(len(self.call(view, reverse('shop-list'))[1]), 2)
+
+
+@override_settings(ORDER_EVENTS_HEARTBEAT=0.05)
+class OrderEventStreamTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(streams, 'broker', LocalBroker())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        user = get_user_model().objects.create_user(email='shop@user.com', password='foo', type='shop')
+        self.token = Token.objects.create(user=user)
+        self.shop = Shop.objects.create(name='Магазин', user=user)
+        self.other_shop = Shop.objects.create(name='Другой магазин', user=user.__class__.objects.create_user(
+            email='other@user.com', password='foo', type='shop'))
+        buyer = get_user_model().objects.create_user(email='buyer@user.com', password='foo', type='buyer')
+        self.order = Order.objects.create(user=buyer, status='new')
+        self.missed = [
+            publish(ORDER_STATUS_CHANGED, {'order_id': self.order.id, 'shop_id': shop.id, 'recipient': 'buyer@user.com',
+                                           'old_status': 'new', 'new_status': 'confirmed'})
+            for shop in (self.shop, self.other_shop, self.shop)
+        ]
+
+    async def open(self, **params):
+        response = await self.async_client.get(reverse('order-events'), params,
+                                               headers={'Authorization': f'Token {self.token.key}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return response.streaming_content
+
+    async def test_stream_resumes_and_pushes_new_events(self):
+        stream = await self.open(last_event_id=self.missed[0].id - 1)
+        self.assertTrue((await anext(stream)).startswith(b'retry:'))
+        replayed = [await anext(stream), await anext(stream)]
+        self.assertEqual([chunk.split(b'\n')[0] for chunk in replayed],
+                         [f'id: {self.missed[0].id}'.encode(), f'id: {self.missed[2].id}'.encode()])
+        self.assertNotIn(b'buyer@user.com', replayed[0])
+
+        self.assertEqual(await anext(stream), b': heartbeat\n\n')
+        for event_id, shop in ((self.missed[2].id, self.shop), (self.missed[2].id + 1, self.other_shop),
+                               (self.missed[2].id + 2, self.shop)):
+            streams.get_broker().publish({'id': event_id, 'topic': ORDER_CREATED, 'payload': {'shop_id': shop.id}})
+        self.assertTrue((await anext(stream)).startswith(f'id: {self.missed[2].id + 2}\n'.encode()))
+
+    @override_settings(ORDER_EVENTS_REDIS_URL=None)
+    def test_broker_requires_redis_with_celery_worker(self):
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        with mock.patch.object(streams, 'broker', None):
+            with self.assertRaises(ImproperlyConfigured):
+                streams.get_broker()
+            with self.assertRaises(ImproperlyConfigured), self.assertLogs('ordering_service.outbox', 'ERROR'):
+                handle_order_events([{'id': self.missed[0].id, 'topic': ORDER_STATUS_CHANGED,
+                                      'payload': self.missed[0].payload}])
+            # уведомление записывается, даже если поток событий не настроен
+            self.assertEqual(StatusNotification.objects.filter(event=self.missed[0]).count(), 1)
+
+            celery_app.conf.task_always_eager = True
+            self.assertIsInstance(streams.get_broker(), LocalBroker)
+
+    def test_missed_events_use_shop_index(self):
+        events = OutboxEvent.objects.filter(shop_id__in=[self.shop.id], id__gt=self.missed[0].id).order_by('id')
+        self.assertEqual(list(events), [self.missed[2]])
+        sql, params = events.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            plan = ' '.join(str(column) for row in cursor.fetchall() for column in row)
+        if connection.vendor == 'sqlite':
+            self.assertIn('outbox_shop_idx', plan)
+
+    async def test_stream_requires_supplier_token(self):
+        response = await self.async_client.get(reverse('order-events'))
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get(reverse('order-events'), {'last_event_id': 'x'},
+                                               headers={'Authorization': f'Token {self.token.key}'})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,52 @@
+import re
+
+NUMBER = re.compile(r'^\s*([-+]?\d+(?:[.,]\d+)?)\s*(.*?)\s*$')
+NAME_UNIT = re.compile(r'\(([^()]+)\)\s*$')
+
+# единицы одной величины: множитель относительно базовой единицы, базовая единица указана первой
+UNIT_FAMILIES = [
+    {'гб': 1, 'gb': 1, 'мб': 1 / 1024, 'mb': 1 / 1024, 'кб': 1 / 1024 ** 2, 'kb': 1 / 1024 ** 2,
+     'тб': 1024, 'tb': 1024},
+    {'дюйм': 1, 'дюйма': 1, 'дюймов': 1, 'in': 1, '"': 1, '″': 1, 'мм': 1 / 25.4, 'mm': 1 / 25.4,
+     'см': 1 / 2.54, 'cm': 1 / 2.54},
+    {'г': 1, 'гр': 1, 'g': 1, 'кг': 1000, 'kg': 1000},
+    {'мгц': 1, 'mhz': 1, 'ггц': 1000, 'ghz': 1000},
+    {'мач': 1, 'mah': 1},
+    {'вт': 1, 'w': 1},
+    {'пикс': 1, 'px': 1},
+    {'мп': 1, 'mp': 1},
+]
+UNITS = {unit: (family, factor) for family, units in enumerate(UNIT_FAMILIES) for unit, factor in units.items()}
+
+
+def normalize_unit(unit):
+    return unit.strip().lower().rstrip('.')
+
+
+def parse_numeric(value, parameter_name=''):
+    """
+    Числовое значение параметра с учетом единиц измерения.
+    Значение приводится к единице из названия параметра ("Встроенная память (Гб)": "1 ТБ" -> 1024),
+    а если в названии единицы нет - к базовой единице величины. Значения, которые не являются
+    одним числом ("2688x1242") или записаны в неизвестных единицах, возвращаются как None.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = NUMBER.match(str(value))
+    if match is None:
+        return None
+    number = float(match.group(1).replace(',', '.'))
+    unit = normalize_unit(match.group(2))
+
+    name_match = NAME_UNIT.search(parameter_name)
+    target = UNITS.get(normalize_unit(name_match.group(1))) if name_match else None
+    if not unit:
+        return number
+    if unit not in UNITS:
+        return None
+    family, factor = UNITS[unit]
+    if target is not None and target[0] == family:
+        return number * factor / target[1]
+    return number * factor
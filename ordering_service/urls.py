@@ -1,6 +1,16 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 
+from ordering_service.async_views import (
+    read_view,
+    shop_list,
+    category_list,
+    product_info_list,
+    product_info_detail,
+    order_list,
+    order_events,
+)
 from ordering_service.views import (
     ContactViewSet,
     ShopViewSet,
@@ -8,6 +18,7 @@ from ordering_service.views import (
     ProductViewSet,
     ProductInfoViewSet,
     GoodsImportAPIView,
+    GoodsImportJobView,
     BasketViewSet,
     OrderView,
     PartnerOrdersSet,
@@ -25,7 +36,7 @@ router.register('shops', ShopViewSet)
 router.register('categories', CategoryViewSet)
 router.register('product', ProductViewSet)
 router.register('product_info', ProductInfoViewSet)
-router.register(r'basket', BasketViewSet)
+router.register(r'basket', BasketViewSet, basename='basket')
 router.register('order/partner', PartnerOrdersSet)
 
 urlpatterns = [
@@ -64,12 +75,36 @@ urlpatterns = [
         GoodsImportAPIView.as_view(),
         name='goods-import'
     ),
+    path(
+        'goods-import/<uuid:job_id>/',
+        GoodsImportJobView.as_view(),
+        name='goods-import-job'
+    ),
     path(
         'order/',
         OrderView.as_view(),
         name='order'
     ),
+    path(
+        'order/partner/events/',
+        order_events,
+        name='order-events'
+    ),
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
-] + router.urls
+]
+
+if settings.ASYNC_READ_VIEWS:
+    # под ASGI чтение каталога и заказов обслуживают асинхронные представления, запись - прежние ViewSet
+    urlpatterns = [
+        path('shops/', read_view(shop_list, ShopViewSet.as_view({'get': 'list', 'post': 'create'}))),
+        path('categories/', read_view(category_list, CategoryViewSet.as_view({'get': 'list', 'post': 'create'}))),
+        path('product_info/', read_view(product_info_list, ProductInfoViewSet.as_view(
+            {'get': 'list', 'post': 'create'}))),
+        path('product_info/<int:pk>/', read_view(product_info_detail, ProductInfoViewSet.as_view(
+            {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}))),
+        path('order/', read_view(order_list, OrderView.as_view())),
+    ] + urlpatterns
+
+urlpatterns += router.urls
@@ -0,0 +1,144 @@
+from django.conf import settings
+from django.db.backends.base.operations import BaseDatabaseOperations
+
+from ordering_service.models import Shop, Category, Product, ProductInfo, Parameter, ProductInfoParameter
+from ordering_service.readers import PriceListError
+
+INTEGER_RANGES = BaseDatabaseOperations.integer_field_ranges
+
+
+def max_length(model, field_name):
+    return model._meta.get_field(field_name).max_length
+
+
+def integer_range(model, field_name):
+    return INTEGER_RANGES[model._meta.get_field(field_name).get_internal_type()]
+
+
+def string(length):
+    def check(value):
+        if not isinstance(value, str) or not value.strip():
+            return 'должно быть непустой строкой'
+        if len(value) > length:
+            return f'длиннее {length} символов'
+    return check
+
+
+def integer(bounds):
+    minimum, maximum = bounds
+
+    def check(value):
+        if isinstance(value, bool) or not isinstance(value, int):
+            return 'должно быть целым числом'
+        if not minimum <= value <= maximum:
+            return f'должно быть в диапазоне от {minimum} до {maximum}'
+    return check
+
+
+def one_of(choices):
+    def check(value):
+        if isinstance(value, bool) or value not in choices:
+            return 'нет в списке категорий прайс-листа'
+    return check
+
+
+def parameters(name_length, value_length):
+    def check(value):
+        if not isinstance(value, dict):
+            return 'должно быть словарем параметров'
+        for name, parameter_value in value.items():
+            if not isinstance(name, str) or not name.strip() or len(name) > name_length:
+                return f'некорректное название параметра {name!r}'
+            if isinstance(parameter_value, (dict, list)) or parameter_value is None:
+                return f'параметр {name!r} должен быть строкой или числом'
+            if len(str(parameter_value)) > value_length:
+                return f'значение параметра {name!r} длиннее {value_length} символов'
+    return check
+
+
+def compile_schema(schema):
+    """
+    Сборка функции проверки словаря по схеме {поле: проверка}.
+    Функция возвращает список пар (поле, сообщение) для всех найденных ошибок.
+    """
+    checks = tuple(schema.items())
+
+    def validate(item):
+        if not isinstance(item, dict):
+            return [(None, 'ожидается объект с полями товара')]
+        errors = []
+        for field, check in checks:
+            if field not in item:
+                errors.append((field, 'обязательное поле'))
+                continue
+            message = check(item[field])
+            if message is not None:
+                errors.append((field, message))
+        return errors
+    return validate
+
+
+CATEGORY_SCHEMA = {
+    'id': integer(INTEGER_RANGES['PositiveBigIntegerField']),
+    'name': string(max_length(Category, 'name')),
+}
+
+GOODS_SCHEMA = {
+    'id': integer(integer_range(ProductInfo, 'external_id')),
+    'model': string(max_length(ProductInfo, 'model')),
+    'name': string(max_length(Product, 'name')),
+    'price': integer(integer_range(ProductInfo, 'price')),
+    'price_rrc': integer(integer_range(ProductInfo, 'price_rrc')),
+    'quantity': integer(integer_range(ProductInfo, 'quantity')),
+    'parameters': parameters(max_length(Parameter, 'name'), max_length(ProductInfoParameter, 'value')),
+}
+
+validate_shop = string(max_length(Shop, 'name'))
+validate_category = compile_schema(CATEGORY_SCHEMA)
+
+
+class PriceListValidator:
+    """
+    Проверка структуры прайс-листа за один проход до записи в базу.
+    Собирает все ошибки (не больше GOODS_IMPORT_MAX_ERRORS) с номерами строк и порядковыми номерами товаров.
+    """
+
+    def __init__(self, max_errors=None):
+        self.max_errors = max_errors or settings.GOODS_IMPORT_MAX_ERRORS
+        self.errors = []
+        self.error_count = 0
+        self.goods_count = 0
+
+    def validate(self, price_list):
+        message = validate_shop(price_list.shop)
+        if message is not None:
+            self.add(None, None, 'shop', message)
+
+        category_ids = set()
+        if isinstance(price_list.categories, list):
+            for number, category in enumerate(price_list.categories, 1):
+                for field, message in validate_category(category):
+                    self.add(None, None, f'categories[{number}].{field}' if field else 'categories', message)
+                if isinstance(category, dict) and 'id' in category:
+                    category_ids.add(category['id'])
+        else:
+            self.add(None, None, 'categories', 'должно быть списком категорий')
+
+        validate_item = compile_schema({**GOODS_SCHEMA, 'category': one_of(category_ids)})
+        try:
+            for line, item in price_list.numbered_goods():
+                self.goods_count += 1
+                for field, message in validate_item(item):
+                    self.add(line, self.goods_count, field, message)
+        except PriceListError as e:
+            self.add(e.line, None, None, str(e))
+
+        if self.error_count > len(self.errors):
+            self.errors.append({'line': None, 'item': None, 'field': None,
+                                'message': f'Всего ошибок: {self.error_count}, показаны первые {len(self.errors)}'})
+        return self.errors
+
+    def add(self, line, item, field, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'item': item, 'field': field, 'message': message})
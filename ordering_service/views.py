@@ -1,13 +1,17 @@
-import yaml
+import os
+
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from ordering_service.permissions import IsShopOwner
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework import serializers, status
 from rest_framework.decorators import action
 from rest_framework.exceptions import PermissionDenied
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
@@ -18,10 +22,14 @@ from ordering_service.serializers import (
     CategorySerializer,
     ProductSerializer,
     ProductInfoSerializer,
+    BestOfferSerializer,
     OrderSerializer,
+    BasketBatchSerializer,
     AddressSerializer,
     OrderProductSerializer,
-    OrderNewSerializer
+    OrderNewSerializer,
+    ShopOrderSerializer,
+    ImportJobSerializer
 )
 from ordering_service.models import (
     Contact,
@@ -32,11 +40,20 @@ from ordering_service.models import (
     ProductInfo,
     OrderProduct,
     Order,
-    Parameter,
-    ProductInfoParameter
+    ShopOrder,
+    BestOffer,
+    ImportJob
 )
 
-from .tasks import send_status_change_email
+from . import catalog
+from .best_offers import MAX_PRODUCTS
+from .facets import facet_index, parameter_filters
+from .filters import CatalogSearchFilter, ParameterFilter
+from .pagination import KeysetPagination
+from .outbox import publish_order_created, publish_status_changed
+from .readers import READERS, PriceListError, detect_format
+from .stock import OutOfStock, reserve as reserve_stock, release as release_stock
+from .tasks import enqueue_import_job
 
 
 class AddressViewSet(ModelViewSet):
@@ -213,6 +230,35 @@ class ProductViewSet(ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    lookup_value_regex = r'\d+'
+
+    """
+    Лучшие предложения товара по возрастанию цены из индекса BestOffer (первое - самое дешевое)
+    """
+    @action(detail=True)
+    def offers(self, request, pk=None):
+        offers = BestOffer.objects.filter(product_id=pk).order_by('rank')
+        data = BestOfferSerializer(offers, many=True).data
+        if not data:
+            get_object_or_404(Product, pk=pk)
+        return Response(data)
+
+    """
+    Лучшие предложения нескольких товаров: ?ids=1,2,3
+    """
+    @action(detail=False, url_path='best_offers')
+    def best_offers(self, request):
+        try:
+            ids = list(dict.fromkeys(int(value) for value in request.query_params.get('ids', '').split(',')))
+        except ValueError:
+            raise serializers.ValidationError({'ids': 'Ожидается список id товаров через запятую'})
+        if len(ids) > MAX_PRODUCTS:
+            raise serializers.ValidationError({'ids': f'Можно запросить не больше {MAX_PRODUCTS} товаров'})
+        offers = {product_id: [] for product_id in ids}
+        for offer in BestOffer.objects.filter(product_id__in=ids).order_by('product_id', 'rank'):
+            offers[offer.product_id].append(offer)
+        return Response([{'product': product_id, 'offers': BestOfferSerializer(product_offers, many=True).data}
+                         for product_id, product_offers in offers.items()])
 
     """
     Создание продукта (товара)
@@ -243,9 +289,10 @@ class ProductInfoViewSet(ModelViewSet):
     """
     Работа с карточкой товара
     """
-    queryset = ProductInfo.objects.all()
+    queryset = ProductInfo.objects.filter(is_active=True)
     serializer_class = ProductInfoSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, CatalogSearchFilter, ParameterFilter, OrderingFilter]
+    pagination_class = KeysetPagination
     filterset_fields = {
         'product__category': ['exact', ],
         'shop': ['exact', ],
@@ -255,6 +302,41 @@ class ProductInfoViewSet(ModelViewSet):
     ordering_fields = ['product__name', 'model', 'price']
     permission_classes = [IsAuthenticatedOrReadOnly, IsShopOwner]
 
+    """
+    Список карточек из кэша каталога, ключ строится по параметрам запроса
+    """
+    def list(self, request, *args, **kwargs):
+        data, hit = catalog.cached_data(catalog.list_key(request.query_params),
+                                        lambda: super(ProductInfoViewSet, self).list(request, *args, **kwargs).data)
+        return Response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
+    """
+    Карточка товара из кэша каталога. Права доступа проверяются до обращения к кэшу
+    """
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        data, hit = catalog.cached_data(catalog.detail_key(instance), lambda: self.get_serializer(instance).data)
+        return Response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
+    """
+    Количество карточек по значениям параметров для текущей выборки (фильтры, ?search=, ?param[...]=)
+    Фильтры по значениям учитываются по обратному индексу, диапазоны числовых параметров - запросом к базе
+    """
+    @action(detail=False)
+    def facets(self, request):
+        def compute():
+            queryset = self.get_queryset()
+            for backend in self.filter_backends:
+                if backend is not ParameterFilter:
+                    queryset = backend().filter_queryset(request, queryset, self)
+            queryset = ParameterFilter().filter_ranges(request, queryset)
+            count, facets = facet_index.counts(queryset.order_by().values_list('id', flat=True),
+                                               parameter_filters(request.query_params))
+            return {'count': count, 'facets': facets}
+
+        data, hit = catalog.cached_data(catalog.list_key(request.query_params, prefix='facets'), compute)
+        return Response(data, headers={'X-Cache': 'HIT' if hit else 'MISS'})
+
     """
     Создание карточки продукта (товара)
     """
@@ -266,51 +348,59 @@ class ProductInfoViewSet(ModelViewSet):
 
 class GoodsImportAPIView(APIView):
     """
-    Импорт товаров из файла
+    Импорт товаров из файла в формате YAML, JSON, NDJSON или CSV.
+    Формат определяется по типу содержимого или расширению файла.
+    Файл сохраняется на диск и обрабатывается фоновой задачей, в ответ возвращается идентификатор задачи.
+    Параметр dry_run позволяет получить разницу с текущим прайс-листом без записи в базу.
     """
     def post(self, request, *args, **kwargs):
         if not request.user.is_authenticated or request.user.type != 'shop':
             return Response({'status': False, 'message': 'Только авторизованные поставщики могут импортировать товары.'},
                             status=status.HTTP_403_FORBIDDEN)
+        if 'file' not in request.FILES:
+            return Response({'status': 'error', 'message': 'Необходимо передать файл'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        upload = request.FILES['file']
+        price_list_format = detect_format(upload.name, upload.content_type)
+        if price_list_format is None:
+            return Response({'status': 'error', 'message': 'Поддерживаются форматы: ' + ', '.join(READERS)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        dry_run = str(request.query_params.get('dry_run', request.data.get('dry_run', ''))).lower() in ('1', 'true')
+
+        job = ImportJob(user=request.user, dry_run=dry_run, format=price_list_format)
+        os.makedirs(settings.GOODS_IMPORT_DIR, exist_ok=True)
+        job.file = os.path.join(settings.GOODS_IMPORT_DIR, f'{job.id}.{price_list_format}')
+        with open(job.file, 'wb') as destination:
+            for chunk in upload.chunks():
+                destination.write(chunk)
         try:
-            data = yaml.load(request.FILES['file'].read(), Loader=yaml.FullLoader)
-
-            shop, created = Shop.objects.get_or_create(name=data['shop'], user_id=request.user.id)
-
-            categories = {}
-            for category_data in data['categories']:
-                category, created = Category.objects.get_or_create(name=category_data['name'], user_id=request.user.id)
-                categories[category_data['id']] = category
-                shop.categories.add(category)
-
-            products = {}
-            for product_data in data['goods']:
-                category = categories[product_data['category']]
-                product, created = Product.objects.get_or_create(name=product_data['name'], category=category)
-                products[product_data['id']] = product
-                category.products.add(product)
-
-                product_info, created = ProductInfo.objects.get_or_create(
-                    product=product,
-                    shop=shop,
-                    model=product_data['model'],
-                    quantity=product_data['quantity'],
-                    price=product_data['price'],
-                    price_rrc=product_data['price_rrc']
-                )
-
-                for param_name, param_value in product_data['parameters'].items():
-                    parameter, created = Parameter.objects.get_or_create(name=param_name)
-                    ProductInfoParameter.objects.create(
-                        product_info=product_info,
-                        parameter=parameter,
-                        value=param_value
-                    )
-
-            return Response({'status': 'success'}, status=status.HTTP_201_CREATED)
-        except Exception as e:
+            enqueue_import_job(job)
+        except PriceListError as e:
+            os.remove(job.file)
             return Response({'status': 'error', 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+        return Response({'status': 'accepted', 'job_id': job.id,
+                         'url': reverse('goods-import-job', args=[job.id], request=request)},
+                        status=status.HTTP_202_ACCEPTED)
+
+
+class GoodsImportJobView(APIView):
+    """
+    Состояние задачи импорта товаров
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = get_object_or_404(ImportJob, id=job_id, user=request.user)
+        return Response(ImportJobSerializer(job).data)
+
+
+def with_order_details(queryset):
+    """
+    Заказы вместе с позициями и контактами: количество запросов не зависит от числа заказов
+    """
+    return queryset.select_related('contact').prefetch_related('order_products', 'contact__addressies')
+
 
 class BasketViewSet(ModelViewSet):
     """
@@ -319,13 +409,14 @@ class BasketViewSet(ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
     """
     Просмотр корзины пользователя
     """
     def get_queryset(self):
         if self.request.user.type == 'buyer':
-            queryset = Order.objects.filter(user=self.request.user, status='basket')
+            queryset = with_order_details(Order.objects.filter(user=self.request.user, status='basket'))
         else:
             raise PermissionDenied("У вас недостаточно прав!")
         return queryset
@@ -364,6 +455,26 @@ class BasketViewSet(ModelViewSet):
             raise PermissionDenied("Вы не являетесь владельцем заказа!")
         super().perform_destroy(instance)
 
+    """
+    Пакетное изменение корзины: {"order_products": [{"product_info": id, "quantity": n}, ...]},
+    количество 0 удаляет позицию. Возвращает корзину целиком.
+    """
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        if request.user.type != 'buyer':
+            raise PermissionDenied("У вас недостаточно прав!")
+        serializer = BasketBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            # блокировка корзины ждет оформления заказа, которое идет в этот момент
+            basket, _ = Order.objects.select_for_update().get_or_create(
+                user=request.user, status='basket',
+                defaults={'contact': Contact.objects.filter(user=request.user).first()}
+            )
+            basket.set_products(serializer.validated_data['order_products'])
+        basket = with_order_details(Order.objects.filter(id=basket.id)).get()
+        return Response(OrderSerializer(basket).data)
+
     """
     Удаление товара из корзины пользователя
     """
@@ -400,9 +511,11 @@ class OrderView(APIView):
     Получения списков заказов пользователя
     """
     def get(self, request):
-        orders = Order.objects.filter(user=request.user).exclude(status='basket')
-        serializer = OrderNewSerializer(orders, many=True)
-        return Response(serializer.data)
+        orders = with_order_details(Order.objects.filter(user=request.user).exclude(status='basket'))
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(orders, request, view=self)
+        serializer = OrderNewSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     """
     Создание заказа пользователя из товаров в корзине
@@ -414,53 +527,79 @@ class OrderView(APIView):
             return Response ({'error': 'Необходимо передать id заказа и id контакта'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            order = Order.objects.get(id=order_id, user=request.user)
-            contact = Contact.objects.get(id=contact_id)
-        except (Order.DoesNotExist, Contact.DoesNotExist):
-            return Response({'error': 'Заказ или контакт не найдены'}, status=status.HTTP_404_NOT_FOUND)
-
-        order.contact = contact
-        order.status = 'new'
-        order.created_at = timezone.now()
-        order.save()
+            with transaction.atomic():
+                # корзина блокируется до конца оформления, чтобы ее нельзя было оформить дважды
+                # или изменить между проверкой и резервированием
+                try:
+                    order = Order.objects.select_for_update().get(id=order_id, user=request.user)
+                    contact = Contact.objects.get(id=contact_id)
+                except (Order.DoesNotExist, Contact.DoesNotExist):
+                    return Response({'error': 'Заказ или контакт не найдены'}, status=status.HTTP_404_NOT_FOUND)
+                if order.status != 'basket':
+                    return Response({'error': 'Заказ уже оформлен'}, status=status.HTTP_400_BAD_REQUEST)
+
+                order.contact = contact
+                order.status = 'new'
+                order.created_at = timezone.now()
+                reserve_stock(order, order.checkout())
+                order.save()
+                publish_order_created(order, order.shop_orders.all())
+        except OutOfStock as e:
+            return Response({'error': str(e), 'product_info': e.product_info_ids}, status=status.HTTP_409_CONFLICT)
 
         return Response({'message': 'Заказ успешно обновлен'}, status=status.HTTP_200_OK)
 
 
 class PartnerOrdersSet(ModelViewSet):
     """
-    Получение заказов поставщиков
+    Получение заказов поставщиков: каждый поставщик видит свою часть заказа (ShopOrder)
+    только с позициями своих магазинов. Фильтр по статусу: ?status=new
     """
-    queryset = Order.objects.all()
-    serializer_class = OrderNewSerializer
+    queryset = ShopOrder.objects.all()
+    serializer_class = ShopOrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['status', 'shop']
+    # поставщик только просматривает свою часть заказа и меняет ее статус: создание, замена
+    # и удаление не проходят через резервирование и outbox
+    http_method_names = ['get', 'patch', 'head', 'options']
 
     """
     Получение списка заказов, оформленных у поставщика
     """
-    def get(self, request):
+    def get_queryset(self):
         if self.request.user.type != 'shop':
             raise PermissionDenied("У вас недостаточно прав!")
-        else:
-            orders = Order.objects.filter(order_products__product_info__shop__user_id=request.user.id
-                                          ).exclude(status='basket').distinct()
-            serializer = OrderNewSerializer(orders, many=True)
-            return Response(serializer.data)
+        shop_ids = list(Shop.objects.filter(user=self.request.user).values_list('id', flat=True))
+        queryset = ShopOrder.objects.filter(shop_id__in=shop_ids).select_related('order__contact').prefetch_related(
+            'order_products', 'order__contact__addressies'
+        )
+        if self.action == 'partial_update':
+            queryset = queryset.select_for_update(of=('self',))
+        return queryset
 
     """
     Функция для редактирования заказа поставщиком.
-    Также использует celery для отправки email с изменением статуса заказа на почту покупателю.
+    Изменение статуса записывается в outbox в той же транзакции, письма покупателям отправляются пачками задачей celery.
+    При отмене зарезервированный товар возвращается на склад.
     """
     def partial_update(self, request, *args, **kwargs):
-        instance = self.get_object()
-        serializer = self.get_serializer(instance, data=request.data, partial=True)
-        serializer.is_valid(raise_exception=True)
-
-        current_status = instance.status
-        new_status = request.data.get('status')
-        if new_status and new_status != current_status:
-            recipient_email = instance.user.email
-            send_status_change_email.delay(current_status, new_status, recipient_email)
-
-        serializer.save()
+        with transaction.atomic():
+            # заказ магазина блокируется до проверки статуса: одновременные изменения статуса
+            # выполняются по очереди, и товар при отмене возвращается на склад один раз
+            instance = self.get_object()
+            serializer = self.get_serializer(instance, data=request.data, partial=True)
+            serializer.is_valid(raise_exception=True)
+
+            current_status = instance.status
+            new_status = serializer.validated_data.get('status', current_status)
+            if new_status != current_status:
+                publish_status_changed(instance.order, current_status, new_status, shop_id=instance.shop_id)
+            if new_status == 'canceled' and current_status != 'canceled':
+                release_stock(instance.order, shop_id=instance.shop_id)
+            serializer.save()
+            statuses = set(ShopOrder.objects.filter(order_id=instance.order_id).values_list('status', flat=True))
+            if len(statuses) == 1:
+                Order.objects.filter(id=instance.order_id).update(status=statuses.pop())
         return Response(serializer.data)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -163,11 +164,81 @@ AUTH_USER_MODEL = 'ordering_service.CustomUser'
 # Celery settings
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379/0'
 CELERY_RESULT_BACKEND = 'redis://127.0.0.1:6379/1'
+CELERY_BEAT_SCHEDULE = {
+    'pull-price-lists': {
+        'task': 'ordering_service.tasks.pull_price_lists',
+        'schedule': 60 * 60,
+    },
+    'dispatch-outbox': {
+        'task': 'ordering_service.tasks.dispatch_outbox',
+        'schedule': 5,
+    },
+    'send-status-notifications': {
+        'task': 'ordering_service.tasks.send_status_notifications',
+        'schedule': 60,
+    },
+    'purge-outbox': {
+        'task': 'ordering_service.tasks.purge_outbox',
+        'schedule': 60 * 60,
+    },
+}
+
+# Goods import
+GOODS_IMPORT_BATCH_SIZE = 1000   # количество товаров в одной пачке при импорте
+GOODS_IMPORT_DIR = BASE_DIR / 'import_files'   # загруженные прайс-листы до обработки
+GOODS_IMPORT_BACKEND = 'bulk'   # 'bulk' - пакетный импорт через ORM, 'staged' - через промежуточные таблицы
+GOODS_IMPORT_STAGING_WORKERS = 1   # количество процессов для загрузки промежуточных таблиц (только PostgreSQL)
+GOODS_IMPORT_LOCK_TIMEOUT = 60 * 60   # через сколько секунд без продления снимается блокировка импорта магазина
+GOODS_IMPORT_LOCK_RETRY_DELAY = 10   # через сколько секунд повторить импорт, если магазин уже импортируется
+GOODS_IMPORT_MAX_ERRORS = 100   # сколько ошибок проверки прайс-листа сохранять в задаче импорта
+PRICE_LIST_PULL_CONCURRENCY = 8   # сколько прайс-листов магазинов загружается одновременно
+PRICE_LIST_PULL_TIMEOUT = 30   # таймаут загрузки прайс-листа по Shop.url, секунд
+PRICE_LIST_MAX_SIZE = 200 * 1024 * 1024   # наибольший размер прайс-листа, загружаемого по Shop.url, байт
+PRICE_LIST_ALLOW_PRIVATE_HOSTS = False   # разрешить Shop.url на внутренние адреса (только для разработки и тестов)
+
+# Cache
+# кэш каталога: в памяти процесса, а при заданном CATALOG_CACHE_URL (например, redis://127.0.0.1:6379/2) - в Redis
+# Счетчики версий (каталога, справочников и индекса параметров) хранятся в этом же кэше: чтобы импорт
+# в процессе Celery сбрасывал кэш веб-процессов, нужен общий кэш (Redis), кэш в памяти - только для разработки и тестов
+CATALOG_CACHE_URL = os.environ.get('CATALOG_CACHE_URL')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CATALOG_CACHE_URL,
+    } if CATALOG_CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+    },
+}
+CATALOG_CACHE_ALIAS = 'catalog'
+CATALOG_CACHE_TIMEOUT = 60 * 10   # сколько секунд хранится закэшированный ответ каталога
+
+# асинхронные представления для чтения каталога и заказов (включаются в orders/asgi.py)
+ASYNC_READ_VIEWS = os.environ.get('ASYNC_READ_VIEWS') == '1'
+
+STOCK_BUCKET_REFILL = 20   # сколько единиц горячего товара переносится за раз из карточки в ячейку остатка
+BEST_OFFERS_SIZE = 5   # сколько самых дешевых предложений товара хранится в индексе лучших предложений
 
 # For order status
 RECIPIENTS_EMAIL = ['manager@mysite.com']   # замените на свою почту
 DEFAULT_FROM_EMAIL = 'admin@mysite.com'  # замените на свою почту
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+NOTIFICATION_BATCH_SIZE = 100   # сколько писем отправляется за одно соединение с почтовым сервером
+NOTIFICATION_CLAIM_TIMEOUT = 600   # через сколько секунд захваченные, но не отправленные уведомления захватываются снова
+OUTBOX_BATCH_SIZE = 500   # сколько событий заказов передается в очередь одной задачей
+# сколько дней хранятся переданные события: на столько назад поток поставщика восстанавливает пропущенное
+OUTBOX_RETENTION_DAYS = 7
+
+# поток событий заказов для поставщиков (order/partner/events/): между процессами события передаются
+# через Redis при заданном ORDER_EVENTS_REDIS_URL (например, redis://127.0.0.1:6379/3), иначе - в процессе;
+# события публикует процесс Celery, поэтому без Redis поток работает только с CELERY_TASK_ALWAYS_EAGER
+ORDER_EVENTS_REDIS_URL = os.environ.get('ORDER_EVENTS_REDIS_URL')
+ORDER_EVENTS_HEARTBEAT = 15   # через сколько секунд без событий отправляется heartbeat
+ORDER_EVENTS_RETRY = 3   # через сколько секунд клиенту переподключаться после обрыва
+ORDER_EVENTS_QUEUE_SIZE = 1000   # сколько непрочитанных событий держится для одного соединения
 
 # Settings for drf_spectacular
 SPECTACULAR_SETTINGS = {